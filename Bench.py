@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import numpy as np
+import CirComp as Cir
+import CirGraph
+import Metrics
+import MNA
+import Transient
+import Parallel
+
+#Bench submodule measures how fast circuits are evaluated so that performance regressions in
+#CirComp, CirGraph, Metrics and the rest of the pipeline can be caught. It runs against FakeSpice by
+#default so it works anywhere (including CI machines without ltSpice) and gives the same numbers
+#every time for the same circuits.
+
+#The circuits are synthetic amplifiers made of 1 or more cascaded common emitter stages, so the
+#number of components and nodes grows with the number of stages. Every benchmark is run on
+#populations of increasing size and reports throughput (circuits per second) and latency
+#percentiles. Results can be saved as a baseline and later runs compared against it:
+
+#python Bench.py --save               (writes Benchmarks/baseline.json)
+#python Bench.py --compare            (exits with an error if anything got slower than the baseline allows)
+
+
+#simulator used by default
+FAKESPICE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "FakeSpice.py")
+
+#where baselines are stored by default
+BASELINE = os.path.join("Benchmarks", "baseline.json")
+
+#analyses run by the full fitness evaluation
+ANALYSES = [("tran", {"freq": 1000, "node": None}),
+            ("ac", {"node": None, "start": 10, "numStep": 100, "stop": 1e8}),
+            ("DCpow", {})]
+
+#every benchmark
+BENCHES = ["netlist", "DCpow", "ac", "tran", "combined", "fitness", "fitness.pool", "mna", "mna.tran"]
+
+
+#This function makes a synthetic amplifier with the given number of common emitter stages. N1 is
+#the supply, N5 the input and the first stage uses N2 (base), N3 (collector) and N4 (emitter) like
+#the example circuit in CirGraph. Each further stage is AC coupled to the collector of the one
+#before it. Component values are drawn around sensible defaults with rng so that every circuit in
+#a population is different. Returns the circuit and the name of its output node.
+
+def amplifier(ID, stages = 1, rng = np.random):
+
+    jitter = lambda val: float(val*np.exp(rng.normal(0, 0.1)))
+
+    cir = CirGraph.Circuit(ID, [], set())
+    cir.addComp(Cir.Component("Vsource", "V1", ["N1", "0"], [10.0]))
+
+    prev = "N5"
+    for stage in range(stages):
+
+        if stage == 0:
+            base, coll, emit = "N2", "N3", "N4"
+        else:
+            base, coll, emit = ["N" + str(3*stage + index + 3) for index in range(3)]
+
+        num = str(stage + 1)
+        cir.addComp(Cir.Component("Capacitor", "CC" + num, [prev, base], [jitter(1e-6)]))
+        cir.addComp(Cir.Component("Resistor", "RB" + num, ["N1", base], [jitter(6000)]))
+        cir.addComp(Cir.Component("Resistor", "RG" + num, [base, "0"], [jitter(1000)]))
+        cir.addComp(Cir.Component("NPN", "Q" + num, [coll, base, emit], []))
+        cir.addComp(Cir.Component("Resistor", "RC" + num, ["N1", coll], [jitter(2000)]))
+        cir.addComp(Cir.Component("Resistor", "RE" + num, [emit, "0"], [jitter(200)]))
+        cir.addComp(Cir.Component("Capacitor", "CE" + num, [emit, "0"], [jitter(10e-6)]))
+
+        prev = coll
+
+    return cir, prev
+
+
+#makes a population of size synthetic amplifiers with the same number of stages
+
+def population(size, stages, seed = 0):
+
+    rng = np.random.default_rng(seed)
+    circuits = [amplifier(index, stages, rng) for index in range(size)]
+
+    return [cir for cir, out in circuits], circuits[0][1]
+
+
+#turns a list of latencies (in seconds) into throughput and percentiles. total is the wall clock
+#time for the whole batch, which is longer than the sum of the latencies when things ran in parallel
+
+def stats(latencies, total = None, count = None):
+
+    latencies = np.asarray(latencies, dtype = float)
+    total = float(np.sum(latencies)) if total is None else total
+    count = len(latencies) if count is None else count
+
+    return {"count": count, "seconds": total, "throughput": count/total if total > 0 else float("inf"),
+            "mean": float(np.mean(latencies)), "p50": float(np.percentile(latencies, 50)),
+            "p90": float(np.percentile(latencies, 90)), "p99": float(np.percentile(latencies, 99)),
+            "max": float(np.max(latencies))}
+
+
+#times func on every item and returns the list of latencies
+
+def timeEach(func, items):
+
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - start)
+
+    return latencies
+
+
+#runs one benchmark on a population. out is the output node and workDir the folder to work in
+
+def bench(name, circuits, out, workDir, numWorkers = None):
+
+    analyses = [(kind, {key: (out if val is None else val) for key, val in args.items()}) for kind, args in ANALYSES]
+
+    match name:
+
+        case "netlist":
+            return stats(timeEach(lambda cir: cir.expNetList(workDir), circuits))
+
+        case "DCpow" | "ac" | "tran" | "combined":
+            for cir in circuits:
+                cir.expNetList(workDir)
+
+            args = {"DCpow": {}, "ac": analyses[1][1], "tran": analyses[0][1],
+                    "combined": {"freq": 1000, "node": out, "start": 10, "numStep": 100, "stop": 1e8}}[name]
+
+            return stats(timeEach(lambda cir: Parallel.ANALYSES[name](ID = cir.ID, workDir = workDir, **args), circuits))
+
+        case "fitness":
+            #export, every analysis and clean up, one circuit at a time
+            return stats(timeEach(lambda cir: Parallel.evalPopulation([cir], analyses, numWorkers = 1), circuits))
+
+        case "fitness.pool":
+            #the whole population through the worker pool. Only the wall clock time of the
+            #population is known so the latency is per population
+            start = time.perf_counter()
+            Parallel.evalPopulation(circuits, analyses, numWorkers)
+            total = time.perf_counter() - start
+            return stats([total], total, len(circuits))
+
+        case "mna":
+            start = time.perf_counter()
+            MNA.evalPopulation(circuits, out, 10, 100, 1e8)
+            total = time.perf_counter() - start
+            return stats([total], total, len(circuits))
+
+        case "mna.tran":
+            #the transient analysis with the native engine instead of the simulator
+            start = time.perf_counter()
+            Transient.evalPopulation(circuits, 1000, out)
+            total = time.perf_counter() - start
+            return stats([total], total, len(circuits))
+
+        case _:
+            raise ValueError("unknown benchmark " + name)
+
+
+#This function runs the benchmarks for every combination of number of stages and population size.
+#cmd is the simulator to use. Returns a dictionary mapping "bench/stages/size" to the stats of that run
+
+def run(stages = (1, 2, 4), sizes = (8, 32), benches = BENCHES, cmd = FAKESPICE, numWorkers = None):
+
+    old = Metrics.LTSPICE
+    Metrics.LTSPICE = cmd
+
+    #worker processes that don't inherit the module (spawn) pick the simulator up from here
+    oldEnv = os.environ.get("LTSPICE")
+    os.environ["LTSPICE"] = cmd
+
+    workDir = tempfile.mkdtemp(prefix = "AmpGABench")
+    results = dict()
+
+    try:
+        for numStages in stages:
+            for size in sizes:
+                circuits, out = population(size, numStages, seed = 1000*numStages + size)
+                for name in benches:
+                    results[name + "/" + str(numStages) + "/" + str(size)] = bench(name, circuits, out, workDir, numWorkers)
+    finally:
+        shutil.rmtree(workDir, ignore_errors = True)
+        Metrics.LTSPICE = old
+        if oldEnv is None:
+            os.environ.pop("LTSPICE", None)
+        else:
+            os.environ["LTSPICE"] = oldEnv
+
+    return results
+
+
+#writes results to path along with a description of the machine they were measured on
+
+def save(results, path = BASELINE):
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+
+    f = open(path, "w")
+    json.dump({"machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+               "results": results}, f, indent = 1, sort_keys = True)
+    f.close()
+
+
+def load(path = BASELINE):
+
+    f = open(path, "r")
+    baseline = json.load(f)
+    f.close()
+
+    return baseline["results"]
+
+
+#compares results with a baseline. Returns a list of (key, ratio, regressed) tuples where ratio is
+#the new median latency over the baseline's and regressed is True when it's more than 1 + tolerance.
+#Benchmarks the baseline doesn't have (like the bigger sizes against a --quick baseline) get a ratio
+#of None so the report can say so
+
+def compare(results, baseline, tolerance = 0.25):
+
+    rows = []
+    for key in sorted(results):
+        if key in baseline and baseline[key]["p50"] > 0:
+            ratio = results[key]["p50"]/baseline[key]["p50"]
+            rows.append((key, ratio, ratio > 1 + tolerance))
+        else:
+            rows.append((key, None, False))
+
+    return rows
+
+
+def report(results, comparison = None):
+
+    ratios = dict() if comparison is None else {key: (ratio, regressed) for key, ratio, regressed in comparison}
+
+    lines = ["%-28s %8s %12s %10s %10s %10s" % ("benchmark/stages/size", "count", "circuits/s", "p50 ms", "p90 ms", "p99 ms")]
+    for key, stat in results.items():
+        line = "%-28s %8d %12.1f %10.3f %10.3f %10.3f" % (key, stat["count"], stat["throughput"], 1e3*stat["p50"], 1e3*stat["p90"], 1e3*stat["p99"])
+        if key in ratios and ratios[key][0] is None:
+            line += "  not in baseline"
+        elif key in ratios:
+            line += "  x%.2f%s" % (ratios[key][0], " REGRESSION" if ratios[key][1] else "")
+        lines.append(line)
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "benchmarks the circuit evaluation pipeline")
+    parser.add_argument("--quick", action = "store_true", help = "only the smallest circuits and population")
+    parser.add_argument("--bench", nargs = "+", default = BENCHES, choices = BENCHES)
+    parser.add_argument("--workers", type = int, default = None)
+    parser.add_argument("--cmd", default = os.environ.get("LTSPICE", FAKESPICE), help = "simulator to run")
+    parser.add_argument("--save", action = "store_true", help = "store the results as the baseline")
+    parser.add_argument("--compare", action = "store_true", help = "compare the results with the baseline")
+    parser.add_argument("--baseline", default = BASELINE)
+    parser.add_argument("--tolerance", type = float, default = 0.25)
+    options = parser.parse_args()
+
+    #say so up front rather than after the whole suite has run
+    if options.compare and not os.path.exists(options.baseline):
+        sys.exit("no baseline at " + options.baseline + " to compare with. Make one with --save")
+
+    stages, sizes = ((1,), (8,)) if options.quick else ((1, 2, 4), (8, 32))
+    results = run(stages, sizes, options.bench, options.cmd, options.workers)
+
+    comparison = compare(results, load(options.baseline), options.tolerance) if options.compare else None
+    print(report(results, comparison))
+
+    if options.save:
+        save(results, options.baseline)
+
+    if comparison is not None and any(regressed for key, ratio, regressed in comparison):
+        sys.exit(1)
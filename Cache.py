@@ -0,0 +1,139 @@
+import hashlib
+import json
+import math
+import sqlite3
+from collections import OrderedDict
+
+##########################################################FitnessCache Class##########################################################
+
+#The FitnessCache class remembers the measurements of circuits that have already been simulated.
+#Elitism, duplicate offspring and parameters that didn't get picked for mutation all produce circuits
+#identical to ones we've already simulated, so before simulating a circuit we look it up here first.
+
+#Circuits are looked up by a hash of their components. Two circuits get the same key if they have
+#the same components (kind, nodes and parameters) regardless of the names of the components or the
+#order they were added in. If tol is given, parameters are rounded to a relative tolerance of tol
+#before hashing so that circuits whose values differ by less than that share a key.
+
+####Class Attributes####
+
+##size: the largest number of entries kept in memory. Once it's full the least recently used entry is dropped
+
+##tol: relative tolerance parameters are rounded to before hashing (None means exact values)
+
+##memory: OrderedDict mapping keys to measurement dictionaries, ordered from least to most recently used
+
+##db: sqlite connection to the on disk store (None if the cache is only kept in memory)
+
+##hits: number of lookups answered from memory
+
+##diskHits: number of lookups answered from the on disk store
+
+##misses: number of lookups that weren't in the cache
+
+####Class Methods####
+
+##key: returns the key (a hex string) of a circuit. analysis can be anything that can be turned into
+#json (like the analyses list used by Parallel.evalPopulation) and is added to the key so that
+#different analyses of the same circuit don't collide
+
+##get: returns the measurements stored under a key or None if the key isn't in the cache
+
+##put: stores the measurements of a key in memory and on disk
+
+##stats: returns a dictionary with the hit and miss counts
+
+##close: closes the on disk store
+
+
+class FitnessCache:
+
+    def __init__(self, path = None, size = 4096, tol = None):
+
+        self.size = size
+        self.tol = tol
+        self.memory = OrderedDict()
+
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS fitness (key TEXT PRIMARY KEY, value TEXT)")
+            self.db.commit()
+
+    #rounds a parameter to the tolerance. With a relative tolerance the values are rounded in
+    #log space so that 1e-9 F and 1e4 Ohm are both rounded to the same number of significant steps.
+    #The bucket is kept next to the sign of the value (and not folded into it) so x and 1/x don't
+    #collide, and 0 (which mutation clips to) gets a bucket of its own
+    def quantize(self, val):
+
+        val = float(val)
+        if self.tol is None:
+            return val
+
+        if val == 0:
+            return (0, 0)
+
+        return (1 if val > 0 else -1, round(math.log(abs(val))/math.log1p(self.tol)))
+
+    def key(self, circuit, analysis = None):
+
+        comps = sorted([comp.kind, list(comp.nodes), [self.quantize(param) for param in comp.params]] for comp in circuit.components)
+
+        text = json.dumps([comps, analysis], sort_keys = True, default = str)
+
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, key):
+
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+
+        if self.db is not None:
+            row = self.db.execute("SELECT value FROM fitness WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.diskHits += 1
+                value = json.loads(row[0])
+                self.remember(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+
+        #numpy floats can't be turned into json so we convert everything into python floats first
+        value = {name: None if val is None else float(val) for name, val in value.items()}
+
+        self.remember(key, value)
+
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO fitness VALUES (?, ?)", (key, json.dumps(value)))
+            self.db.commit()
+
+    #adds an entry to the in memory LRU and drops the least recently used entry if it's full
+    def remember(self, key, value):
+
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+
+        while len(self.memory) > self.size:
+            self.memory.popitem(last = False)
+
+    def stats(self):
+
+        lookups = self.hits + self.diskHits + self.misses
+        rate = (self.hits + self.diskHits)/lookups if lookups > 0 else 0
+
+        return {"hits": self.hits, "diskHits": self.diskHits, "misses": self.misses, "hitRate": rate, "entries": len(self.memory)}
+
+    def close(self):
+
+        if self.db is not None:
+            self.db.close()
+            self.db = None
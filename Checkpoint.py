@@ -0,0 +1,234 @@
+import os
+import json
+import numpy as np
+import CirComp as Cir
+import CirGraph
+import Genome
+
+#Checkpoint submodule saves the state of a run so that it can be picked back up if it's killed,
+#and keeps a history of every evaluation for looking at afterwards.
+
+#A checkpoint is a single .npz file (gen{N}.npz) holding the parameter matrix of the population,
+#the topology of the template circuit, the fitness and metrics of every individual, the state of
+#the random number generator and any other arrays the caller wants to keep. Checkpoints are written
+#to a temporary file first and then renamed so a run killed halfway through a save never leaves a
+#broken checkpoint behind.
+
+#The history is an append only binary file with one fixed size record per evaluation (generation,
+#fitness, parameters and metrics). Records are only ever added onto the end, so writing one costs
+#the same no matter how long the run has been going, and the file can be memory mapped and streamed
+#a chunk at a time without loading it all.
+
+
+#returns the path of the checkpoint for generation gen
+
+def genPath(directory, gen):
+    return os.path.join(directory, "gen" + str(gen).zfill(8) + ".npz")
+
+
+#This function writes the checkpoint of generation gen into directory and returns its path.
+
+#genome: Genome holding the population
+#fitness: (population,) array of fitnesses
+#metrics: dictionary mapping metric names to (population,) arrays, or a list of measurement
+#dictionaries (one per individual) like the ones Parallel.evalPopulation returns
+#rng: numpy Generator whose state is saved. The old RandomState isn't supported since load always
+#rebuilds a Generator
+#extra: any other arrays to keep (like born in GA.SteadyState)
+
+def save(directory, gen, genome, fitness, metrics = None, rng = None, **extra):
+
+    if rng is not None and not isinstance(rng, np.random.Generator):
+        raise ValueError("only a numpy Generator can be checkpointed")
+
+    os.makedirs(directory, exist_ok = True)
+
+    arrays = {"gen": np.array(gen), "params": genome.params, "fitness": np.asarray(fitness, dtype = float),
+              "topology": np.array(json.dumps(topology(genome.template)))}
+
+    if isinstance(metrics, list):
+        keys = sorted(set(key for m in metrics for key in m))
+        metrics = {key: [m.get(key) for m in metrics] for key in keys}
+
+    for key, vals in (metrics or dict()).items():
+        arrays["metric:" + key] = np.array([np.nan if val is None else val for val in vals], dtype = float)
+
+    if rng is not None:
+        arrays["rng"] = np.array(json.dumps(rng.bit_generator.state))
+
+    for key, val in extra.items():
+        arrays["extra:" + key] = np.asarray(val)
+
+    path = genPath(directory, gen)
+
+    f = open(path + ".tmp", "wb")
+    np.savez(f, **arrays)
+    f.close()
+    os.replace(path + ".tmp", path)
+
+    return path
+
+
+#returns the topology of a template circuit as it's stored in a checkpoint: the kind, name, nodes and
+#number of parameters of every component and the sorted node names. Two templates with the same
+#topology give the same circuits for the same parameter matrix
+
+def topology(template):
+    return {"components": [[comp.kind, comp.name, list(comp.nodes), len(comp.params)] for comp in template.components],
+            "nodes": sorted(template.nodes)}
+
+
+#returns the path of the newest checkpoint in directory (None if there aren't any)
+
+def latest(directory):
+
+    if not os.path.isdir(directory):
+        return None
+
+    names = sorted(name for name in os.listdir(directory) if name.startswith("gen") and name.endswith(".npz"))
+
+    return os.path.join(directory, names[-1]) if len(names) > 0 else None
+
+
+#deletes all but the newest keep checkpoints in directory
+
+def prune(directory, keep = 3):
+
+    names = sorted(name for name in os.listdir(directory) if name.startswith("gen") and name.endswith(".npz"))
+
+    for name in names[:max(len(names) - keep, 0)]:
+        os.remove(os.path.join(directory, name))
+
+
+#This function reads a checkpoint back in. path can be a checkpoint file or a directory, in which
+#case its newest checkpoint is read. Returns a dictionary holding gen, genome (a Genome rebuilt from
+#the saved topology), topology (see topology), fitness, metrics (dictionary of arrays), rng (a
+#Generator with the saved state, or None) and extra (dictionary of the extra arrays).
+
+def load(path):
+
+    if os.path.isdir(path):
+        path = latest(path)
+        if path is None:
+            raise ValueError("no checkpoints to load")
+
+    data = np.load(path, allow_pickle = False)
+
+    topology = json.loads(str(data["topology"]))
+    comps = [Cir.Component(kind, name, nodes, [0.0]*num) for kind, name, nodes, num in topology["components"]]
+    template = CirGraph.Circuit("template", comps, set(topology["nodes"]))
+
+    rng = None
+    if "rng" in data.files:
+        state = json.loads(str(data["rng"]))
+        rng = np.random.Generator(getattr(np.random, state["bit_generator"])())
+        rng.bit_generator.state = state
+
+    checkpoint = {"gen": int(data["gen"]), "genome": Genome.Genome(template, data["params"]), "topology": topology,
+                  "fitness": data["fitness"],
+                  "metrics": {name[7:]: data[name] for name in data.files if name.startswith("metric:")},
+                  "rng": rng, "extra": {name[6:]: data[name] for name in data.files if name.startswith("extra:")}}
+
+    data.close()
+
+    return checkpoint
+
+
+##########################################################History Class##########################################################
+
+#The History class is the append only log of every evaluation. The records live in path and the
+#layout of a record (number of parameters and names of the metrics) is kept next to it in path.json
+#so the file can be read back without knowing how it was written.
+
+####Class Attributes####
+
+##path: path of the binary file holding the records
+
+##numParams: number of parameters in a record
+
+##keys: names of the metrics in a record
+
+##dtype: numpy structured dtype of a record with fields gen, fitness, params and metrics
+
+####Class Methods####
+
+##append: adds records onto the end of the file
+
+##read: returns a read only memory map of every record
+
+##stream: yields the records chunk records at a time
+
+
+class History:
+
+    def __init__(self, path, numParams = None, keys = ()):
+
+        if os.path.exists(path + ".json"):
+            f = open(path + ".json", "r")
+            layout = json.load(f)
+            f.close()
+
+            if numParams is not None and (layout["numParams"] != numParams or layout["keys"] != list(keys)):
+                raise ValueError("history at " + path + " has a different layout")
+
+        elif numParams is None:
+            raise ValueError("numParams is needed to make a new history")
+
+        else:
+            layout = {"numParams": numParams, "keys": list(keys)}
+            f = open(path + ".json", "w")
+            json.dump(layout, f)
+            f.close()
+
+        self.path = path
+        self.numParams = layout["numParams"]
+        self.keys = layout["keys"]
+        self.dtype = np.dtype([("gen", np.int64), ("fitness", np.float64), ("params", np.float64, (self.numParams,)),
+                               ("metrics", np.float64, (len(self.keys),))])
+
+        #a run killed in the middle of a write can leave part of a record at the end which we drop
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+            if size % self.dtype.itemsize != 0:
+                os.truncate(path, size - size % self.dtype.itemsize)
+
+    def __len__(self):
+        return os.path.getsize(self.path)//self.dtype.itemsize if os.path.exists(self.path) else 0
+
+    #params is a (num, numParams) array, fitness a (num,) array and metrics either a dictionary of
+    #(num,) arrays or a list of measurement dictionaries. Metrics that are missing are stored as nan
+    def append(self, gen, params, fitness, metrics = None):
+
+        params = np.atleast_2d(np.asarray(params, dtype = float))
+
+        records = np.zeros(len(params), dtype = self.dtype)
+        records["gen"] = gen
+        records["fitness"] = fitness
+        records["params"] = params
+        records["metrics"] = np.nan
+
+        if isinstance(metrics, list):
+            for col, key in enumerate(self.keys):
+                records["metrics"][:, col] = [np.nan if m.get(key) is None else m[key] for m in metrics]
+        elif metrics is not None:
+            for col, key in enumerate(self.keys):
+                if key in metrics:
+                    records["metrics"][:, col] = metrics[key]
+
+        f = open(self.path, "ab")
+        f.write(records.tobytes())
+        f.close()
+
+    def read(self):
+
+        if len(self) == 0:
+            return np.zeros(0, dtype = self.dtype)
+
+        return np.memmap(self.path, dtype = self.dtype, mode = "r", shape = (len(self),))
+
+    def stream(self, chunk = 65536):
+
+        records = self.read()
+
+        for start in range(0, len(records), chunk):
+            yield np.array(records[start:start + chunk])
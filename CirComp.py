@@ -53,6 +53,9 @@ DIODE_MODEL = "1N4148"
 
 class Component:
 
+    #components don't get a __dict__ so that a population of them (and the views in Genome) stay small
+    __slots__ = ("kind", "name", "nodes", "params")
+
     def __init__(self, kind, name, nodes, params):
         
         self.kind = kind
@@ -157,7 +160,7 @@ class Component:
 
         #for diodes, bjts, and mosfets we also have to specify the model that we're using
         if self.kind == "Diode":
-            return self.kind[0] + output + DIODE_MODEL
+            return self.kind[0] + output + " " + DIODE_MODEL
 
         if self.kind == "Vsource":
             return self.kind[0] + output + " dc " + str(self.params[0])
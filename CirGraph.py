@@ -1,6 +1,77 @@
 import CirComp as Cir
 import Metrics
+import NetList
 import os
+import Instrument
+
+##########################################################NodeSets Class##########################################################
+
+#The NodeSets class is a union-find (disjoint set) structure over node names. Every node starts out in a set by
+#itself and union joins two sets together. find returns the name of the set a node is in (its root) and squashes
+#the path it took to get there so that later calls are close to constant time.
+
+####Class Attributes####
+
+##parent: (dict) maps a node to the node above it in its set. Nodes that aren't in it are roots of their own set
+
+####Class Methods####
+
+##find: returns the root of the set holding node
+
+##union: joins the sets holding a and b and returns the new root. sizeA and sizeB are the sizes (like the number
+#of pins) used to decide which root survives. Ground ("0") always survives.
+
+##reset: makes node a set by itself again (for a name that was merged away and is being used for a new node).
+#Nodes that were merged into it stay with its old root
+
+
+class NodeSets:
+
+    def __init__(self):
+        self.parent = dict()
+
+    def find(self, node):
+
+        root = node
+        while root in self.parent:
+            root = self.parent[root]
+
+        #point everything on the path straight at the root
+        while node != root:
+            above = self.parent[node]
+            self.parent[node] = root
+            node = above
+
+        return root
+
+    def union(self, a, b, sizeA = 1, sizeB = 1):
+
+        a = self.find(a)
+        b = self.find(b)
+
+        if a == b:
+            return a
+
+        #the bigger set (or ground) keeps its name
+        if b == "0" or (a != "0" and sizeB > sizeA):
+            a, b = b, a
+
+        self.parent[b] = a
+
+        return a
+
+    def reset(self, node):
+
+        if node not in self.parent:
+            return
+
+        root = self.find(node)
+        for other, above in self.parent.items():
+            if above == node:
+                self.parent[other] = root
+
+        del self.parent[node]
+
 
 ##########################################################Circuit Class##########################################################
 
@@ -9,11 +80,19 @@ import os
 ##ID: (string) a unique identifier for the circuit used to locate its corresponding folder in the NetLists directory
 ##components: (list) a list of Component objects holding all of the components used in the circuit
 ##nodes: (set) a set of strings holding the names of all of the nodes in the circuit
+##pins: (dict) maps the name of each node to the set of (component, pin number) pairs connected to it. It's kept
+#up to date by addComp, delComp and rewire so that none of them have to go through every component
+##merged: (NodeSets) union-find structure that remembers which nodes have been merged together by delComp
+
+#A circuit takes ownership of the Component objects it's given: addComp, delComp, rewire and merge change
+#their nodes in place. Pass in copies of components that are still used somewhere else. Every component's
+#node list is copied when it's added so lists shared between components aren't edited through each other
 
 ####Class Methods####
 
 ##expNetList: This function exports the circuit into a netlist file (Circuit{ID}.cir) in
-#the corresponding folder whose relative path is NetLists/Circuit{ID}.
+#the corresponding folder whose relative path is NetLists/Circuit{ID}. The optional workDir
+#argument replaces NetLists with another folder (used by the parallel evaluator).
 
 ##fitness: This function assigns a fitness score (FoM) to the circuit by calling on the Metrics submodule
 #to produce the relevant measurements for the circuit. Takes in a fitFunc to calculate the fitness score
@@ -28,16 +107,26 @@ import os
 #and if there are any new nodes, it will add those to nodes
 
 ##delComp: This function deletes a component from the circuit given by the component's index in the component list.
-#It's currently a work in progress. I'm pretty sure
-#that what I have currently works for deleting two terminal devices but I'm not sure if it does for transistors.
 #The idea is that a component is removed from a circuit either by just taking it out and creating an open circuit
-#or by shorting it and replacing it with wire. If component connects to a node that isn't used by any other component
-#then that component created a node. If we just took out the component, we would likely have a floating node. So instead
-#we replace the component with a wire so that the nodes that the component joins become one node. If a component doesn't
-#create a node then we don't have to worry about this problem and we can just make an open circuit. In fact, making a short
+#or by shorting it and replacing it with wire. If taking out the component would leave one of its nodes with only
+#a single other pin connected to it, that pin would be left floating. So instead we replace the component with a
+#wire so that the nodes that the component joins become one node. If a component doesn't leave a floating node
+#then we don't have to worry about this problem and we can just make an open circuit. In fact, making a short
 #here would be problematic since then if we had another component connecting these two nodes, it would also be effectively
-#removed from the circuit since no current would flow through it. With three terminal devices it gets tricky since
-#you can't really short a device like that. Maybe you can think of it as 2 two terminal devices?
+#removed from the circuit since no current would flow through it. Three terminal devices are treated like 2 two
+#terminal devices: each node that would be left floating is joined to one of the device's other nodes (one that
+#isn't being left floating if there is one).
+
+##rewire: This function moves pin number pin of a component to another node
+
+##find: returns the name a node goes by now. Once a node has been merged into another one by delComp, find
+#returns the name of the node it was merged into
+
+##degree: returns the number of pins connected to a node
+
+##floating: returns the list of nodes (other than ground) that have fewer than two pins connected to them
+
+##connected: returns True if every node can be reached from ground by going through components
 
 ##__str__(): This function overrides the default __str__() function
 
@@ -47,33 +136,26 @@ class Circuit:
     def __init__(self, ID, components, nodes):
 
         self.ID = ID
-        self.components = components
+        self.components = []
         self.nodes = nodes
+        self.pins = dict()
+        self.merged = NodeSets()
 
+        for comp in components:
+            self.addComp(comp)
 
-    def expNetList(self):
-        file = "Circuit" + str(self.ID)
-
-        if not os.path.exists("NetLists/" + file):
-            os.makedirs("NetLists/" + file)
-        f = open("NetLists/" + file + "/" + file + ".cir", "w")
-        f.write("*Circuit # " + str(self.ID) + "\n\n")
 
-        #add in model definitions
-        f.write("*MODEL DEFINITIONS\n")
-        f.write(".model 2N2222 NPN(IS = 1E-14 VAF = 100 BF = 200 IKF = 0.3 XTB = 1.5 BR = 3 CJC = 8E-12 CJE = 25E-12 TR=100E-9 TF=400E-12 ITF=1 VTF = 2 XTF=3 RB=10 RC=.3 RE=.2 Vceo=30 lcrating=800m mfg=N)\n")
-        f.write(".model 1N4148 D(Is=2.52n Rs=.568 N=1.752 Cjo=4p M=.4 tt=20n lave=200m Vpk=75 mfg=OnSemi type=silicon\n")
-
-        f.write(".model 2N3906 PNP(Is=1E-14 VAF=100 BF=200 IKF=0.4 XTB=1.5 BR=4 CJC=4.5E-12 CJE=10E-12 RB=20 RC=0.1 RE=0.1 TR=250E-9 TF=350E-12 ITF=1 VTF=2 XTF=3 Vceo=40 lcrating=200m mfg=NXP\n")
+    def expNetList(self, workDir = "NetLists"):
+        file = "Circuit" + str(self.ID)
 
-        
-        f.write("*NETLIST DESCRIPTION\n")
+        if not os.path.exists(workDir + "/" + file):
+            os.makedirs(workDir + "/" + file)
 
-        #iterate through list of components and call on netList function to get their corresponding line
-        for component in self.components:
-            f.write(component.netList() + "\n")
-
-        f.close()
+        #the whole netlist is rendered in memory (see NetList) and written out in one go
+        with Instrument.timer("netlist"):
+            f = open(workDir + "/" + file + "/" + file + ".cir", "w")
+            f.write(NetList.render(self))
+            f.close()
 
 
     
@@ -81,57 +163,117 @@ class Circuit:
 
         #to mutate component values, we just iterate through the list of components
         #and call on their mutate function
-        for component in components:
+        for component in self.components:
             component.mutate(factor, pm)
     
     
     def addComp(self, comp):
 
+        comp.nodes = list(comp.nodes)
         self.components.append(comp)
-        for node in comp.nodes:
-            self.nodes.add(node)
+        for pin in range(len(comp.nodes)):
+            self.connect(comp, pin, comp.nodes[pin])
     
     def delComp(self, index):
 
-        #to see if we need to short or open the component we make a dictionary keeping the count
-        #of each of the nodes in the component
-        numNodes = dict(zip(self.components[index].nodes, [0 for node in self.components[index].nodes]))
-        
+        comp = self.components[index]
+
+        #unhook the component from its nodes. Anything left with a single pin would be floating
+        for pin in range(len(comp.nodes)):
+            self.disconnect(comp, pin)
+
+        floating = [node for node in dict.fromkeys(comp.nodes) if node != "0" and self.degree(node) == 1]
+
+        #if the component defined a node, we need to replace the component with a short
+        for node in floating:
+
+            #join the node to another one of the component's nodes, preferring one that isn't floating
+            others = [other for other in comp.nodes if self.find(other) != self.find(node)]
+            if len(others) == 0:
+                continue
+            solid = [other for other in others if other not in floating]
+            target = solid[0] if len(solid) > 0 else others[0]
+
+            self.merge(self.find(node), self.find(target))
+
+        #nodes with nothing connected to them anymore are gone
+        for node in comp.nodes:
+            if node in self.pins and len(self.pins[node]) == 0:
+                del self.pins[node]
+                self.nodes.discard(node)
 
-        #for each component
-        for component in self.components:
-            #iterate through the nodes it connects to
-            for node in component.nodes:
-                #if this component and the component to be deleted share a node
-                #we add it to the corresponding count
-                if node in numNodes:
-                    numNodes[node] += 1
-        #if the component to be deleted defined a node, we need to replace the component with a short
-                    
-        if sum([1 if val > 2 else 0 for val in numNodes.values()]) < 2*len(numNodes):
-
-            #for each component in the circuit
-            for idx in range(len(self.components)):
-                #if this component is the same as the one to be deleted, we move on to the next component
-                if idx == index:
-                    continue
-
-                #for each node
-                for ndx in range(len(self.components[idx].nodes)):
-
-                    #if the component and the component to be deleted share the node connected to the anode of the component to be deleted
-                    if self.component[idx].nodes[ndx] == self.components[index].nodes[1]:
-                        #set that node to be the node connected to the cathode of that anode. This is really similar
-                        #to deleting a node in a linked list. We're removing all references to the node that's being deleted
-                        self.component[idx].nodes[ndx] = self.components[index].nodes[0]
-
-                #after we do that we remove that node from node list
-                self.nodes.remove(self.components[index].nodes[1])
-
-        #and if the component doesn't define a node, we can just remove it from the list. We also have to do this
-        #if it does define a node.
         self.components.pop(index)
 
+    def rewire(self, comp, pin, node):
+
+        self.disconnect(comp, pin)
+
+        old = comp.nodes[pin]
+        if old in self.pins and len(self.pins[old]) == 0:
+            del self.pins[old]
+            self.nodes.discard(old)
+
+        self.connect(comp, pin, self.find(node))
+
+    #adds pin number pin of comp to the index of node. A name that was merged away earlier and shows up
+    #again is a new node, so it's taken back out of the union-find
+    def connect(self, comp, pin, node):
+
+        if node not in self.pins:
+            self.merged.reset(node)
+
+        comp.nodes[pin] = node
+        self.nodes.add(node)
+        self.pins.setdefault(node, set()).add((comp, pin))
+
+    #takes pin number pin of comp out of the index (but leaves comp.nodes alone)
+    def disconnect(self, comp, pin):
+        self.pins[comp.nodes[pin]].discard((comp, pin))
+
+    #merges node a and node b. The node with fewer pins is folded into the other one (unless it's
+    #ground, which always keeps its name) so only the pins of the smaller node have to be renamed
+    def merge(self, a, b):
+
+        root = self.merged.union(a, b, len(self.pins.get(a, ())), len(self.pins.get(b, ())))
+        gone = b if root == a else a
+
+        for comp, pin in list(self.pins.get(gone, ())):
+            comp.nodes[pin] = root
+            self.pins.setdefault(root, set()).add((comp, pin))
+
+        self.pins.pop(gone, None)
+        self.nodes.discard(gone)
+
+        return root
+
+    def find(self, node):
+        return self.merged.find(node)
+
+    def degree(self, node):
+        return len(self.pins.get(node, ()))
+
+    def floating(self):
+        return [node for node in self.pins if node != "0" and len(self.pins[node]) < 2]
+
+    def connected(self):
+
+        if len(self.pins) == 0:
+            return True
+
+        #walk from ground through every component that touches a node we've reached
+        start = "0" if "0" in self.pins else next(iter(self.pins))
+        seen = {start}
+        stack = [start]
+        while len(stack) > 0:
+            node = stack.pop()
+            for comp, pin in self.pins[node]:
+                for other in comp.nodes:
+                    if other not in seen:
+                        seen.add(other)
+                        stack.append(other)
+
+        return len(seen) == len(self.pins)
+
     
     def __str__(self):
         output = ""
@@ -139,15 +281,19 @@ class Circuit:
             output += component.__str__() + "\n"
         return output
 
-cir = Circuit("532", [], set())
-cir.addComp(Cir.Component("Vsource", "V1", ["N1", "0"], [10]))
-cir.addComp(Cir.Component("Resistor", "R1", ["N1", "N2"], [6000]))
-cir.addComp(Cir.Component("Resistor", "R2", ["N2", "0"], [500]))
-cir.addComp(Cir.Component("NPN", "Q1", ["N3", "N2", "N4"], []))
-cir.addComp(Cir.Component("Resistor", "R3", ["N4", "0"], [100]))
-cir.addComp(Cir.Component("Resistor", "R4", ["N1", "N3"], [100]))
-cir.addComp(Cir.Component("Capacitor", "C1", ["N5", "N2"], [1e-6]))
+#the example circuit is only built when this file is run directly so that importing
+#the module (for example from a worker process) doesn't write out a netlist
+
+if __name__ == "__main__":
+    cir = Circuit("532", [], set())
+    cir.addComp(Cir.Component("Vsource", "V1", ["N1", "0"], [10]))
+    cir.addComp(Cir.Component("Resistor", "R1", ["N1", "N2"], [6000]))
+    cir.addComp(Cir.Component("Resistor", "R2", ["N2", "0"], [500]))
+    cir.addComp(Cir.Component("NPN", "Q1", ["N3", "N2", "N4"], []))
+    cir.addComp(Cir.Component("Resistor", "R3", ["N4", "0"], [100]))
+    cir.addComp(Cir.Component("Resistor", "R4", ["N1", "N3"], [100]))
+    cir.addComp(Cir.Component("Capacitor", "C1", ["N5", "N2"], [1e-6]))
 
-cir.expNetList()
+    cir.expNetList()
             
             
@@ -0,0 +1,104 @@
+import numpy as np
+
+#Distortion submodule measures the output waveforms of a whole population at once. The waveforms
+#are passed in as a 2D array with one row per individual, and every measurement is computed for all
+#of the rows with array operations (and a single batched FFT) instead of looping over the samples.
+
+#The FFT based measurements assume the rows are sampled at equally spaced times that cover a whole
+#number of periods (cycles) of the input signal, with the sample at the end of the last period left
+#out. The waveforms made by Metrics.tran cover one period with both end points included so they're
+#passed in with endpoint = True and the last sample is dropped.
+
+
+#This function takes in the waveforms (population, samples) and returns a dictionary of arrays
+#(one value per row) holding:
+
+#gain: amplitude of the fundamental divided by inAmp, the amplitude of the input signal
+#p2p: peak to peak swing of the output
+#phase: phase of the fundamental (in degrees) relative to a sine wave starting at time 0
+#THD: total harmonic distortion, the RMS of the harmonics (up to numHarm) divided by the fundamental
+#SINAD: ratio (in dB) of the power of the fundamental to the power of everything else but DC
+
+def measure(waves, inAmp = 1e-3, cycles = 1, numHarm = 10, endpoint = False):
+
+    waves = np.atleast_2d(np.asarray(waves, dtype = float))
+
+    if endpoint:
+        waves = waves[:, :-1]
+
+    N = waves.shape[-1]
+
+    p2p = np.ptp(waves, axis = -1)
+
+    #one FFT for the whole population. Scaling by 2/N turns each bin into the amplitude
+    #of the sine wave at that frequency
+    spectrum = np.fft.rfft(waves, axis = -1)
+    amps = 2*np.abs(spectrum)/N
+
+    fund = amps[:, cycles]
+
+    #a sine wave has an FFT phase of -90 degrees so we shift by 90 degrees
+    phase = (np.angle(spectrum[:, cycles], deg = True) + 90 + 180) % 360 - 180
+
+    #power in each bin. The bin at nyquist (for even N) isn't mirrored like the others so
+    #it only holds half as much power as its doubled amplitude would suggest
+    power = amps**2/2
+    if N % 2 == 0:
+        power[:, -1] = power[:, -1]/2
+
+    #harmonics that fit below the nyquist frequency
+    harm = cycles*np.arange(2, numHarm + 1)
+    harm = harm[harm < amps.shape[-1]]
+
+    harmRMS = np.sqrt(2*np.sum(power[:, harm], axis = -1))
+    thd = harmRMS/np.where(fund > 0, fund, np.nan)
+
+    #power of everything other than DC and the fundamental
+    noise = np.sum(power[:, 1:], axis = -1) - power[:, cycles]
+    sinad = 10*np.log10(power[:, cycles]/np.maximum(noise, 1e-300))
+
+    return {"gain": fund/inAmp, "p2p": p2p, "phase": phase, "THD": thd, "SINAD": sinad}
+
+
+#This function is the vectorized version of the distortion measurement that Metrics.tran has always
+#used. For every row it centers the waveform on 0, finds the first time the waveform crosses 0 and lines
+#up an ideal sine wave with the same peak to peak swing so that it crosses 0 at the same time and in
+#the same direction. The distortion is the sum of the distances between the waveform and that sine
+#wave divided by the peak to peak swing. times holds the times of the samples (shared by every row)
+#and freq is the frequency of the input.
+
+#Returns the arrays of peak to peak swings and distortions
+
+def sineFit(waves, times, freq):
+
+    waves = np.atleast_2d(np.asarray(waves, dtype = float))
+    times = np.asarray(times, dtype = float)
+
+    #the ideal sine wave swings p2p/2 either side of 0, so the waveform is centered on the middle of
+    #its swing. The mean would be off whenever the samples don't cover exactly whole periods (and
+    #Metrics.waveStats drops the last two)
+    p2p = np.ptp(waves, axis = -1)
+    waves = waves - (np.max(waves, axis = -1, keepdims = True) - 0.5*p2p[:, None])
+
+    #first place where consecutive samples are on opposite sides of 0 (a sample that lands right on
+    #0 counts as above it). If there isn't one the phase is 0
+    above = waves >= 0
+    cross = above[:, :-1] != above[:, 1:]
+    found = np.any(cross, axis = -1)
+    first = np.argmax(cross, axis = -1)
+
+    #the time of the crossing is interpolated between the two samples around it
+    rows = np.arange(len(waves))
+    before = waves[rows, first]
+    after = waves[rows, np.minimum(first + 1, waves.shape[-1] - 1)]
+    step = times[np.minimum(first + 1, len(times) - 1)] - times[first]
+    t0 = times[first] + step*before/np.where(found, before - after, 1)
+
+    #sin(w*(t - t0)) rises through 0 at t0, a falling crossing (like the output of an
+    #inverting amplifier) needs another half period
+    phase = np.where(found, -t0*freq*2*np.pi + np.where(after < before, np.pi, 0), 0)
+
+    ideal = 0.5*p2p[:, None]*np.sin(times[None, :]*freq*2*np.pi + phase[:, None])
+    distortion = np.sum(np.abs(waves - ideal), axis = -1)/p2p
+
+    return p2p, distortion
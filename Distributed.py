@@ -0,0 +1,425 @@
+import os
+import sys
+import time
+import uuid
+import socket
+import shutil
+import tempfile
+import threading
+import collections
+import multiprocessing as mp
+from multiprocessing.managers import BaseManager
+import CirComp as Cir
+import CirGraph
+import Parallel
+
+#Distributed submodule spreads the evaluation of a population over worker processes on any number
+#of machines. The coordinator holds a Board (shared with the workers over TCP with
+#multiprocessing.managers) that the circuits to evaluate are put on. Workers connect to it, take a
+#batch of tasks at a time, run the Metrics analyses on them exactly like Parallel does, and send each
+#result back as soon as it's done.
+
+#Circuits are sent as compact tuples (see pack) instead of pickled Circuit objects. Every worker sends
+#a heartbeat every few seconds. If a worker stops sending them (because it died or its machine went
+#away) the tasks it was holding are put back at the front of the queue for another worker. Results
+#that show up for a task that was already finished elsewhere are ignored. The coordinator only lets
+#maxPending tasks wait on the board at a time so a huge population doesn't all sit in memory at once.
+
+#To run it start a Coordinator and call evaluate, then start workers on each machine with
+#python Distributed.py worker <host> <port> <authkey> [numProcesses]
+#or, on the same machine, with startWorkers.
+
+#Anyone who can connect to the board and knows the authkey can send it pickles, which can run code
+#on the coordinator. The coordinator only listens on 127.0.0.1 unless it's given another address and
+#there's no default authkey, so pick a long random one (os.urandom) before serving on a network.
+
+
+#turns a circuit into a compact task message: (ID, ((kind, name, nodes, params), ...))
+
+def pack(circuit):
+    return (circuit.ID, tuple((comp.kind, comp.name, tuple(comp.nodes), tuple(float(param) for param in comp.params)) for comp in circuit.components))
+
+
+#turns a task message back into a Circuit
+
+def unpack(message):
+
+    ID, comps = message
+    comps = [Cir.Component(kind, name, list(nodes), list(params)) for kind, name, nodes, params in comps]
+
+    return CirGraph.Circuit(ID, comps, set(node for comp in comps for node in comp.nodes))
+
+
+##########################################################Board Class##########################################################
+
+#The Board class lives in the coordinator process and is where tasks wait to be taken by workers.
+#Workers call take, finish and beat through a proxy.
+
+####Class Attributes####
+
+##pending: deque of (taskID, analyses, message) tasks that haven't been handed out
+
+##leased: dictionary mapping the taskID of every handed out task to (worker, task)
+
+##results: dictionary mapping taskIDs to the measurements sent back for them
+
+##workers: dictionary mapping the name of each worker to the time of its last heartbeat
+
+##requeued: number of tasks that were put back because their worker died
+
+##cancelled: set of the taskIDs of tasks given up on. They're never handed out and their results are dropped
+
+##stopped: True once the coordinator shuts down. Workers exit when they see it
+
+####Class Methods####
+
+##submit: (coordinator) adds tasks, waiting while the board is full
+
+##take: (worker) hands out up to num tasks. Waits up to wait seconds for some to show up
+
+##finish: (worker) sends back the measurements of a task
+
+##beat: (worker) heartbeat
+
+##reap: (coordinator) requeues the tasks of workers that haven't sent a heartbeat in timeout seconds
+
+##collect: (coordinator) waits for results and returns the ones that are done
+
+##cancel: (coordinator) gives up on tasks
+
+##live: (coordinator) number of workers that haven't been reaped
+
+
+class Board:
+
+    def __init__(self, maxPending = 256):
+
+        self.maxPending = maxPending
+        self.pending = collections.deque()
+        self.leased = dict()
+        self.results = dict()
+        self.workers = dict()
+        self.requeued = 0
+        self.cancelled = set()
+        self.stopped = False
+        self.lock = threading.Condition()
+
+    def submit(self, tasks):
+
+        for task in tasks:
+            with self.lock:
+                while len(self.pending) >= self.maxPending and not self.stopped and task[0] not in self.cancelled:
+                    self.lock.wait(1)
+                if task[0] not in self.cancelled:
+                    self.pending.append(task)
+                self.lock.notify_all()
+
+    def take(self, worker, num = 1, wait = 1.0):
+
+        with self.lock:
+
+            self.workers[worker] = time.time()
+
+            if self.stopped:
+                return None
+
+            if len(self.pending) == 0:
+                self.lock.wait(wait)
+
+            batch = []
+            while len(self.pending) > 0 and len(batch) < num:
+                task = self.pending.popleft()
+                self.leased[task[0]] = (worker, task)
+                batch.append(task)
+
+            #there's room on the board again
+            self.lock.notify_all()
+
+            return batch
+
+    def finish(self, worker, taskID, measurements):
+
+        with self.lock:
+
+            self.workers[worker] = time.time()
+
+            lease = self.leased.get(taskID)
+            if lease is not None and lease[0] == worker:
+                del self.leased[taskID]
+
+            #a task that was requeued can be finished twice. The first result wins
+            if taskID not in self.results and taskID not in self.cancelled:
+                self.results[taskID] = measurements
+
+                #if it's still waiting on the board (it was requeued) there's no need to run it again
+                if lease is None or lease[0] != worker:
+                    self.leased.pop(taskID, None)
+                    self.pending = collections.deque(task for task in self.pending if task[0] != taskID)
+
+            self.lock.notify_all()
+
+    def beat(self, worker):
+        with self.lock:
+            self.workers[worker] = time.time()
+        return not self.stopped
+
+    def reap(self, timeout):
+
+        with self.lock:
+
+            now = time.time()
+            dead = [worker for worker, last in self.workers.items() if now - last > timeout]
+
+            for worker in dead:
+                del self.workers[worker]
+
+            lost = [taskID for taskID, (worker, task) in self.leased.items() if worker in dead]
+            for taskID in lost:
+                worker, task = self.leased.pop(taskID)
+                if taskID not in self.results:
+                    self.pending.appendleft(task)
+                    self.requeued += 1
+
+            if len(lost) > 0:
+                self.lock.notify_all()
+
+            return dead
+
+    def collect(self, taskIDs, wait = 1.0):
+
+        with self.lock:
+
+            done = {taskID: self.results.pop(taskID) for taskID in taskIDs if taskID in self.results}
+            if len(done) == 0:
+                self.lock.wait(wait)
+                done = {taskID: self.results.pop(taskID) for taskID in taskIDs if taskID in self.results}
+
+            return done
+
+    def cancel(self, taskIDs):
+
+        with self.lock:
+
+            self.cancelled.update(taskIDs)
+            self.pending = collections.deque(task for task in self.pending if task[0] not in self.cancelled)
+            for taskID in taskIDs:
+                self.leased.pop(taskID, None)
+                self.results.pop(taskID, None)
+
+            self.lock.notify_all()
+
+    def live(self):
+        with self.lock:
+            return len(self.workers)
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.lock.notify_all()
+
+    def stats(self):
+        with self.lock:
+            return {"pending": len(self.pending), "leased": len(self.leased), "workers": len(self.workers), "requeued": self.requeued}
+
+
+#the manager the board is shared through. The coordinator registers the board it made and workers
+#register the name without a callable to get a proxy to it
+
+class BoardManager(BaseManager):
+    pass
+
+
+##########################################################Coordinator Class##########################################################
+
+####Class Attributes####
+
+##address: (host, port) the board is served on. Port 0 picks a free port (see address after start). Only
+#127.0.0.1 by default, so workers on other machines need the coordinator to be given a public host
+
+##authkey: key workers need to connect (bytes). It has to be given, there's no default
+
+##board: the Board
+
+##timeout: seconds without a heartbeat after which a worker is treated as dead
+
+##waitWorkers: seconds evaluate carries on with no live workers (because none connected yet or they all
+#died) before it gives up and raises a TimeoutError
+
+####Class Methods####
+
+##start: starts serving the board in a background thread
+
+##evaluate: evaluates a population on the workers. Same arguments and return value as Parallel.evalPopulation
+#(without numWorkers and chunkSize)
+
+##close: tells the workers to exit and stops serving the board
+
+
+class Coordinator:
+
+    def __init__(self, authkey, address = ("127.0.0.1", 50000), maxPending = 256, timeout = 20.0, waitWorkers = 60.0):
+
+        if not isinstance(authkey, bytes) or len(authkey) == 0:
+            raise ValueError("authkey should be a non empty bytes string")
+
+        self.address = address
+        self.authkey = authkey
+        self.board = Board(maxPending)
+        self.timeout = timeout
+        self.waitWorkers = waitWorkers
+        self.server = None
+
+    def start(self):
+
+        board = self.board
+        BoardManager.register("board", callable = lambda: board)
+
+        manager = BoardManager(self.address, self.authkey)
+        self.server = manager.get_server()
+        self.address = self.server.address
+
+        thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        thread.start()
+
+        return self
+
+    def evaluate(self, circuits, analyses, cache = None):
+
+        results = [None]*len(circuits)
+
+        keys = [None]*len(circuits)
+        if cache is not None:
+            for index in range(len(circuits)):
+                keys[index] = cache.key(circuits[index], analyses)
+                results[index] = cache.get(keys[index])
+
+        #every task gets an ID that's unique across calls so late results from an old call can't be mixed in
+        run = uuid.uuid4().hex[:8]
+        todo = {run + str(index): index for index in range(len(circuits)) if results[index] is None}
+
+        #the tasks are added from a separate thread since submit waits while the board is full,
+        #and we have to keep collecting results in the meantime
+        tasks = [(taskID, analyses, pack(circuits[index])) for taskID, index in todo.items()]
+        feeder = threading.Thread(target = self.board.submit, args = (tasks,), daemon = True)
+        feeder.start()
+
+        waiting = set(todo)
+        alive = time.time()
+        while len(waiting) > 0:
+
+            for taskID, measurements in self.board.collect(list(waiting)).items():
+                index = todo[taskID]
+                results[index] = measurements
+                waiting.discard(taskID)
+                if cache is not None and "failure" not in measurements:
+                    cache.put(keys[index], measurements)
+
+            self.board.reap(self.timeout)
+
+            #without any workers nothing will ever finish so we stop waiting after a while
+            if self.board.live() > 0:
+                alive = time.time()
+            elif len(waiting) > 0 and time.time() - alive > self.waitWorkers:
+                self.board.cancel(list(waiting))
+                feeder.join()
+                raise TimeoutError(str(len(waiting)) + " tasks left and no live workers for " + str(self.waitWorkers) + " seconds")
+
+        feeder.join()
+
+        return results
+
+    def close(self):
+
+        self.board.stop()
+
+        #give the workers a moment to see that we're stopping before the server goes away
+        time.sleep(0.5)
+        if self.server is not None:
+            self.server.stop_event.set()
+
+
+#This function is a worker. It connects to the board at address, then takes batch tasks at a time,
+#evaluates them and sends every result back as soon as it's ready until the coordinator stops.
+#A heartbeat is sent every beatEvery seconds from a separate thread so long simulations don't make
+#the worker look dead.
+
+def work(address, authkey, batch = 4, beatEvery = 5.0):
+
+    BoardManager.register("board")
+    manager = BoardManager(tuple(address), authkey)
+    manager.connect()
+    board = manager.board()
+
+    name = socket.gethostname() + ":" + str(os.getpid())
+
+    root = tempfile.mkdtemp(prefix = "AmpGAWorker")
+    Parallel.initWorker(root)
+
+    done = threading.Event()
+
+    def heartbeat():
+        #proxies keep a connection per thread so this thread gets its own
+        while not done.wait(beatEvery):
+            try:
+                if not board.beat(name):
+                    break
+            except (EOFError, ConnectionError):
+                break
+
+    beater = threading.Thread(target = heartbeat, daemon = True)
+    beater.start()
+
+    try:
+        while True:
+
+            try:
+                tasks = board.take(name, batch)
+            except (EOFError, ConnectionError):
+                break
+
+            if tasks is None:
+                break
+
+            for taskID, analyses, message in tasks:
+
+                try:
+                    measurements = Parallel.evalCircuit((unpack(message), analyses))
+                except Exception as error:
+                    measurements = {"failure": "error: " + str(error)}
+
+                try:
+                    board.finish(name, taskID, measurements)
+                except (EOFError, ConnectionError):
+                    return
+
+    finally:
+        done.set()
+        shutil.rmtree(root, ignore_errors = True)
+
+
+#starts num worker processes on this machine and returns them
+
+def startWorkers(address, authkey, num = None, batch = 4, beatEvery = 5.0):
+
+    num = os.cpu_count() if num is None else num
+
+    procs = []
+    for index in range(num):
+        proc = mp.Process(target = work, args = (address, authkey, batch, beatEvery), daemon = True)
+        proc.start()
+        procs.append(proc)
+
+    return procs
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 5 or sys.argv[1] != "worker":
+        sys.stderr.write("usage: python Distributed.py worker <host> <port> <authkey> [numProcesses]\n")
+        sys.exit(2)
+
+    address = (sys.argv[2], int(sys.argv[3]))
+    num = int(sys.argv[5]) if len(sys.argv) > 5 else None
+
+    for proc in startWorkers(address, sys.argv[4].encode(), num):
+        proc.join()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import numpy as np
+import CirComp as Cir
+import CirGraph
+import MNA
+
+#FakeSpice is a stand in for ltSpice used by the benchmarks (Bench) and on machines that don't have
+#ltSpice installed. It's run the same way (FakeSpice.py -b Circuit1.cir) so pointing Metrics.LTSPICE
+#(or the LTSPICE environment variable) at it is all it takes.
+
+#The deck is read back into a Circuit and simulated with the MNA engine, and the results are written
+#out in the same formats ltSpice uses: a UTF-16LE .log file with the operating point and .meas results
+#and binary .raw files. The transient waveform is the small signal response to the sine input on top
+#of the DC operating point, so it's a linear approximation, but the files have the same layout and
+#the same dependence on the component values as the real ones. Everything is deterministic.
+
+#The environment variable FAKESPICE_DELAY can be set to a number of seconds to sleep for each run so
+#that the overhead of the rest of the pipeline can be compared against a realistic simulator runtime.
+
+#MOSFETs aren't supported by MNA. Decks that hold them exit with an error like a crashed ltSpice.
+
+
+#kinds of component for the first letter of a netlist line
+KINDS = {"R": "Resistor", "C": "Capacitor", "L": "Inductor", "V": "Vsource", "D": "Diode"}
+
+#multipliers for the SPICE suffixes used in the decks
+SUFFIXES = [("meg", 1e6), ("f", 1e-15), ("p", 1e-12), ("n", 1e-9), ("u", 1e-6), ("m", 1e-3), ("k", 1e3), ("g", 1e9), ("t", 1e12)]
+
+
+#reads a SPICE number like 1m, 4.7k or 1e-6. {name} is looked up in values (the .param symbols)
+
+def number(text, values = None):
+
+    text = text.strip().lower().rstrip(",)")
+
+    if text.startswith("{"):
+        return values[text.strip("{}")]
+
+    for suffix, mult in SUFFIXES:
+        if text.endswith(suffix):
+            return float(text[:-len(suffix)])*mult
+
+    return float(text)
+
+
+#This function reads a deck written by Metrics. values holds the values of the .param symbols.
+#Returns the circuit, the input node (where Vin is connected, None if there's no Vin) and the list
+#of analysis, .param, .step and .meas lines (lower case)
+
+def parse(lines, values = None):
+
+    comps = []
+    nodes = set()
+    inNode = None
+    commands = []
+
+    for line in lines:
+
+        line = line.strip()
+        if len(line) == 0 or line[0] == "*":
+            continue
+
+        if line[0] == ".":
+            if not line.lower().startswith(".model"):
+                commands.append(line.lower())
+            continue
+
+        words = line.split()
+
+        #the input source added by the analyses
+        if words[0].lower() == "vin":
+            inNode = words[1]
+            continue
+
+        letter = words[0][0].upper()
+
+        if letter == "Q":
+            kind = "NPN" if words[4] == Cir.NPN_MODEL else "PNP"
+            comps.append(Cir.Component(kind, words[0][1:], words[1:4], []))
+        elif letter == "D":
+            comps.append(Cir.Component("Diode", words[0][1:], words[1:3], []))
+        elif letter == "V":
+            comps.append(Cir.Component("Vsource", words[0][1:], words[1:3], [number(words[4], values)]))
+        elif letter in KINDS:
+            comps.append(Cir.Component(KINDS[letter], words[0][1:], words[1:3], [number(words[3], values)]))
+        else:
+            raise ValueError("FakeSpice can't simulate " + words[0])
+
+        nodes.update(comps[-1].nodes)
+
+    return CirGraph.Circuit("fake", comps, nodes), inNode, commands
+
+
+#reads the .step param run list and the .param name table(run, ...) lines. Returns the list of
+#runs (None if the deck isn't stepped) and a dictionary mapping each parameter to {run: value}
+
+def steps(commands):
+
+    runs = None
+    tables = dict()
+
+    for command in commands:
+
+        words = command.split()
+
+        if words[0] == ".step" and words[1:4] == ["param", "run", "list"]:
+            runs = [int(number(word)) for word in words[4:]]
+
+        elif words[0] == ".param" and "table(" in command:
+            name = words[1]
+            args = command[command.index("table(") + 6:command.rindex(")")].split(",")[1:]
+            tables[name] = {int(number(args[index])): number(args[index + 1]) for index in range(0, len(args) - 1, 2)}
+
+    return runs, tables
+
+
+#writes a binary raw file. names and columns are the variables and their values, complex is
+#True for .ac data. Real data is written like ltSpice: time as float64 and the rest as float32
+
+def writeRaw(path, plotname, names, columns, complex = False):
+
+    numPoints = len(columns[0])
+
+    header = ["Title: * FakeSpice\n", "Date: " + time.ctime(0) + "\n", "Plotname: " + plotname + "\n",
+              "Flags: " + ("complex forward log" if complex else "real forward") + "\n",
+              "No. Variables: " + str(len(names)) + "\n", "No. Points: " + str(numPoints) + "\n",
+              "Offset: 0.0000000000000000e+000\n", "Command: FakeSpice\n", "Variables:\n"]
+    for index in range(len(names)):
+        kind = "frequency" if names[index] == "frequency" else "time" if names[index] == "time" else "voltage" if names[index].startswith("V(") else "device_current"
+        header.append("\t" + str(index) + "\t" + names[index] + "\t" + kind + "\n")
+    header.append("Binary:\n")
+
+    if complex:
+        types = [np.complex128]*len(names)
+    else:
+        types = [np.float64] + [np.float32]*(len(names) - 1)
+
+    data = np.zeros(numPoints, dtype = np.dtype([("v" + str(index), types[index]) for index in range(len(names))]))
+    for index in range(len(names)):
+        data["v" + str(index)] = columns[index]
+
+    f = open(path, "wb")
+    f.write("".join(header).encode("utf-16-le"))
+    f.write(data.tobytes())
+    f.close()
+
+
+#returns the node of a V(node) expression
+
+def probe(expr):
+    return expr[expr.index("v(") + 2:expr.index(")")].upper()
+
+
+#This function simulates a deck once with the .param symbols set to values. If base is given the
+#raw files are written to base.raw (and base.op.raw). Returns the lines of the operating point
+#section of the log and the list of .meas results. Each result is a tuple (name, line, fields) where
+#line is how the result is printed in a normal run (None if the measurement failed) and fields are the
+#values printed in the table of a stepped run
+
+def analyze(lines, values, base = None):
+
+    circuit, inNode, commands = parse(lines, values)
+
+    topo = MNA.Topology(circuit, inNode if inNode is not None else "0")
+    vals = topo.values(circuit)
+
+    x, J, small, converged = MNA.dcSolve(topo, vals)
+
+    names = ["V(" + node.lower() + ")" for node in topo.nodes]
+    names += ["I(V" + name.lower() + ")" for name in topo.V["name"]]
+
+    log = []
+    if not converged:
+        log.append("Direct Newton iteration failed to find .op point.\n")
+
+    analyses = [command.split()[0] for command in commands]
+
+    #operating point. Node voltages come first and then the currents through the sources
+    op = [x[topo.index(node)] for node in topo.nodes] + list(x[topo.V["row"]])
+    if ".op" in analyses:
+        log.append("       --- Operating Point ---\n\n")
+        for name, val in zip(names, op):
+            log.append(name + "\t " + repr(float(val)) + "\t" + ("voltage" if name.startswith("V") else "device_current") + "\n")
+        log.append("\n")
+
+    #LTspice writes the operating point of .ac and .tran runs into a .op.raw and a lone .op into the .raw
+    if base is not None and (".op" in analyses or ".ac" in analyses or ".tran" in analyses):
+        opPath = base + (".op.raw" if ".ac" in analyses or ".tran" in analyses else ".raw")
+        writeRaw(opPath, "Operating Point", ["time"] + names, [[0.0]] + [[val] for val in op])
+
+    meas = [command for command in commands if command.startswith(".meas")]
+    results = []
+
+    for command in commands:
+
+        words = command.replace("=", " = ").split()
+
+        if words[0] == ".ac":
+
+            #.ac dec <points per decade> <start> <stop>. The points are capped so a huge number doesn't take forever
+            perDecade = min(number(words[2]), 100)
+            start = number(words[3])
+            stop = number(words[4])
+            freqs = np.logspace(np.log10(start), np.log10(stop), max(int(perDecade*np.log10(stop/start)), 1) + 1)
+
+            X, x, converged = MNA.acSweep(topo, vals, freqs)
+
+            if base is not None:
+                writeRaw(base + ".raw", "AC Analysis", ["frequency"] + names[:len(topo.nodes)],
+                         [freqs] + [X[:, topo.index(node)] for node in topo.nodes], complex = True)
+
+            acMeas = [line for line in meas if line.split()[1] == "ac"]
+            if len(acMeas) > 0:
+                results += acResults(freqs, X[:, topo.index(probe(acMeas[0]))], converged, acMeas)
+
+        elif words[0] == ".tran":
+
+            stop = number(words[2])
+            freq = 1/stop
+
+            #same response as the ac analysis, just at the frequency of the input
+            X, x, ok = MNA.acSweep(topo, vals, [freq])
+            times = np.linspace(0, stop, 201)
+
+            columns = [times]
+            for node in topo.nodes:
+                H = X[0, topo.index(node)]
+                columns.append(x[topo.index(node)] + 1e-3*np.abs(H)*np.sin(2*np.pi*freq*times + np.angle(H)))
+
+            #source currents are held at their operating point
+            for row in topo.V["row"]:
+                columns.append(np.full(len(times), x[row]))
+
+            if base is not None:
+                writeRaw(base + ".raw", "Transient Analysis", ["time"] + names, columns)
+
+            #find <v(node) or i(source)> at <time>
+            for line in meas:
+                words = line.replace("=", " = ").split()
+                if words[1] != "tran":
+                    continue
+                at = number(words[-1])
+                expr = words[4]
+                val = np.interp(at, times, columns[1 + [name.lower() for name in names].index(expr)])
+                results.append((words[2], words[2] + ": " + expr + "=" + repr(float(val)) + " at " + repr(at) + "\n", [repr(float(val)), repr(at)]))
+
+    return log, results
+
+
+#This function works out the .meas ac results
+
+def acResults(freqs, H, converged, meas):
+
+    m = MNA.acMeasure(freqs, H)
+
+    phase = np.unwrap(np.angle(H))*180/np.pi
+    unity, idx, t = MNA.crossing(freqs, np.abs(H), np.ones(()), 1)
+    unityPhase = (phase[idx] + t*(phase[min(idx + 1, len(freqs) - 1)] - phase[idx]) + 180) % 360 - 180
+
+    results = []
+    for line in meas:
+
+        name = line.split()[2]
+        expr = "mag(v(" + probe(line).lower() + "))"
+
+        if name == "op_point" and converged:
+            point = "(" + repr(float(m["op_freq_gain"])) + "dB," + repr(float(m["op_freq_phase"])) + "\N{DEGREE SIGN})"
+            results.append((name, "op_point: MAX(" + expr + ")=" + point + " FROM " + repr(float(freqs[0])) + " TO " + repr(float(freqs[-1])) + "\n",
+                            [point, repr(float(freqs[0])), repr(float(freqs[-1]))]))
+        elif name in ["3db_cutoff1", "3db_cutoff2", "unity_freq"] and converged and np.isfinite(m[name]):
+            results.append((name, name + ": " + expr + "=" + ("1" if name == "unity_freq" else "op_point/sqrt(2)") + " AT " + repr(float(m[name])) + "\n",
+                            [repr(float(m[name]))]))
+        elif name == "unity_phase" and converged and np.isfinite(unity):
+            point = "(0dB," + repr(float(unityPhase)) + "\N{DEGREE SIGN})"
+            results.append((name, "unity_phase: v(" + probe(line).lower() + ")=" + point + " at " + repr(float(unity)) + "\n",
+                            [point, repr(float(unity))]))
+        else:
+            results.append((name, None, None))
+
+    return results
+
+
+#This function simulates a deck and writes the log and raw files next to it. A stepped deck is
+#simulated once per run and its .meas results are printed as one table per measurement with a row
+#per run, like ltSpice does. Runs where a measurement failed are left out of its table. Stepped
+#runs don't write raw files.
+
+def simulate(path):
+
+    f = open(path, "r")
+    lines = f.readlines()
+    f.close()
+
+    base = os.path.splitext(path)[0]
+    circuit, inNode, commands = parse([line for line in lines if "{" not in line])
+    runs, tables = steps(commands)
+
+    log = ["Circuit: * " + os.path.basename(path) + "\n\n"]
+
+    if runs is None:
+        opLog, results = analyze(lines, dict(), base)
+        log += opLog
+        log += [line if line is not None else "Measurement \"" + name + "\" FAIL'ed\n" for name, line, fields in results]
+
+    else:
+        perRun = []
+        for run in runs:
+            log.append(".step run=" + str(run) + "\n")
+            opLog, results = analyze(lines, {name: table[run] for name, table in tables.items()})
+            perRun.append(results)
+
+        log.append("\n")
+
+        for col in range(len(perRun[0]) if len(perRun) > 0 else 0):
+            log.append("Measurement: " + perRun[0][col][0] + "\n")
+            log.append("  step\tvalue\n")
+            for run, results in zip(runs, perRun):
+                if results[col][2] is not None:
+                    log.append("%6d\t" % run + "\t".join(results[col][2]) + "\n")
+            log.append("\n")
+
+    f = open(base + ".log", "w", encoding = "utf-16-le")
+    f.writelines(log)
+    f.close()
+
+
+if __name__ == "__main__":
+
+    args = [arg for arg in sys.argv[1:] if arg != "-b"]
+    if len(args) != 1:
+        sys.stderr.write("usage: FakeSpice.py -b deck.cir\n")
+        sys.exit(2)
+
+    delay = float(os.environ.get("FAKESPICE_DELAY", "0"))
+    if delay > 0:
+        time.sleep(delay)
+
+    try:
+        simulate(args[0])
+    except Exception as error:
+        sys.stderr.write("FakeSpice: " + str(error) + "\n")
+        sys.exit(1)
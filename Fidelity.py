@@ -0,0 +1,139 @@
+import numpy as np
+import Parallel
+import Instrument
+
+#Fidelity submodule evaluates a population with successive halving. Running every analysis at full
+#resolution on every candidate is wasteful since most candidates are clearly bad after a much
+#cheaper look. Instead the population goes through a ladder of rungs. Every candidate still alive
+#gets the analyses of the current rung and only the best fraction of them is promoted to the next,
+#more expensive rung. The last rung runs the full resolution analyses.
+
+#Measurements of a candidate are merged from rung to rung (a later rung overwrites the measurements
+#of an earlier one) so the fitness function always sees everything measured so far, and a
+#candidate's fitness is always the one computed after the highest rung it reached. A failure at an
+#earlier rung is dropped when the candidate gets to the next one, so only a failure in its latest
+#rung counts.
+
+#A rung is a dictionary holding:
+
+#analyses: list of analyses to run, in the format used by Parallel.evalPopulation
+#keep: fraction of the candidates in this rung that get promoted to the next one
+#max: (optional) largest number of candidates promoted to the next rung
+
+#Every rung has to measure everything the fitness function reads (at whatever resolution) since
+#the fitness of a candidate that's dropped is the one from its last rung.
+
+#For example, with keep = 0.5 in every rung, a population of 64 runs 64 coarse, 32 medium and 16
+#full evaluations instead of 64 full ones.
+
+
+#This function returns the default ladder: DC power with a coarse AC sweep and a coarse transient
+#(the same single period as the full one, sampled at 20 points instead of 100), then the full AC
+#sweep, then the full transient. The arguments are the same as Metrics.tran and
+#Metrics.ac.
+
+def ladder(node, freq = 1000, start = 10, numStep = 100, stop = 1e8, keep = 0.5):
+
+    return [{"analyses": [("DCpow", {}),
+                          ("ac", {"node": node, "start": start, "numStep": max(numStep//10, 2), "stop": stop}),
+                          ("tran", {"freq": freq, "node": node, "points": 20})], "keep": keep},
+            {"analyses": [("ac", {"node": node, "start": start, "numStep": numStep, "stop": stop})], "keep": keep},
+            {"analyses": [("tran", {"freq": freq, "node": node, "points": 100})], "keep": 1.0}]
+
+
+#This function runs successive halving on a population.
+
+#circuits: list of circuits to evaluate
+#fitFunc: takes in a measurement dictionary and returns the fitness (higher is better). Measurements
+#that couldn't be made are None like in Metrics, and failed simulations have a "failure" entry
+#rungs: the ladder of rungs (see ladder)
+#evaluate: function with the signature of Parallel.evalPopulation used to run the analyses
+#gen: if it's given, the Instrument stats are closed out under generation gen once every rung is done
+#(see Instrument.generation). Pass it when the population is a generation of an evolutionary loop
+#options: passed on to evaluate (numWorkers, chunkSize, cache...)
+
+#Returns the array of fitnesses, the array of the highest rung each candidate reached and the list
+#of merged measurement dictionaries
+
+def halving(circuits, fitFunc, rungs, evaluate = Parallel.evalPopulation, gen = None, **options):
+
+    num = len(circuits)
+    fitness = np.full(num, -np.inf)
+    reached = np.zeros(num, dtype = int)
+    measurements = [dict() for index in range(num)]
+
+    alive = np.arange(num)
+
+    for level in range(len(rungs)):
+
+        rung = rungs[level]
+        Instrument.count("fidelity.rung" + str(level), len(alive))
+
+        results = evaluate([circuits[index] for index in alive], rung["analyses"], **options)
+
+        for index, result in zip(alive, results):
+            measurements[index].pop("failure", None)
+            measurements[index].update(result)
+            reached[index] = level
+            fitness[index] = score(fitFunc, measurements[index])
+
+        if level == len(rungs) - 1:
+            break
+
+        #promote the best of this rung. The sort is stable so ties go to the earlier candidate
+        numKeep = max(int(np.ceil(rung.get("keep", 0.5)*len(alive))), 1)
+        if rung.get("max") is not None:
+            numKeep = min(numKeep, rung["max"])
+
+        order = np.argsort(-fitness[alive], kind = "stable")
+        alive = np.sort(alive[order[:numKeep]])
+
+    if gen is not None:
+        Instrument.generation(gen)
+
+    return fitness, reached, measurements
+
+
+#runs the fitness function and turns failures (errors, None or nan) into -inf. That includes a
+#KeyError for a measurement the rungs so far didn't make, which is counted as fidelity.missing so a
+#ladder that never measures what the fitness function reads shows up in the Instrument stats
+
+def score(fitFunc, measurements):
+
+    if "failure" in measurements:
+        return -np.inf
+
+    try:
+        fit = fitFunc(measurements)
+    except KeyError:
+        Instrument.count("fidelity.missing")
+        return -np.inf
+    except Exception:
+        return -np.inf
+
+    if fit is None or np.isnan(fit):
+        return -np.inf
+
+    return float(fit)
+
+
+#Fitnesses from different rungs aren't measured the same way so they can't be compared directly.
+#This function returns the indices of the candidates from best to worst where a candidate that
+#reached a higher rung always beats one that didn't, and candidates on the same rung are ordered
+#by fitness.
+
+def order(fitness, reached):
+    return np.lexsort((-np.asarray(fitness), -np.asarray(reached)))
+
+
+#returns a fitness array that can be used for selection (like Genome.select) where candidates that
+#reached a higher rung are always ahead of the ones that didn't: the rank of every candidate in
+#order, with the best candidate getting len(fitness) and failures staying at -inf
+
+def ranks(fitness, reached):
+
+    fitness = np.asarray(fitness, dtype = float)
+    ranked = np.empty(len(fitness))
+    ranked[order(fitness, reached)] = np.arange(len(fitness), 0, -1)
+
+    return np.where(np.isfinite(fitness), ranked, -np.inf)
@@ -0,0 +1,451 @@
+import os
+import queue
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import Genome
+import Checkpoint
+import SimRunner
+import Instrument
+
+#GA submodule is the evolutionary driver that puts the genome (Genome) and the evaluators (Metrics,
+#MNA, Parallel) together. Instead of evaluating a whole generation and waiting for the slowest
+#simulation to finish before breeding the next one, it runs steady state evolution: a fixed number
+#of evaluations are kept in flight and as soon as any of them finishes the result is put into the
+#population and a new child is bred and sent off. That way every worker is always busy.
+
+#Several populations (islands) can be evolved at the same time in separate processes. Every so
+#often each island sends copies of its best individuals to the next island in a ring.
+
+#The fitness function is given a Circuit and returns a number where higher is better, or a
+#(fitness, measurements) pair where measurements is a dictionary like the ones Metrics returns (the
+#measurements named in metricKeys are kept in the history and the checkpoints). It's run in worker
+#processes so it has to be a function defined at the top level of a module. Circuits whose fitness
+#is None or nan, or whose simulation failed (the fitness function raises a SimRunner.SimFailure, a
+#LinAlgError or a FloatingPointError), get a fitness of -inf and the error is kept as the "failure"
+#measurement. Any other error is a bug in the fitness function and stops the run.
+
+#errors of a fitness function that mean the circuit couldn't be simulated
+FAILURES = (SimRunner.SimFailure, np.linalg.LinAlgError, FloatingPointError)
+
+
+#evaluates one individual in a worker process. The circuit is rebuilt from the template and
+#the row of parameters so that only the parameters have to be sent to the worker. Returns the
+#fitness and the dictionary of measurements (empty if the fitness function doesn't give any)
+
+def evalRow(fitFunc, template, row):
+
+    circuit = Genome.Genome(template, row[None, :]).circuit(0)
+
+    try:
+        fit = fitFunc(circuit)
+    except FAILURES as error:
+        Instrument.count("ga.failed")
+        return -np.inf, {"failure": repr(error)}
+
+    measurements = dict()
+    if isinstance(fit, tuple):
+        fit, measurements = fit
+
+    if fit is None or np.isnan(fit):
+        return -np.inf, measurements
+
+    return float(fit), measurements
+
+
+#runs evalRow in a worker process and sends the worker's stats (see Instrument) back with the
+#result like Parallel.evalTask. In the current process (numWorkers 0) taking the stats and merging
+#them back in changes nothing
+
+def evalWorker(fitFunc, template, row):
+
+    fit, measurements = evalRow(fitFunc, template, row)
+
+    return fit, measurements, Instrument.take()
+
+
+#runs fitFunc on a circuit in the current process. Used in place of an executor when numWorkers is 0
+
+class Inline:
+
+    def submit(self, func, *args):
+
+        future = InlineFuture()
+        future.value = func(*args)
+        return future
+
+    def shutdown(self, wait = True):
+        pass
+
+
+class InlineFuture:
+
+    def result(self):
+        return self.value
+
+    def done(self):
+        return True
+
+
+##########################################################SteadyState Class##########################################################
+
+#The SteadyState class evolves a single population. Every len(population) evaluations count as a
+#generation and close out the Instrument stats (see Instrument.generation), including the stats the
+#workers send back with their results.
+
+####Class Attributes####
+
+##genome: the Genome holding the population. Its array is updated in place as children replace individuals
+
+##fitness: (population,) array of fitnesses (-inf for individuals that haven't been evaluated yet)
+
+##born: (population,) array holding the evaluation count at which each individual was added
+
+##busy: (population,) boolean array of the rows of the initial population whose evaluation hasn't come
+#back yet. They can't be replaced, otherwise the result would be written onto the child that took the row
+
+##metrics: dictionary mapping each name in metricKeys to a (population,) array of that measurement (nan
+#where it's missing)
+
+##evals: number of evaluations done so far
+
+##history: list of (evals, best fitness) pairs, one for every evaluation
+
+####Class Methods####
+
+##run: evolves the population until maxEvals evaluations have been done and returns the best individual
+#as a (params, fitness) pair. inbox and outbox are optional queues used for migration between islands.
+
+##breed: makes one child (a parameter row) from the current population
+
+##insert: puts an evaluated child into the population according to the replacement policy
+
+##best: returns the indices of the num fittest individuals
+
+##checkpoint: saves the population to checkpointDir (see Checkpoint)
+
+##resume: loads the newest checkpoint in checkpointDir back in. run then carries on from where it was saved
+
+####Options####
+
+##fitFunc: fitness function (see the top of the file)
+
+##numWorkers: number of evaluations kept in flight. 0 evaluates in the current process
+
+##selection: how parents are picked: "tournament", "roulette" or "truncation" (see Genome.select)
+
+##replacement: which individual a child replaces:
+#"worst" replaces the worst individual if the child is better
+#"oldest" always replaces the individual that has been in the population the longest
+#"tournament" replaces the worst of k random individuals if the child is better
+
+##factor, pm: mutation settings (see Genome.mutate)
+
+##crossover, pc: crossover method (see Genome.crossover) and the probability a child is made with crossover
+
+##k: tournament size used by selection and replacement
+
+##migrateEvery, numMigrants: every migrateEvery evaluations the numMigrants best individuals are sent to
+#the outbox
+
+##seed: seed of the random number generator
+
+##checkpointDir: folder the checkpoints and the history of every evaluation (history.bin, see Checkpoint.History)
+#are written to. None turns checkpointing off
+
+##checkpointEvery: number of evaluations between checkpoints. Only the newest 3 checkpoints are kept
+
+##metricKeys: names of the measurements (from fitness functions that return them) that are kept with the
+#fitness in metrics, the history and the checkpoints
+
+
+class SteadyState:
+
+    def __init__(self, genome, fitFunc, numWorkers = None, selection = "tournament", replacement = "worst",
+                 factor = 0.1, pm = 0.2, crossover = "uniform", pc = 0.5, k = 2, migrateEvery = 100, numMigrants = 2, seed = None,
+                 checkpointDir = None, checkpointEvery = 1000, metricKeys = ()):
+
+        self.genome = genome
+        self.fitFunc = fitFunc
+        self.numWorkers = os.cpu_count() if numWorkers is None else numWorkers
+        self.selection = selection
+        self.replacement = replacement
+        self.factor = factor
+        self.pm = pm
+        self.crossover = crossover
+        self.pc = pc
+        self.k = k
+        self.migrateEvery = migrateEvery
+        self.numMigrants = numMigrants
+        self.rng = np.random.default_rng(seed)
+
+        self.fitness = np.full(len(genome), -np.inf)
+        self.born = np.zeros(len(genome), dtype = int)
+        self.busy = np.zeros(len(genome), dtype = bool)
+        self.metrics = {key: np.full(len(genome), np.nan) for key in metricKeys}
+        self.evals = 0
+        self.history = []
+
+        self.checkpointDir = checkpointDir
+        self.checkpointEvery = checkpointEvery
+        self.log = None
+        if checkpointDir is not None:
+            os.makedirs(checkpointDir, exist_ok = True)
+            self.log = Checkpoint.History(os.path.join(checkpointDir, "history.bin"), genome.params.shape[1], metricKeys)
+
+    def breed(self):
+
+        g = self.genome
+
+        #only individuals that have been evaluated can be parents
+        ready = np.flatnonzero(np.isfinite(self.fitness))
+        if len(ready) == 0:
+            ready = np.arange(len(g))
+
+        parents = ready[g.select(self.fitness[ready], 2, self.selection, self.k, self.rng)]
+
+        if self.rng.uniform() < self.pc:
+            child = g.crossover(parents[:1], parents[1:], self.crossover, rng = self.rng)
+        else:
+            child = g.params[parents[:1]].copy()
+
+        #mutate the child with a one row genome so that the population isn't touched
+        single = Genome.Genome(g.template, child)
+        single.mutate(self.factor, self.pm, self.rng)
+
+        return single.params[0]
+
+    def insert(self, params, fit, measurements = None):
+
+        #rows still waiting on their first evaluation are left alone. If that's all of them the child is dropped
+        free = np.flatnonzero(~self.busy)
+        if len(free) == 0:
+            return
+
+        match self.replacement:
+
+            case "worst":
+                target = free[np.argmin(self.fitness[free])]
+
+            case "oldest":
+                target = free[np.argmin(self.born[free])]
+
+            case "tournament":
+                picks = free[Genome.integers(self.rng, len(free), self.k)]
+                target = picks[np.argmin(self.fitness[picks])]
+
+            case _:
+                raise ValueError("unknown replacement policy " + self.replacement)
+
+        #the oldest policy replaces no matter what but the others only keep better children
+        if self.replacement == "oldest" or fit > self.fitness[target]:
+            self.genome.params[target] = params
+            self.fitness[target] = fit
+            self.born[target] = self.evals
+            self.record(target, measurements)
+
+    #stores the measurements of the individual in row (the ones that are missing become nan)
+    def record(self, row, measurements):
+
+        for key, vals in self.metrics.items():
+            val = None if measurements is None else measurements.get(key)
+            vals[row] = np.nan if val is None else val
+
+    def best(self, num = 1):
+        return np.argsort(-self.fitness, kind = "stable")[:num]
+
+    #sends copies of the best individuals out and takes in any individuals sent by the other islands
+    def migrate(self, inbox, outbox):
+
+        if outbox is not None:
+            top = self.best(self.numMigrants)
+            outbox.put([(self.genome.params[index].copy(), self.fitness[index],
+                         {key: vals[index] for key, vals in self.metrics.items()}) for index in top])
+
+        if inbox is not None:
+            while True:
+                try:
+                    migrants = inbox.get_nowait()
+                except queue.Empty:
+                    break
+                for params, fit, measurements in migrants:
+                    self.insert(params, fit, measurements)
+
+    def checkpoint(self):
+
+        Checkpoint.save(self.checkpointDir, self.evals, self.genome, self.fitness, self.metrics, rng = self.rng, born = self.born)
+        Checkpoint.prune(self.checkpointDir)
+
+    def resume(self):
+
+        if self.checkpointDir is None or Checkpoint.latest(self.checkpointDir) is None:
+            return False
+
+        state = Checkpoint.load(self.checkpointDir)
+
+        #the rows of the checkpoint only mean the same circuits with the same template
+        if state["topology"] != Checkpoint.topology(self.genome.template) or state["genome"].params.shape != self.genome.params.shape:
+            raise ValueError("the checkpoint in " + self.checkpointDir + " was made with a different template or population")
+
+        self.genome.params = state["genome"].params
+        self.fitness = state["fitness"]
+        self.metrics = {key: state["metrics"].get(key, np.full(len(self.fitness), np.nan)) for key in self.metrics}
+        self.born = state["extra"]["born"]
+        self.evals = state["gen"]
+        self.rng = state["rng"]
+
+        #evaluations logged after the checkpoint was made will be done again so they're dropped
+        #from the history of best fitnesses but kept in the history file
+        self.history = [(self.evals, float(np.max(self.fitness)))]
+
+        return True
+
+    def run(self, maxEvals, inbox = None, outbox = None):
+
+        g = self.genome
+
+        #forked workers start with a copy of this process's stats which would be counted twice
+        executor = Inline() if self.numWorkers == 0 else ProcessPoolExecutor(self.numWorkers, initializer = Instrument.reset)
+
+        #individuals of the initial population that still have to be evaluated (after resuming from
+        #a checkpoint that's only the ones it hadn't gotten to). They're put straight into their own
+        #row rather than going through the replacement policy
+        initial = list(np.flatnonzero(self.born == 0))
+        self.busy[:] = False
+        self.busy[initial] = True
+
+        #maps each future to the row it's evaluating (for the initial population) or None for a child
+        #along with the parameters that were sent out
+        pending = dict()
+
+        def submit():
+            if len(initial) > 0:
+                row = initial.pop(0)
+                params = g.params[row].copy()
+            else:
+                row = None
+                params = self.breed()
+            pending[executor.submit(evalWorker, self.fitFunc, g.template, params)] = (row, params)
+
+        try:
+            while len(pending) < max(self.numWorkers, 1) and self.evals + len(pending) < maxEvals:
+                submit()
+
+            while len(pending) > 0:
+
+                if self.numWorkers == 0:
+                    done = list(pending.keys())
+                else:
+                    done, notDone = wait(list(pending.keys()), return_when = FIRST_COMPLETED)
+
+                for future in done:
+                    row, params = pending.pop(future)
+                    fit, measurements, stats = future.result()
+                    Instrument.merge(stats)
+                    self.evals += 1
+
+                    if row is None:
+                        self.insert(params, fit, measurements)
+                    else:
+                        self.fitness[row] = fit
+                        self.born[row] = self.evals
+                        self.busy[row] = False
+                        self.record(row, measurements)
+
+                    self.history.append((self.evals, float(np.max(self.fitness))))
+
+                    if self.log is not None:
+                        self.log.append(self.evals, params, fit, [measurements])
+                        if self.evals % self.checkpointEvery == 0:
+                            self.checkpoint()
+
+                    if self.evals % self.migrateEvery == 0:
+                        self.migrate(inbox, outbox)
+
+                    if self.evals % len(g) == 0:
+                        Instrument.generation(self.evals//len(g))
+
+                    #replace the finished evaluation with a new one straight away
+                    if self.evals + len(pending) < maxEvals:
+                        submit()
+
+        finally:
+            executor.shutdown(wait = True)
+
+        if self.log is not None:
+            self.checkpoint()
+
+        top = self.best(1)[0]
+
+        return g.params[top].copy(), self.fitness[top]
+
+
+#runs one island in its own process and sends back the final population through results
+
+def runIsland(index, genome, fitFunc, maxEvals, options, inbox, outbox, results):
+
+    #migrants that the next island never reads shouldn't stop this process from exiting
+    if outbox is not None:
+        outbox.cancel_join_thread()
+
+    #the island starts with a copy of the parent's stats, which would be sent back and counted twice
+    Instrument.reset()
+    del Instrument.generations[:]
+
+    engine = SteadyState(genome, fitFunc, **options)
+    engine.run(maxEvals, inbox, outbox)
+
+    results.put((index, engine.genome.params, engine.fitness, engine.history, Instrument.generations, Instrument.take()))
+
+
+#This function evolves numIslands populations in separate processes with migration around a ring
+#(island i sends its best individuals to island i + 1). genomes is a list with one Genome per island.
+#options are passed on to SteadyState (and each island's seed is offset by its index so islands don't
+#make the same choices). numWorkers is the budget for all of the islands together (os.cpu_count() by
+#default) and is split between them, every island getting at least one worker unless it's 0. Returns
+#a list of (Genome, fitness, history) tuples, one per island. The Instrument stats of every island's
+#generations are added to Instrument.generations (tagged with the island) and whatever the islands
+#recorded after their last generation is merged into the current one.
+
+def runIslands(genomes, fitFunc, maxEvals, **options):
+
+    numIslands = len(genomes)
+
+    budget = options.pop("numWorkers", None)
+    if budget is None:
+        budget = os.cpu_count()
+
+    queues = [mp.Queue() for index in range(numIslands)]
+    results = mp.Queue()
+
+    procs = []
+    for index in range(numIslands):
+
+        opts = dict(options)
+        opts["numWorkers"] = 0 if budget == 0 else max(budget//numIslands + (index < budget % numIslands), 1)
+        if opts.get("seed") is not None:
+            opts["seed"] = opts["seed"] + index
+
+        inbox = queues[index]
+        outbox = queues[(index + 1) % numIslands] if numIslands > 1 else None
+
+        proc = mp.Process(target = runIsland, args = (index, genomes[index], fitFunc, maxEvals, opts, inbox, outbox, results))
+        proc.start()
+        procs.append(proc)
+
+    #the results have to be read before joining or a process with a lot to send would never finish
+    finished = [None]*numIslands
+    for count in range(numIslands):
+        index, params, fitness, history, generations, stats = results.get()
+        finished[index] = (Genome.Genome(genomes[index].template, params), fitness, history)
+
+        for gen in generations:
+            gen["island"] = index
+            Instrument.generations.append(gen)
+            Instrument.accumulate(Instrument.totals, gen)
+        Instrument.merge(stats)
+
+    for proc in procs:
+        proc.join()
+
+    return finished
@@ -0,0 +1,245 @@
+import numpy as np
+import CirComp as Cir
+import CirGraph
+
+#Genome submodule stores a population of circuits that share a topology as a structure of arrays.
+#Instead of every Component keeping its own params list, the parameters of the whole population live
+#in one contiguous (population, numParams) float64 array where row i holds the parameters of
+#individual i in the same order as the parameter vector used by MNA (every component's params joined
+#together in the order the components appear in the circuit). Mutation, crossover and selection are
+#then whole array operations instead of python loops over components.
+
+
+#draws random integers from 0 up to (not including) high. The global np.random calls this randint
+#while np.random.Generator objects call it integers so this works with either
+
+def integers(rng, high, size):
+
+    if hasattr(rng, "integers"):
+        return rng.integers(0, high, size)
+
+    return rng.randint(0, high, size)
+
+
+#This function turns sensitivities into per entry step size scales for mutation. sens is an array of
+#derivatives d(metric)/d(param) with the shape of params (population, numParams), or a dictionary or
+#list of them with one per metric (like the one returned by MNA.sensitivity). The effect of a
+#parameter on a metric is how much the metric changes for a relative change of the parameter
+#(|d(metric)/d(param)*param|), divided by the largest effect on that metric in the individual so
+#that metrics with different units can be compared. Every parameter gets the largest of its effects
+#over the metrics. The scale goes from floor for parameters that don't matter up to 1 for the most
+#important one, and every row is divided by its mean so the overall amount of mutation stays the
+#same. Parameters whose sensitivity couldn't be worked out (nan) count as not mattering.
+
+def scales(sens, params, floor = 0.1):
+
+    if isinstance(sens, dict):
+        sens = list(sens.values())
+    sens = np.asarray(sens, dtype = np.float64).reshape((-1,) + np.shape(params))
+
+    effect = np.nan_to_num(np.abs(sens*params), nan = 0, posinf = 0)
+    top = np.max(effect, axis = -1, keepdims = True)
+    importance = np.max(effect/np.where(top > 0, top, 1), axis = 0)
+
+    scale = floor + (1 - floor)*importance
+
+    return scale/np.mean(scale, axis = -1, keepdims = True)
+
+
+##########################################################ParamView Class##########################################################
+
+#The ParamView class is a Component whose params are a view onto one row of a Genome's array instead
+#of a list. Changing view.params[i] (for example through Component.mutate) changes the array, and
+#since the view only keeps the row number it keeps working when the Genome replaces its array.
+
+####Class Attributes####
+
+##kind, name, nodes: same as Component
+
+##genome: the Genome the view belongs to
+
+##row: the individual the view is looking at
+
+##lo, hi: the columns of the genome's array holding this component's parameters
+
+
+class ParamView(Cir.Component):
+
+    __slots__ = ("genome", "row", "lo", "hi")
+
+    def __init__(self, genome, row, comp, lo, hi):
+
+        self.kind = comp.kind
+        self.name = comp.name
+
+        #every view gets its own node list so rewiring one individual's circuit doesn't rewire
+        #the template (and every other individual)
+        self.nodes = list(comp.nodes)
+        self.genome = genome
+        self.row = row
+        self.lo = lo
+        self.hi = hi
+
+    @property
+    def params(self):
+        return self.genome.params[self.row, self.lo:self.hi]
+
+    @params.setter
+    def params(self, vals):
+        self.genome.params[self.row, self.lo:self.hi] = vals
+
+
+##########################################################Genome Class##########################################################
+
+####Class Attributes####
+
+##template: a Circuit with the topology shared by every individual. Its parameter values aren't used
+
+##params: (population, numParams) float64 array holding the parameters of every individual
+
+##owner: (numParams,) array with the index (in template.components) of the component each column belongs to
+
+##kinds: (numParams,) array with the kind of the component each column belongs to
+
+##slices: list holding the (lo, hi) columns of every component
+
+####Class Methods####
+
+##circuit: returns a Circuit for one individual whose components are ParamViews onto its row
+
+##circuits: returns the circuits of every individual
+
+##take: returns a new Genome holding the rows given by an array of indices
+
+##mutate: performs gaussian mutation on the whole population at once. Same rules as Component.mutate:
+#each parameter is mutated with probability pm by sampling from a normal distribution with standard
+#deviation factor, and the result is clipped to within 5 factors of the old value and to be non negative.
+
+##mutateScaled: gaussian mutation where every entry's standard deviation is factor scaled by how much
+#that parameter affects the measurements (see scales), so mutations aren't wasted on parameters that
+#barely matter
+
+##crossover: takes in two arrays of parent indices and returns the array of children's parameters
+
+##select: takes in the fitness of every individual (higher is better) and returns the indices of num
+#selected individuals
+
+##replace: overwrites rows of the array with new parameters
+
+
+class Genome:
+
+    def __init__(self, template, params):
+
+        self.template = template
+        self.params = np.ascontiguousarray(params, dtype = np.float64)
+
+        self.slices = []
+        owner = []
+        pos = 0
+        for index in range(len(template.components)):
+            num = len(template.components[index].params)
+            self.slices.append((pos, pos + num))
+            owner += [index]*num
+            pos += num
+
+        self.owner = np.array(owner, dtype = int)
+        self.kinds = np.array([template.components[index].kind for index in owner], dtype = object)
+
+        if self.params.ndim != 2 or self.params.shape[1] != pos:
+            raise ValueError("params should have shape (population, " + str(pos) + ")")
+
+    #builds a Genome from a list of circuits that share a topology
+    @classmethod
+    def fromCircuits(cls, circuits):
+
+        rows = [[float(param) for comp in circuit.components for param in comp.params] for circuit in circuits]
+
+        return cls(circuits[0], np.array(rows, dtype = np.float64).reshape(len(circuits), -1))
+
+    def __len__(self):
+        return self.params.shape[0]
+
+    def circuit(self, row, ID = None):
+
+        comps = [ParamView(self, row, comp, lo, hi) for comp, (lo, hi) in zip(self.template.components, self.slices)]
+
+        return CirGraph.Circuit(str(row) if ID is None else ID, comps, set(self.template.nodes))
+
+    def circuits(self):
+        return [self.circuit(row) for row in range(len(self))]
+
+    def take(self, indices):
+        return Genome(self.template, self.params[np.asarray(indices)])
+
+    def mutate(self, factor, pm, rng = np.random):
+
+        params = self.params
+
+        #factor can be a single number or one standard deviation per column (or per entry)
+        factor = np.broadcast_to(np.asarray(factor, dtype = np.float64), params.shape)
+
+        mask = rng.uniform(0, 1, params.shape) < pm
+        samp = rng.normal(params, factor)
+
+        lb = params - 5*factor
+        ub = params + 5*factor
+
+        self.params = np.where(mask, np.minimum(np.maximum(np.maximum(samp, lb), 0), ub), params)
+
+    def mutateScaled(self, sens, factor, pm, rng = np.random, floor = 0.1):
+        self.mutate(factor*scales(sens, self.params, floor), pm, rng)
+
+    def crossover(self, parentsA, parentsB, method = "uniform", alpha = 0.5, rng = np.random):
+
+        A = self.params[np.asarray(parentsA)]
+        B = self.params[np.asarray(parentsB)]
+
+        match method:
+
+            #each parameter comes from either parent with equal probability
+            case "uniform":
+                return np.where(rng.uniform(0, 1, A.shape) < 0.5, A, B)
+
+            #parameters before a random cut point come from A and the rest from B
+            case "onepoint":
+                cut = integers(rng, A.shape[1] + 1, A.shape[0])
+                return np.where(np.arange(A.shape[1])[None, :] < cut[:, None], A, B)
+
+            #blend crossover (BLX-alpha): sample uniformly from the interval spanned by the parents
+            #stretched by alpha on both sides, clipped to be non negative like mutation
+            case "blend":
+                lo = np.minimum(A, B)
+                hi = np.maximum(A, B)
+                span = hi - lo
+                return np.maximum(rng.uniform(lo - alpha*span, hi + alpha*span), 0)
+
+            case _:
+                raise ValueError("unknown crossover method " + method)
+
+    def select(self, fitness, num, method = "tournament", k = 2, rng = np.random):
+
+        fitness = np.asarray(fitness, dtype = np.float64)
+        size = len(fitness)
+
+        match method:
+
+            #pick k random individuals num times and keep the fittest of each group
+            case "tournament":
+                picks = integers(rng, size, (num, k))
+                return np.take_along_axis(picks, np.argmax(fitness[picks], axis = 1)[:, None], 1)[:, 0]
+
+            #pick individuals with probability proportional to their fitness (shifted to be positive)
+            case "roulette":
+                weights = fitness - np.min(fitness) + 1e-12
+                return rng.choice(size, num, p = weights/np.sum(weights))
+
+            #keep the num fittest individuals
+            case "truncation":
+                return np.argsort(-fitness, kind = "stable")[:num]
+
+            case _:
+                raise ValueError("unknown selection method " + method)
+
+    def replace(self, rows, params):
+        self.params[np.asarray(rows)] = params
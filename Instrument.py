@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import functools
+
+#Instrument submodule keeps track of where the time goes during an evaluation. Every stage of the
+#pipeline (writing the netlist, running ltSpice, parsing the log, measuring the distortion...) is
+#wrapped in a timer, and events like failed simulations and FAIL'ed measurements are counted.
+
+#Timers only call time.perf_counter twice and add into a list, so they cost around a microsecond
+#and can be left on for real runs. Setting the environment variable AMPGA_INSTRUMENT to 0 turns
+#them off entirely.
+
+#Stats are kept per process. Parallel and GA send the stats of each worker back along with its
+#results and merge them in, so the main process sees everything. Calling generation at the end of
+#every generation files the stats collected since the last call under that generation, and the per
+#generation stats can be written out as json or as a Prometheus text file. GA.SteadyState and
+#NSGA.run call it themselves, and Parallel.evalPopulation and Fidelity.halving do when they're
+#given the generation number.
+
+
+ENABLED = os.environ.get("AMPGA_INSTRUMENT", "1") != "0"
+
+#maps the name of each stage to [calls, total seconds, longest call in seconds] for the current generation
+timers = dict()
+
+#maps the name of each event to the number of times it happened in the current generation
+counters = dict()
+
+#list of the stats of the finished generations, each a dictionary holding gen, timers and counters
+generations = []
+
+#stats of every generation (finished or not) added together, used for the Prometheus export
+totals = {"timers": dict(), "counters": dict()}
+
+
+#adds one call of a stage that took elapsed seconds
+
+def record(name, elapsed):
+
+    stat = timers.get(name)
+    if stat is None:
+        timers[name] = [1, elapsed, elapsed]
+    else:
+        stat[0] += 1
+        stat[1] += elapsed
+        if elapsed > stat[2]:
+            stat[2] = elapsed
+
+
+def count(name, num = 1):
+    if ENABLED:
+        counters[name] = counters.get(name, 0) + num
+
+
+##########################################################Timer Class##########################################################
+
+#The Timer class is a context manager that records how long its block took under name. Use it as:
+
+#with Instrument.timer("tran.deck"):
+#    ...
+
+class Timer:
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+#used in place of a Timer when instrumentation is turned off
+
+class NoTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOTIMER = NoTimer()
+
+
+def timer(name):
+    return Timer(name) if ENABLED else NOTIMER
+
+
+#decorator that times every call of a function under name
+
+def timed(name):
+
+    def wrap(func):
+
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+
+        return inner
+
+    return wrap
+
+
+#returns a copy of the stats of the current generation
+
+def snapshot():
+    return {"timers": {name: list(stat) for name, stat in timers.items()}, "counters": dict(counters)}
+
+
+def reset():
+    timers.clear()
+    counters.clear()
+
+
+#returns the stats of the current generation and starts over. Used by worker processes to send
+#their stats back
+
+def take():
+
+    stats = snapshot()
+    reset()
+
+    return stats
+
+
+#adds stats (from snapshot or take) into the current generation
+
+def merge(stats):
+
+    for name, (calls, total, longest) in stats["timers"].items():
+        stat = timers.get(name)
+        if stat is None:
+            timers[name] = [calls, total, longest]
+        else:
+            stat[0] += calls
+            stat[1] += total
+            stat[2] = max(stat[2], longest)
+
+    for name, num in stats["counters"].items():
+        counters[name] = counters.get(name, 0) + num
+
+
+#adds stats into a running total
+
+def accumulate(total, stats):
+
+    for name, (calls, seconds, longest) in stats["timers"].items():
+        stat = total["timers"].setdefault(name, [0, 0.0, 0.0])
+        stat[0] += calls
+        stat[1] += seconds
+        stat[2] = max(stat[2], longest)
+
+    for name, num in stats["counters"].items():
+        total["counters"][name] = total["counters"].get(name, 0) + num
+
+
+#ends generation gen: its stats are filed away and the next generation starts from 0. Returns the
+#stats of the generation
+
+def generation(gen):
+
+    stats = take()
+    stats["gen"] = gen
+
+    generations.append(stats)
+    accumulate(totals, stats)
+
+    return stats
+
+
+#returns a readable summary of stats: for every stage the number of calls, the total and mean time
+#and the fraction of the time spent in it (relative to the sum of the top level stages, the ones
+#without a "." in their name)
+
+def summary(stats = None):
+
+    if stats is None:
+        stats = snapshot()
+
+    top = sum(stat[1] for name, stat in stats["timers"].items() if "." not in name)
+
+    stages = dict()
+    for name, (calls, total, longest) in sorted(stats["timers"].items(), key = lambda item: -item[1][1]):
+        stages[name] = {"calls": calls, "total": total, "mean": total/calls, "max": longest,
+                        "fraction": total/top if top > 0 else 0.0}
+
+    return {"stages": stages, "counters": dict(stats["counters"])}
+
+
+#writes the stats of every finished generation (and the summary of each) to path as json
+
+def toJSON(path):
+
+    out = [dict(stats, summary = summary(stats)) for stats in generations]
+
+    f = open(path + ".tmp", "w")
+    json.dump(out, f, indent = 1)
+    f.close()
+    os.replace(path + ".tmp", path)
+
+
+#writes the running totals (including the current generation) to path in the Prometheus text format
+#so it can be picked up by node_exporter's textfile collector
+
+def toPrometheus(path, prefix = "ampga"):
+
+    total = {"timers": {name: list(stat) for name, stat in totals["timers"].items()}, "counters": dict(totals["counters"])}
+    accumulate(total, snapshot())
+
+    lines = ["# HELP " + prefix + "_stage_seconds_total Time spent in each stage of the evaluation pipeline\n",
+             "# TYPE " + prefix + "_stage_seconds_total counter\n"]
+    lines += [prefix + "_stage_seconds_total{stage=\"" + name + "\"} " + repr(stat[1]) + "\n" for name, stat in sorted(total["timers"].items())]
+
+    lines += ["# HELP " + prefix + "_stage_calls_total Number of times each stage ran\n",
+              "# TYPE " + prefix + "_stage_calls_total counter\n"]
+    lines += [prefix + "_stage_calls_total{stage=\"" + name + "\"} " + str(stat[0]) + "\n" for name, stat in sorted(total["timers"].items())]
+
+    lines += ["# HELP " + prefix + "_stage_seconds_max Longest single run of each stage\n",
+              "# TYPE " + prefix + "_stage_seconds_max gauge\n"]
+    lines += [prefix + "_stage_seconds_max{stage=\"" + name + "\"} " + repr(stat[2]) + "\n" for name, stat in sorted(total["timers"].items())]
+
+    lines += ["# HELP " + prefix + "_events_total Number of times each event happened\n",
+              "# TYPE " + prefix + "_events_total counter\n"]
+    lines += [prefix + "_events_total{event=\"" + name + "\"} " + str(num) + "\n" for name, num in sorted(total["counters"].items())]
+
+    lines.append(prefix + "_generations " + str(len(generations)) + "\n")
+
+    f = open(path + ".tmp", "w")
+    f.writelines(lines)
+    f.close()
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,1025 @@
+import numpy as np
+import CirComp as Cir
+
+#MNA submodule is a small modified nodal analysis engine that simulates a Circuit (from CirGraph)
+#directly in python instead of going through ltSpice. It solves the DC operating point with
+#Newton-Raphson and then runs the AC small signal analysis at every frequency at once. The
+#measurements it returns have the same keys as the ones returned by Metrics.ac and Metrics.DCpow.
+
+#All of the internal functions are written so that the parameter values can have extra leading
+#dimensions. A single circuit uses a parameter vector of shape (n_params,) but a whole population
+#that shares a topology can be passed in as a (population, n_params) array.
+
+#The device models are simplified versions of the ones in NetList.MODELS. BJTs use
+#the Ebers-Moll transport model with the Early effect (IS, BF, BR, VAF), constant junction
+#capacitances (CJE, CJC) and diffusion capacitances from the transit times (TF, TR). Diodes use
+#IS and N along with CJO and TT. Parasitic resistances (RB, RC, RE, RS) and high injection (IKF)
+#are ignored. MOSFETs aren't supported.
+
+#sensitivity returns the derivative of the gain, cutoffs and DC power with respect to every parameter
+#from adjoint solves (see below), which Genome.mutateScaled uses to decide how far to move each parameter.
+
+
+#thermal voltage at 27 C
+VT = 0.025852
+
+#conductance placed from every node to ground so that the matrices are never singular, like
+#the gmin option in SPICE
+GMIN = 1e-12
+
+#largest change in a junction voltage allowed in a single Newton step
+DVMAX = 0.1
+
+#above this argument the exponential in the junction equations is continued as a straight line
+#so that a bad Newton step can't overflow
+XMAX = 40.0
+
+#model parameters taken from the .model lines in NetList.MODELS
+MODELS = {Cir.NPN_MODEL: {"IS": 1e-14, "BF": 200, "BR": 3, "VAF": 100, "CJE": 25e-12, "CJC": 8e-12, "TF": 400e-12, "TR": 100e-9},
+          Cir.PNP_MODEL: {"IS": 1e-14, "BF": 200, "BR": 4, "VAF": 100, "CJE": 10e-12, "CJC": 4.5e-12, "TF": 350e-12, "TR": 250e-9},
+          Cir.DIODE_MODEL: {"IS": 2.52e-9, "N": 1.752, "CJO": 4e-12, "TT": 20e-9}}
+
+
+##########################################################Topology Class##########################################################
+
+#The Topology class holds everything about a circuit that doesn't depend on the values of its
+#components: which node each pin is connected to, where each element is stamped in the MNA matrix,
+#and which entry of the parameter vector holds each element's value. It's built once and then
+#reused for every set of parameter values.
+
+####Class Attributes####
+
+##nodes: dictionary mapping the name of each (non ground) node to its row in the MNA matrix
+
+##size: number of unknowns, which is the number of nodes plus one branch current for every voltage
+#source and inductor. The matrices are one bigger than this because ground is given the last row
+#(and column) which is thrown away before solving. That way elements connected to ground
+#don't need any special handling when they're stamped.
+
+##numParams: length of the parameter vector. The parameter vector is every component's params
+#list joined together in the order the components appear in the circuit.
+
+##R, C, L, V: dictionaries describing the resistors, capacitors, inductors and voltage sources.
+#"a" and "b" are the rows of the first and second node, "val" is the position of the value in the
+#parameter vector and for inductors and voltage sources "row" is the row of the branch current.
+
+##D: dictionary describing the diodes. "a" is the anode row, "b" the cathode row and the rest of the
+#entries are the model parameters.
+
+##Q: dictionary describing the BJTs. "c", "b" and "e" are the rows of the collector, base and emitter,
+#"p" is +1 for NPN and -1 for PNP and the rest of the entries are the model parameters.
+
+##vin: row of the branch current of the input source that's connected from inNode to ground. The
+#source is 0 V at DC and 1 V for the AC analysis, like the Vin source added by Metrics.ac. If the
+#circuit doesn't have inNode this is None.
+
+##key: tuple describing the structure of the circuit. Two circuits with the same key can share a Topology.
+
+####Class Methods####
+
+##values: returns the parameter vector of a circuit with this topology
+
+##index: returns the row of a node
+
+
+class Topology:
+
+    def __init__(self, circuit, inNode = "N5"):
+
+        self.key = (inNode,) + tuple((comp.kind, tuple(comp.nodes), len(comp.params)) for comp in circuit.components)
+
+        #number the nodes in the order they show up
+        self.nodes = dict()
+        for comp in circuit.components:
+            for node in comp.nodes:
+                if node != "0" and node not in self.nodes:
+                    self.nodes[node] = len(self.nodes)
+
+        numNodes = len(self.nodes)
+        self.size = numNodes
+
+        self.R = {"a": [], "b": [], "val": []}
+        self.C = {"a": [], "b": [], "val": []}
+        self.L = {"a": [], "b": [], "val": [], "row": []}
+        self.V = {"a": [], "b": [], "val": [], "row": [], "name": []}
+        self.D = {"a": [], "b": [], "IS": [], "N": [], "CJO": [], "TT": []}
+        self.Q = {"c": [], "b": [], "e": [], "p": [], "IS": [], "BF": [], "BR": [], "VAF": [], "CJE": [], "CJC": [], "TF": [], "TR": []}
+
+        #pos keeps track of where we are in the parameter vector
+        pos = 0
+
+        for comp in circuit.components:
+
+            pins = [self.index(node) for node in comp.nodes]
+
+            match comp.kind:
+
+                case "Resistor":
+                    group = self.R
+                case "Capacitor":
+                    group = self.C
+                case "Inductor":
+                    group = self.L
+                case "Vsource":
+                    group = self.V
+                    group["name"].append(comp.name)
+                case "Diode":
+                    group = self.D
+                case "NPN" | "PNP":
+                    group = self.Q
+                case _:
+                    raise ValueError("MNA can't simulate component " + comp.name + " of kind " + comp.kind)
+
+            if comp.kind in ["NPN", "PNP"]:
+                self.Q["c"].append(pins[0])
+                self.Q["b"].append(pins[1])
+                self.Q["e"].append(pins[2])
+                self.Q["p"].append(1 if comp.kind == "NPN" else -1)
+
+                model = MODELS[Cir.NPN_MODEL if comp.kind == "NPN" else Cir.PNP_MODEL]
+
+            else:
+                group["a"].append(pins[0])
+                group["b"].append(pins[1])
+
+                model = MODELS[Cir.DIODE_MODEL] if comp.kind == "Diode" else dict()
+
+            #copy in the model parameters
+            for param in model:
+                group[param].append(model[param])
+
+            #every element with a value takes up one spot in the parameter vector
+            if "val" in group:
+                group["val"].append(pos)
+
+            #and voltage sources and inductors get a branch current
+            if "row" in group:
+                group["row"].append(self.size)
+                self.size += 1
+
+            pos += len(comp.params)
+
+        self.numParams = pos
+
+        self.vin = None
+        if inNode in self.nodes:
+            self.vin = self.size
+            self.size += 1
+        self.inNode = inNode
+
+        #turn all of the lists into arrays so they can be used for indexing
+        for group in [self.R, self.C, self.L, self.V, self.D, self.Q]:
+            for entry in group:
+                if entry != "name":
+                    group[entry] = np.array(group[entry], dtype = int if entry in ["a", "b", "c", "e", "p", "val", "row"] else float)
+
+    #ground is given the last row of the (size + 1) by (size + 1) matrices
+    def index(self, node):
+
+        if node == "0":
+            return -1
+
+        return self.nodes[node]
+
+    def values(self, circuit):
+
+        vals = []
+        for comp in circuit.components:
+            vals += list(comp.params)
+
+        return np.array(vals, dtype = float)
+
+
+#adds vals into the matrix M at the entries (rows, cols). M has shape (..., N, N) and vals has
+#shape (..., len(rows)). Repeated entries are summed up.
+
+def stamp(M, rows, cols, vals):
+
+    if len(rows) == 0:
+        return
+
+    N = M.shape[-1]
+    flat = M.reshape(-1, N*N)
+    vals = np.broadcast_to(vals, M.shape[:-2] + (len(rows),)).reshape(flat.shape[0], len(rows))
+
+    #ground is row -1 which we turn into row N - 1
+    np.add.at(flat, (slice(None), (rows % N)*N + cols % N), vals)
+
+
+#adds vals (..., len(rows)) into the vector v (..., N) at rows
+
+def inject(v, rows, vals):
+
+    if len(rows) == 0:
+        return
+
+    N = v.shape[-1]
+    flat = v.reshape(-1, N)
+    vals = np.broadcast_to(vals, v.shape[:-1] + (len(rows),)).reshape(flat.shape[0], len(rows))
+
+    np.add.at(flat, (slice(None), rows % N), vals)
+
+
+#solves the stacked systems A x = b like np.linalg.solve. If any of the matrices are singular (or
+#hold infs or nans), the solution of those systems is nan instead of raising an error for the whole
+#batch so that one broken individual doesn't stop the rest of the population from being evaluated
+
+def solve(A, b):
+
+    finite = np.all(np.isfinite(A), axis = (-2, -1))
+
+    try:
+        if np.all(finite):
+            return np.linalg.solve(A, b)
+    except np.linalg.LinAlgError:
+        pass
+
+    b = np.broadcast_to(b, A.shape[:-2] + b.shape[-2:])
+    flatA = A.reshape((-1,) + A.shape[-2:])
+    flatB = b.reshape((-1,) + b.shape[-2:])
+    finite = finite.reshape(-1)
+    x = np.full(flatB.shape, np.nan, dtype = np.result_type(A, b))
+
+    #the matrices holding infs or nans are left out and the rest are still solved as a batch
+    try:
+        x[finite] = np.linalg.solve(flatA[finite], flatB[finite])
+
+    #one of them is singular so we solve them one at a time
+    except np.linalg.LinAlgError:
+        for index in np.flatnonzero(finite):
+            try:
+                x[index] = np.linalg.solve(flatA[index], flatB[index])
+            except np.linalg.LinAlgError:
+                pass
+
+    return x.reshape(b.shape)
+
+
+#stamps a conductance g between rows a and b
+
+def conductance(M, a, b, g):
+
+    rows = np.concatenate((a, b, a, b))
+    cols = np.concatenate((a, b, b, a))
+    stamp(M, rows, cols, np.concatenate((g, g, -g, -g), axis = -1))
+
+
+#stamps the incidence entries of a branch current (row) flowing from a to b
+
+def branch(M, a, b, row):
+
+    rows = np.concatenate((a, b, row, row))
+    cols = np.concatenate((row, row, a, b))
+    ones = np.ones(len(a))
+    stamp(M, rows, cols, np.concatenate((ones, -ones, ones, -ones)))
+
+
+#exponential used by the junctions. Returns the value and the derivative
+
+def explin(x):
+
+    big = x > XMAX
+    e = np.exp(np.minimum(x, XMAX))
+
+    return np.where(big, e*(1 + x - XMAX), e), e
+
+
+#This function builds the linear part of the DC system. Takes in the topology and the parameter
+#values (shape (..., numParams)) and returns the matrix G (..., size + 1, size + 1) and the right
+#hand side b (..., size + 1)
+
+def linear(topo, vals):
+
+    batch = vals.shape[:-1]
+    N = topo.size + 1
+
+    G = np.zeros(batch + (N, N))
+    b = np.zeros(batch + (N,))
+
+    #gmin from every node to ground
+    idx = np.arange(len(topo.nodes))
+    stamp(G, idx, idx, np.full(len(idx), GMIN))
+
+    #a 0 Ohm resistor gives an infinite conductance which makes that individual's solution nan
+    #(and so not converged) instead of stopping the whole batch
+    with np.errstate(divide = "ignore"):
+        conductance(G, topo.R["a"], topo.R["b"], 1/vals[..., topo.R["val"]])
+
+    #inductors are shorts at DC which is the same thing as a 0 V source
+    branch(G, topo.L["a"], topo.L["b"], topo.L["row"])
+
+    branch(G, topo.V["a"], topo.V["b"], topo.V["row"])
+    b[..., topo.V["row"]] = vals[..., topo.V["val"]]
+
+    if topo.vin is not None:
+        vin = np.array([topo.vin])
+        branch(G, np.array([topo.index(topo.inNode)]), np.array([-1]), vin)
+
+    return G, b
+
+
+#This function evaluates the diodes and BJTs at the solution x (..., size + 1). It returns the
+#currents leaving each node through the devices (..., size + 1) and adds the derivatives of
+#those currents into the matrix J. It also returns the small signal quantities needed by
+#capacitance.
+
+def devices(topo, x, J):
+
+    I = np.zeros(x.shape)
+    small = dict()
+
+    D = topo.D
+    if len(D["a"]) > 0:
+
+        nvt = D["N"]*VT
+        e, de = explin((x[..., D["a"]] - x[..., D["b"]])/nvt)
+
+        Id = D["IS"]*(e - 1)
+        gd = D["IS"]*de/nvt
+
+        inject(I, D["a"], Id)
+        inject(I, D["b"], -Id)
+        conductance(J, D["a"], D["b"], gd)
+
+        small["gd"] = gd
+
+    Q = topo.Q
+    if len(Q["c"]) > 0:
+
+        p = Q["p"]
+        vbe = p*(x[..., Q["b"]] - x[..., Q["e"]])
+        vbc = p*(x[..., Q["b"]] - x[..., Q["c"]])
+
+        ef, def_ = explin(vbe/VT)
+        er, der = explin(vbc/VT)
+        def_ = def_/VT
+        der = der/VT
+
+        #base charge from the Early effect
+        q = np.maximum(1 - vbc/Q["VAF"], 0.1)
+
+        #transport current and its derivatives
+        Ict = Q["IS"]*(ef - er)*q
+        gf = Q["IS"]*def_*q
+        gr = -Q["IS"]*der*q - Q["IS"]*(ef - er)/Q["VAF"]*(q > 0.1)
+
+        #base currents
+        Ibf = Q["IS"]/Q["BF"]*(ef - 1)
+        Ibr = Q["IS"]/Q["BR"]*(er - 1)
+        gbe = Q["IS"]/Q["BF"]*def_
+        gbc = Q["IS"]/Q["BR"]*der
+
+        #currents flowing into the collector and base (and so leaving those nodes)
+        Ic = p*(Ict - Ibr)
+        Ib = p*(Ibf + Ibr)
+
+        inject(I, Q["c"], Ic)
+        inject(I, Q["b"], Ib)
+        inject(I, Q["e"], -Ic - Ib)
+
+        #derivatives with respect to the collector, base and emitter voltages. The polarity
+        #cancels out since both the currents and the junction voltages are multiplied by p
+        dIc = [-(gr - gbc), gf + gr - gbc, -gf]
+        dIb = [-gbc, gbe + gbc, -gbe]
+        dIe = [-dIc[k] - dIb[k] for k in range(3)]
+
+        pins = [Q["c"], Q["b"], Q["e"]]
+        for row, dI in zip(pins, [dIc, dIb, dIe]):
+            for col, g in zip(pins, dI):
+                stamp(J, row, col, g)
+
+        small["gf"] = Q["IS"]*ef*q/VT
+        small["gr"] = Q["IS"]*er*q/VT
+
+    return I, small
+
+
+#This function solves for the DC operating point using Newton-Raphson. Takes in the topology and
+#the parameter values (..., numParams) and returns the solution x (..., size + 1), the jacobian at
+#the solution, the small signal quantities of the devices and a boolean array saying which
+#solutions converged.
+
+#Solutions whose Newton step stops being finite (a singular jacobian or one that blew up) are marked
+#failed and taken out of the batch for the rest of the iterations so that one bad individual doesn't
+#send every later solve down the slow path of solve or keep the others iterating until maxIter. Their
+#solution is nan and they aren't converged.
+
+def dcSolve(topo, vals, maxIter = 200, tol = 1e-9):
+
+    G, b = linear(topo, vals)
+    n = topo.size
+
+    x = np.zeros(b.shape)
+    converged = np.zeros(b.shape[:-1], dtype = bool)
+    failed = np.zeros(b.shape[:-1], dtype = bool)
+
+    for iteration in range(maxIter):
+
+        J = G.copy()
+        I, small = devices(topo, x, J)
+
+        #residual of the KCL (and branch) equations
+        F = np.einsum("...ij,...j->...i", G, x) - b + I
+
+        active = ~failed
+        step = solve(J[active][:, :n, :n], F[active][:, :n, None])[..., 0]
+
+        bad = ~np.all(np.isfinite(step), axis = -1)
+        step[bad] = 0
+        failed[active] = bad
+
+        dx = np.zeros(x.shape)
+        dx[active, :n] = step
+
+        #limit how much any junction voltage can move in a single step
+        dv = [np.abs(dx[..., topo.D["a"]] - dx[..., topo.D["b"]]),
+              np.abs(dx[..., topo.Q["b"]] - dx[..., topo.Q["e"]]),
+              np.abs(dx[..., topo.Q["b"]] - dx[..., topo.Q["c"]])]
+        dvMax = np.max(np.concatenate(dv + [np.zeros(x.shape[:-1] + (1,))], axis = -1), axis = -1)
+        alpha = np.minimum(1, DVMAX/np.maximum(dvMax, 1e-300))
+
+        x = x - alpha[..., None]*dx
+
+        failed |= ~np.all(np.isfinite(x), axis = -1)
+        x[failed] = 0
+
+        converged = ~failed & (alpha == 1) & (np.max(np.abs(dx), axis = -1) < tol + 1e-6*np.max(np.abs(x), axis = -1))
+
+        if np.all(converged | failed):
+            break
+
+    x[failed] = np.nan
+
+    #evaluate the jacobian at the final solution
+    J = G.copy()
+    I, small = devices(topo, x, J)
+
+    return x, J, small, converged
+
+
+#This function builds the matrix of capacitances (and inductances) that multiplies jw in the
+#AC analysis. The device capacitances depend on the operating point through small.
+
+def capacitance(topo, vals, small):
+
+    batch = vals.shape[:-1]
+    N = topo.size + 1
+
+    Cm = np.zeros(batch + (N, N))
+
+    conductance(Cm, topo.C["a"], topo.C["b"], vals[..., topo.C["val"]])
+
+    #the branch equation of an inductor is V(a) - V(b) - jwL*I = 0
+    stamp(Cm, topo.L["row"], topo.L["row"], -vals[..., topo.L["val"]])
+
+    D = topo.D
+    if len(D["a"]) > 0:
+        conductance(Cm, D["a"], D["b"], D["CJO"] + D["TT"]*small["gd"])
+
+    Q = topo.Q
+    if len(Q["c"]) > 0:
+        conductance(Cm, Q["b"], Q["e"], Q["CJE"] + Q["TF"]*small["gf"])
+        conductance(Cm, Q["b"], Q["c"], Q["CJC"] + Q["TR"]*small["gr"])
+
+    return Cm
+
+
+#This function runs the AC analysis at every frequency in freqs at once. Takes in the topology,
+#the parameter values (..., numParams) and the frequencies. Returns the complex solution
+#(..., len(freqs), size + 1), the DC solution (..., size + 1) and the boolean array of
+#converged operating points.
+
+def acSweep(topo, vals, freqs):
+
+    x, J, small, converged = dcSolve(topo, vals)
+    Cm = capacitance(topo, vals, small)
+
+    rhs = np.zeros(topo.size + 1)
+    if topo.vin is not None:
+        rhs[topo.vin] = 1
+
+    X = acSolve(topo, J, Cm, freqs, rhs)
+
+    return X, x, converged
+
+
+#solves the small signal system (J + jwCm) X = rhs at every frequency at once. freqs can be a list of
+#frequencies shared by the whole batch (nf,) or have the batch dimensions of J in front (..., nf).
+#With adjoint the transposed system is solved instead. Returns X (..., nf, size + 1)
+
+def acSolve(topo, J, Cm, freqs, rhs, adjoint = False):
+
+    n = topo.size
+    w = 2*np.pi*np.asarray(freqs, dtype = float)
+
+    #one admittance matrix per frequency, all solved in a single call
+    Y = J[..., None, :n, :n] + 1j*w[..., None, None]*Cm[..., None, :n, :n]
+    if adjoint:
+        Y = np.swapaxes(Y, -1, -2)
+
+    X = np.zeros(Y.shape[:-2] + (n + 1,), dtype = complex)
+    X[..., :n] = solve(Y, np.broadcast_to(np.asarray(rhs)[:n, None], Y.shape[:-1] + (1,)))[..., 0]
+
+    return X
+
+
+#finds where the rows of mag (..., nf) cross level (...,) for the count-th time. Returns the
+#interpolated frequency (nan if there's no such crossing) and the index of the sample before it
+
+def crossing(freqs, mag, level, count):
+
+    above = mag >= level[..., None]
+    cross = above[..., :-1] != above[..., 1:]
+
+    #cumulative number of crossings so far. The count-th crossing is the first place where it reaches count
+    total = np.cumsum(cross, axis = -1)
+    found = total[..., -1] >= count if total.shape[-1] > 0 else np.zeros(level.shape, dtype = bool)
+    idx = np.argmax(total >= count, axis = -1)
+
+    m0 = np.take_along_axis(mag, idx[..., None], -1)[..., 0]
+    m1 = np.take_along_axis(mag, idx[..., None] + 1, -1)[..., 0]
+
+    #interpolate in log frequency like a decade sweep
+    logf = np.log10(freqs)
+    t = np.where(found, (level - m0)/np.where(m1 == m0, 1, m1 - m0), 0)
+    f = 10**(logf[idx] + t*(logf[np.minimum(idx + 1, len(freqs) - 1)] - logf[idx]))
+
+    return np.where(found, f, np.nan), idx, t
+
+
+#This function takes the frequencies and the complex response H (..., nf) at the output node and
+#returns a dictionary of arrays with the same measurements as Metrics.ac
+
+def acMeasure(freqs, H):
+
+    freqs = np.asarray(freqs, dtype = float)
+    mag = np.abs(H)
+    phase = np.unwrap(np.angle(H), axis = -1)*180/np.pi
+
+    peak = np.argmax(mag, axis = -1)
+    opMag = np.take_along_axis(mag, peak[..., None], -1)[..., 0]
+    opPhase = np.take_along_axis(phase, peak[..., None], -1)[..., 0]
+
+    cutoff1, _, _ = crossing(freqs, mag, opMag/np.sqrt(2), 1)
+    cutoff2, _, _ = crossing(freqs, mag, opMag/np.sqrt(2), 2)
+    unity, idx, t = crossing(freqs, mag, np.ones(opMag.shape), 1)
+
+    #phase at the unity gain frequency
+    p0 = np.take_along_axis(phase, idx[..., None], -1)[..., 0]
+    p1 = np.take_along_axis(phase, np.minimum(idx + 1, len(freqs) - 1)[..., None], -1)[..., 0]
+    unityPhase = p0 + t*(p1 - p0)
+
+    #ltSpice reports phases between -180 and 180
+    wrap = lambda deg: (deg + 180) % 360 - 180
+    opPhase = wrap(opPhase)
+    unityPhase = wrap(unityPhase)
+
+    margin = np.where(np.isnan(unity), 0, 180 - np.abs(unityPhase - opPhase))
+
+    return {"op_freq_gain": 20*np.log10(np.maximum(opMag, 1e-300)), "op_freq_phase": opPhase,
+            "3db_cutoff1": cutoff1, "3db_cutoff2": cutoff2, "unity_freq": unity, "phase_margin": margin}
+
+
+#This function finds where |H| crosses level inside the brackets [lo, hi] (log10 of the frequency,
+#shape (..., k) for k brackets per circuit where ... are the batch dimensions of J) to a relative
+#tolerance tol. mlo and mhi are |H| at the ends of the brackets, which have to be on opposite sides
+#of level. Every bracket is refined at once with the Illinois method: the next point is where the
+#straight line through the ends (in log |H|) crosses the level, so the bracket is always kept like
+#bisection, and an end that stays put twice in a row has its value halved so it can't get stuck.
+#Each iteration is one small signal solve per bracket. Returns the frequencies and H at them.
+
+def refine(topo, J, Cm, rhs, out, lo, hi, mlo, mhi, level, tol = 1e-4, maxIter = 50):
+
+    tolLog = np.log10(1 + tol)
+
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        glo = np.log(mlo) - np.log(level)
+        ghi = np.log(mhi) - np.log(level)
+
+    #brackets that don't hold a crossing (failed operating points) are left alone
+    active = np.isfinite(glo) & np.isfinite(ghi) & (np.sign(glo) != np.sign(ghi))
+    glo = np.where(active, glo, 1)
+    ghi = np.where(active, ghi, -1)
+    side = np.zeros(lo.shape, dtype = int)
+
+    for iteration in range(maxIter):
+
+        mid = lo + glo/(glo - ghi)*(hi - lo)
+        active &= (hi - lo) > tolLog
+        if not np.any(active):
+            break
+
+        H = acSolve(topo, J, Cm, 10**mid, rhs)[..., out]
+        with np.errstate(divide = "ignore"):
+            g = np.log(np.abs(H)) - np.log(level)
+        g = np.where(np.isfinite(g), g, 0)
+
+        #the new point replaces the end on its own side of the level
+        low = active & (np.sign(g) == np.sign(glo))
+        high = active & ~low
+
+        glo = np.where(high & (side == -1), glo/2, glo)
+        ghi = np.where(low & (side == 1), ghi/2, ghi)
+
+        lo = np.where(low, mid, lo)
+        glo = np.where(low, g, glo)
+        hi = np.where(high, mid, hi)
+        ghi = np.where(high, g, ghi)
+
+        side = np.where(low, 1, np.where(high, -1, side))
+
+    mid = lo + glo/(glo - ghi)*(hi - lo)
+    f = 10**mid
+
+    return f, acSolve(topo, J, Cm, f, rhs)[..., out]
+
+
+#returns the DC power drawn from the voltage sources of the circuit for the solution x
+
+def power(topo, vals, x):
+    return np.abs(np.sum(vals[..., topo.V["val"]]*x[..., topo.V["row"]], axis = -1))
+
+
+#Sensitivities are worked out with the adjoint method. The derivative of a response H = e^T X of
+#the system Y X = rhs with respect to a parameter p is -mu^T (dY/dp) X where mu solves the transposed
+#system Y^T mu = e. So a single extra solve per metric gives the derivative with respect to every
+#parameter at once instead of one re-simulation per parameter. Y also depends on the parameters
+#through the operating point (the device conductances and capacitances change with x), and that
+#part is brought back to the parameters with one more adjoint solve of the DC jacobian.
+
+
+#returns u^T (dA/dp) v (..., numParams) for every parameter p, where A = G + jwCm is the linear part
+#of the system. u and v are (..., size + 1) with a 0 in the ground entry and w is the angular frequency
+#(0 for the DC system). Only resistors, capacitors and inductors change A. Voltage sources only
+#change the right hand side
+
+def dLinear(topo, vals, u, v, w = 0):
+
+    w = np.asarray(w)
+    batch = np.broadcast_shapes(vals.shape[:-1], u.shape[:-1], v.shape[:-1], w.shape)
+
+    dA = np.zeros(batch + (topo.numParams,), dtype = complex)
+    w = w[..., None]
+
+    R = topo.R
+    dA[..., R["val"]] = -(u[..., R["a"]] - u[..., R["b"]])*(v[..., R["a"]] - v[..., R["b"]])/vals[..., R["val"]]**2
+
+    C = topo.C
+    dA[..., C["val"]] = 1j*w*(u[..., C["a"]] - u[..., C["b"]])*(v[..., C["a"]] - v[..., C["b"]])
+
+    L = topo.L
+    dA[..., L["val"]] = -1j*w*u[..., L["row"]]*v[..., L["row"]]
+
+    return dA
+
+
+#returns u^T (dY/dx_j) v (..., nf, size + 1) for every node j, which is how the small signal system
+#Y = J + jwCm moves with the operating point. Only the device stamps depend on x so they're
+#differentiated (with central differences of the device models, no solves) at every node a device
+#is connected to. u and v are (..., nf, size + 1) and w (..., nf).
+
+def dDevices(topo, x, u, v, w, h = 1e-6):
+
+    pins = np.concatenate((topo.D["a"], topo.D["b"], topo.Q["c"], topo.Q["b"], topo.Q["e"]))
+    cols = np.unique(pins[pins >= 0])
+
+    g = np.zeros(u.shape, dtype = complex)
+    if len(cols) == 0:
+        return g
+
+    #every +h and -h perturbation of the nodes is evaluated in one batch
+    N = x.shape[-1]
+    steps = np.zeros((2*len(cols), N))
+    steps[np.arange(len(cols)), cols] = h
+    steps[np.arange(len(cols)) + len(cols), cols] = -h
+
+    xp = x[..., None, :] + steps
+    Jp = np.zeros(xp.shape + (N,))
+    I, small = devices(topo, xp, Jp)
+    Cp = capacitance(topo, np.zeros(xp.shape[:-1] + (topo.numParams,)), small)
+
+    s = np.einsum("...fi,...kij,...fj->...fk", u, Jp, v) + 1j*np.asarray(w)[..., None]*np.einsum("...fi,...kij,...fj->...fk", u, Cp, v)
+    g[..., cols] = (s[..., :len(cols)] - s[..., len(cols):])/(2*h)
+
+    return g
+
+
+#This function returns the sensitivity of the measurements to every parameter. Takes in the
+#topology, the parameter values (..., numParams), the output node and the frequencies of the AC
+#sweep. Returns a dictionary mapping "op_freq_gain" (dB), "3db_cutoff1", "3db_cutoff2" (Hz) and
+#"DC Power" (W) to the array of derivatives (..., numParams), the measurements (like measure) and
+#the array of converged operating points. Derivatives that can't be worked out (the operating point
+#didn't converge or the cutoff wasn't found) are nan.
+
+#The gain is measured at the sampled peak of the sweep, which doesn't move for small changes, so
+#its derivative is the derivative of |H| at that frequency. A cutoff fc is where |H(fc)| equals the
+#peak over sqrt(2), so by implicit differentiation dfc/dp = (d|H(f0)|/dp/sqrt(2) - d|H(fc)|/dp)/(d|H|/df).
+
+def sensitivity(topo, vals, node, freqs):
+
+    freqs = np.asarray(freqs, dtype = float)
+    out = topo.index(node)
+    V = topo.V
+
+    x, J, small, converged = dcSolve(topo, vals)
+    Cm = capacitance(topo, vals, small)
+
+    rhs = np.zeros(topo.size + 1)
+    if topo.vin is not None:
+        rhs[topo.vin] = 1
+
+    X = acSolve(topo, J, Cm, freqs, rhs)
+    H = X[..., out]
+
+    measurements = acMeasure(freqs, H)
+    measurements["DC Power"] = power(topo, vals, x)
+
+    #the peak and both cutoffs, each with its own forward and adjoint solve
+    f0 = freqs[np.argmax(np.abs(H), axis = -1)]
+    fk = np.stack((f0, measurements["3db_cutoff1"], measurements["3db_cutoff2"]), axis = -1)
+    found = np.isfinite(fk)
+    fk = np.where(found, fk, f0[..., None])
+    wk = 2*np.pi*fk
+
+    e = np.zeros(topo.size + 1)
+    e[out] = 1
+
+    Xk = acSolve(topo, J, Cm, fk, rhs)
+    Mk = acSolve(topo, J, Cm, fk, e, adjoint = True)
+    Hk = Xk[..., out]
+
+    #the operating point terms of the three responses and the power all go through one solve with
+    #the transposed DC jacobian
+    c = np.zeros(x.shape)
+    c[..., V["row"]] = vals[..., V["val"]]
+    sources = np.concatenate((dDevices(topo, x, Mk, Xk, wk), c[..., None, :]), axis = -2)
+
+    n = topo.size
+    lam = np.zeros(sources.shape, dtype = complex)
+    lam[..., :n] = np.swapaxes(solve(np.swapaxes(J[..., :n, :n], -1, -2), np.swapaxes(sources[..., :n], -1, -2)), -1, -2)
+
+    #lam^T dF/dp where F = Gx - b + I(x) is the DC residual
+    dF = dLinear(topo, vals[..., None, :], lam, x[..., None, :])
+    dF[..., V["val"]] -= lam[..., V["row"]]
+
+    dH = -dLinear(topo, vals[..., None, :], Mk, Xk, wk) + dF[..., :3, :]
+    dMag = np.real(np.conj(Hk)[..., None]*dH)/np.abs(Hk)[..., None]
+
+    #how fast |H| falls with frequency at each cutoff
+    dHdw = -1j*np.einsum("...fi,...ij,...fj->...f", Mk, Cm, Xk)
+    dMagdf = 2*np.pi*np.real(np.conj(Hk)*dHdw)/np.abs(Hk)
+
+    #the power is |s| with s = sum of V*I over the sources
+    ds = np.zeros(vals.shape)
+    ds[..., V["val"]] = x[..., V["row"]]
+    ds = ds - np.real(dF[..., 3, :])
+    s = np.sum(vals[..., V["val"]]*x[..., V["row"]], axis = -1)
+
+    grads = {"op_freq_gain": 20/np.log(10)*dMag[..., 0, :]/np.abs(Hk[..., 0])[..., None],
+             "3db_cutoff1": (dMag[..., 0, :]/np.sqrt(2) - dMag[..., 1, :])/dMagdf[..., 1, None],
+             "3db_cutoff2": (dMag[..., 0, :]/np.sqrt(2) - dMag[..., 2, :])/dMagdf[..., 2, None],
+             "DC Power": np.sign(s)[..., None]*ds}
+
+    ok = {"op_freq_gain": converged, "3db_cutoff1": converged & found[..., 1],
+          "3db_cutoff2": converged & found[..., 2], "DC Power": converged}
+
+    for key in grads:
+        grads[key] = np.where(ok[key][..., None], grads[key], np.nan)
+
+    return grads, measurements, converged
+
+
+#turns a dictionary of measurement arrays into a list of dictionaries (one per individual) or a
+#single dictionary if there's no batch dimension. Failed measurements become None like in Metrics.
+
+def unpack(measurements, converged):
+
+    converged = np.asarray(converged)
+    flat = {key: np.broadcast_to(val, converged.shape).reshape(-1) for key, val in measurements.items()}
+    ok = converged.reshape(-1)
+
+    results = []
+    for index in range(len(ok)):
+        result = dict()
+        for key in flat:
+            val = flat[key][index]
+            result[key] = None if (not ok[index] or np.isnan(val)) else float(val)
+        results.append(result)
+
+    if converged.ndim == 0:
+        return results[0]
+
+    return results
+
+
+#This function does the same thing as Metrics.ac but with the MNA engine. Takes in the circuit,
+#the node to measure the output from and the starting frequency, number of frequencies and
+#stopping frequency of the (logarithmic) sweep. inNode is the node the 1 V AC source is connected to.
+#If tol is given the sweep is only a coarse one and the cutoffs and unity gain frequency are refined
+#to that relative tolerance (see measureAdaptive).
+
+def ac(circuit, node, start, numStep, stop, inNode = "N5", tol = None):
+
+    topo = Topology(circuit, inNode)
+    freqs = np.logspace(np.log10(start), np.log10(stop), numStep)
+
+    if tol is None:
+        X, x, converged = acSweep(topo, topo.values(circuit), freqs)
+        measurements = acMeasure(freqs, X[..., topo.index(node)])
+    else:
+        measurements, converged = measureAdaptive(topo, topo.values(circuit), node, freqs, tol)
+        del measurements["DC Power"]
+
+    measurements = unpack(measurements, converged)
+
+    #like in Metrics.ac, a phase margin that couldn't be measured is 0
+    if measurements["phase_margin"] is None:
+        measurements["phase_margin"] = 0
+
+    return measurements
+
+
+#This function does the same thing as Metrics.DCpow with the MNA engine
+
+def DCpow(circuit):
+
+    topo = Topology(circuit)
+    vals = topo.values(circuit)
+
+    x, J, small, converged = dcSolve(topo, vals)
+
+    return unpack({"DC Power": power(topo, vals, x)}, converged)
+
+
+#returns a dictionary with the DC voltage of every node in the circuit
+
+def op(circuit):
+
+    topo = Topology(circuit)
+    x, J, small, converged = dcSolve(topo, topo.values(circuit))
+
+    return {node: float(x[topo.index(node)]) for node in topo.nodes}
+
+
+#This function returns the sensitivities of a circuit (see sensitivity) with the same arguments as
+#ac. Every derivative array has one entry per parameter in the order of the parameter vector (every
+#component's params joined together in the order the components appear in the circuit, which is
+#also the column order of a Genome)
+
+def sensitivities(circuit, node, start, numStep, stop, inNode = "N5"):
+
+    topo = Topology(circuit, inNode)
+    freqs = np.logspace(np.log10(start), np.log10(stop), numStep)
+
+    grads, measurements, converged = sensitivity(topo, topo.values(circuit), node, freqs)
+
+    return grads
+
+
+#This function runs the DC and AC analyses for a whole batch of parameter vectors that share the
+#topology topo. vals has shape (population, numParams). Every Newton iteration and the AC sweep
+#are solved with one broadcast call over stacked (population, n, n) matrices (and
+#(population, frequencies, n, n) for the AC sweep). Returns a dictionary of measurement arrays
+#with the keys of Metrics.ac and Metrics.DCpow along with the array of converged operating points.
+
+def measure(topo, vals, node, freqs):
+
+    freqs = np.asarray(freqs, dtype = float)
+
+    X, x, converged = acSweep(topo, vals, freqs)
+    measurements = acMeasure(freqs, X[..., topo.index(node)])
+    measurements["DC Power"] = power(topo, vals, x)
+
+    return measurements, converged
+
+
+#This function finds the peak of |H| between lo and hi (log10 of the frequency, shape (...,) with the
+#batch dimensions of J) with a golden section search. The peak is flat so its height is known to
+#about tol long before its frequency is, and the search stops once the bracket is within sqrt(tol).
+#Returns the frequencies of the peaks and H at them.
+
+def peak(topo, J, Cm, rhs, out, lo, hi, tol = 1e-4, maxIter = 100):
+
+    tolLog = np.log10(1 + np.sqrt(tol))
+    ratio = (np.sqrt(5) - 1)/2
+
+    a = lo + (1 - ratio)*(hi - lo)
+    b = lo + ratio*(hi - lo)
+    ma = np.abs(acSolve(topo, J, Cm, 10**a[..., None], rhs)[..., 0, out])
+    mb = np.abs(acSolve(topo, J, Cm, 10**b[..., None], rhs)[..., 0, out])
+
+    for iteration in range(maxIter):
+
+        if not np.any(hi - lo > tolLog):
+            break
+
+        #the peak is on the side of the bigger of the two inner points. A nan (failed operating
+        #point) just keeps shrinking the bracket
+        left = ~(mb > ma)
+
+        hi = np.where(left, b, hi)
+        lo = np.where(left, lo, a)
+
+        new = np.where(left, lo + (1 - ratio)*(hi - lo), lo + ratio*(hi - lo))
+        mnew = np.abs(acSolve(topo, J, Cm, 10**new[..., None], rhs)[..., 0, out])
+
+        b, mb, a, ma = np.where(left, a, new), np.where(left, ma, mnew), np.where(left, new, b), np.where(left, mnew, mb)
+
+    f = 10**np.where(mb > ma, b, a)
+
+    return f, acSolve(topo, J, Cm, f[..., None], rhs)[..., 0, out]
+
+
+#This function is the adaptive version of measure. freqs is a coarse sweep that's only used to
+#find the peak and to bracket the cutoffs and the unity gain frequency, which are then refined
+#(see refine) to a relative tolerance tol. A few dozen frequencies per circuit give every crossing
+#more accurately than a dense sweep does. Crossings that happen between two points of the coarse
+#sweep (a narrow notch) aren't seen, so the coarse sweep still needs a handful of points per decade.
+
+def measureAdaptive(topo, vals, node, freqs, tol = 1e-4):
+
+    freqs = np.asarray(freqs, dtype = float)
+    out = topo.index(node)
+
+    x, J, small, converged = dcSolve(topo, vals)
+    Cm = capacitance(topo, vals, small)
+
+    rhs = np.zeros(topo.size + 1)
+    if topo.vin is not None:
+        rhs[topo.vin] = 1
+
+    H = acSolve(topo, J, Cm, freqs, rhs)[..., out]
+    mag = np.abs(H)
+
+    measurements = acMeasure(freqs, H)
+    measurements["DC Power"] = power(topo, vals, x)
+
+    #the peak lies between the neighbours of the biggest point of the sweep
+    top = np.argmax(mag, axis = -1)
+    logf = np.log10(freqs)
+    fop, Hop = peak(topo, J, Cm, rhs, out, logf[np.maximum(top - 1, 0)], logf[np.minimum(top + 1, len(freqs) - 1)], tol)
+
+    better = np.abs(Hop) > np.max(mag, axis = -1)
+    opMag = np.where(better, np.abs(Hop), np.max(mag, axis = -1))
+    measurements["op_freq_gain"] = 20*np.log10(np.maximum(opMag, 1e-300))
+    measurements["op_freq_phase"] = np.where(better, np.angle(Hop)*180/np.pi, measurements["op_freq_phase"])
+
+    #bracket the first and second crossing of the cutoff level and the first one of 1
+    levels = np.stack((opMag/np.sqrt(2), opMag/np.sqrt(2), np.ones(opMag.shape)), axis = -1)
+    crossings = [crossing(freqs, mag, levels[..., k], count) for k, count in enumerate([1, 2, 1])]
+
+    found = np.stack([np.isfinite(f) for f, idx, t in crossings], axis = -1)
+    idx = np.stack([idx for f, idx, t in crossings], axis = -1)
+
+    nxt = np.minimum(idx + 1, len(freqs) - 1)
+    mlo = np.take_along_axis(mag[..., None, :], idx[..., None], -1)[..., 0]
+    mhi = np.take_along_axis(mag[..., None, :], nxt[..., None], -1)[..., 0]
+
+    f, Hc = refine(topo, J, Cm, rhs, out, logf[idx], logf[nxt], np.where(found, mlo, np.nan), mhi, levels, tol)
+    f = np.where(found, f, np.nan)
+
+    measurements["3db_cutoff1"] = f[..., 0]
+    measurements["3db_cutoff2"] = f[..., 1]
+    measurements["unity_freq"] = f[..., 2]
+
+    #like acMeasure, the phases are between -180 and 180
+    unityPhase = np.angle(Hc[..., 2])*180/np.pi
+    measurements["phase_margin"] = np.where(found[..., 2], 180 - np.abs(unityPhase - measurements["op_freq_phase"]), 0)
+
+    return measurements, converged
+
+
+#This function evaluates a population of circuits with the MNA engine. Circuits are grouped by
+#topology (parameter only mutation never changes it so usually there's a single group) and each
+#group is solved as one batch. Returns a list with one dictionary per circuit, in the same order
+#as circuits, holding the measurements of both Metrics.ac and Metrics.DCpow. With tol the crossings
+#are refined like in ac.
+
+def evalPopulation(circuits, node, start, numStep, stop, inNode = "N5", tol = None):
+
+    freqs = np.logspace(np.log10(start), np.log10(stop), numStep)
+
+    #group the circuits by topology
+    groups = dict()
+    for index in range(len(circuits)):
+        topo = Topology(circuits[index], inNode)
+        if topo.key not in groups:
+            groups[topo.key] = (topo, [])
+        groups[topo.key][1].append(index)
+
+    results = [None]*len(circuits)
+
+    for topo, members in groups.values():
+
+        vals = np.stack([topo.values(circuits[index]) for index in members])
+        if tol is None:
+            measurements, converged = measure(topo, vals, node, freqs)
+        else:
+            measurements, converged = measureAdaptive(topo, vals, node, freqs, tol)
+
+        for index, result in zip(members, unpack(measurements, converged)):
+            if result["phase_margin"] is None:
+                result["phase_margin"] = 0
+            results[index] = result
+
+    return results
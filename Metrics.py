@@ -1,82 +1,129 @@
 import os
 import numpy as np
 import time
+import RawRead
+import Distortion
+import SimRunner
+import Instrument
+import NetList
 
 #Metrics submodule uses ltSpice simulator to simulate the circuit
 #and calculate metrics relevant to FoM score
 
+#path to the ltSpice executable. It can be changed with the LTSPICE environment variable (for
+#example to point at FakeSpice.py on machines without ltSpice)
+LTSPICE = os.environ.get("LTSPICE", "/Applications/LTspice.app/Contents/MacOS/LTspice")
+
+#seconds a simulation gets before it's killed and the number of times a failed simulation
+#is tried again with relaxed convergence options (see SimRunner)
+TIMEOUT = 120
+RETRIES = 1
+
+
+#returns the path (without extension) of the files for circuit ID
+#inside of the folder workDir
+
+def circPrefix(ID, workDir = "NetLists"):
+    return workDir + "/Circuit" + str(ID) + "/" + "Circuit" + str(ID)
+
+
+#runs ltSpice in batch mode on the cir file for circuit ID. file can be given to run
+#a different deck in the same folder. Raises a SimRunner.SimFailure if ltSpice hangs, crashes
+#or doesn't write a log file (even after being retried)
+
+def runSim(ID, workDir = "NetLists", file = None):
+
+    if file is None:
+        file = "Circuit" + str(ID) + ".cir"
+
+    job = SimRunner.SimJob(ID, workDir + "/Circuit" + str(ID), file)
+
+    Instrument.count("sim.runs")
+
+    try:
+        with Instrument.timer("sim"):
+            SimRunner.run(job, LTSPICE, TIMEOUT, RETRIES)
+    except SimRunner.SimFailure as failure:
+        Instrument.count("sim.failed." + failure.reason)
+        raise
+    finally:
+        Instrument.count("sim.retries", job.attempts - 1)
+
+
 #This function performs a transient analysis on the circuit
 #described in the file Netlists/Circuit{ID}/Circuit{ID}.cir
 #where ID is the unique identifier for the circuit
 #takes in the expected frequency of the output voltage signal
 #as well as the name of the node to measure the waveform from
 
-#creates a csv file called Circuit{ID}.csv in the same folder as the cir
-#file which contains the output waveform sampled at 100 equally spaced points
+#The circuit is simulated once for a single period of the input and the output waveform
+#is read straight out of the binary .raw file ltSpice writes (see RawRead). The waveform
+#is then sampled at 101 equally spaced points, which are the times the old .step sweep
+#measured it at. points can be lowered for a quicker, coarser look at the waveform (the time
+#step and the number of samples are both set from it).
 
-def tran(freq, ID, node):
+#workDir is the folder holding the Circuit{ID} folders. It defaults to NetLists but
+#parallel workers point it at their own scratch directory so that two evaluations
+#never touch the same files
+
+@Instrument.timed("tran")
+def tran(freq, ID, node, workDir = "NetLists", points = 100):
     
-    prefix = "NetLists/Circuit" + str(ID) + "/" + "Circuit" + str(ID)
+    prefix = circPrefix(ID, workDir)
 
-    #add commands for performing transient analysis
-    fcir = open(prefix + ".cir", "a")
+    #add commands for performing transient analysis. We limit the time step so that
+    #there are at least points points in the waveform
+    with Instrument.timer("tran.deck"):
+        fcir = open(prefix + ".cir", "r")
+        lines = fcir.readlines()
+        fcir.close()
 
-    fcir.write("Vin N5 0 sin(0, 1m, " + str(freq) + " )\n")
-    fcir.write(".tran 0 " + str(1/freq) + " " + str(1/(100*freq)) + "\n")
-    fcir.write(".param T = 0\n")
-    fcir.write(".meas tran result find V(" + node + ") at = T\n")
-    fcir.write(".step param T 0 " + str(1/freq) + " " + str(1/(100*freq)) + "\n")
+        lines.append("Vin N5 0 sin(0, 1m, " + str(freq) + " )\n")
+        lines.append(".tran 0 " + str(1/freq) + " 0 " + str(1/(points*freq)) + "\n")
 
-    fcir.close()
+        fcir = open(prefix + "tran.cir", "w")
+        fcir.writelines(lines)
+        fcir.close()
 
     #simulate the circuit using ltSpice
+    try:
+        runSim(ID, workDir, "Circuit" + str(ID) + "tran.cir")
 
-    os.system("cd NetLists/Circuit" + str(ID) + ";/Applications/LTspice.app/Contents/MacOS/LTspice -b Circuit" + str(ID) + ".cir")
+        #read the output waveform out of the raw file
+        with Instrument.timer("tran.read"):
+            raw = RawRead.read(prefix + "tran.raw")
 
-    #remove the raw files generated as we only need the error log file
-    os.remove(prefix + ".raw")
-    os.remove(prefix + ".op.raw")
+            times = np.arange(points + 1)/(points*freq)
+            samples = np.interp(times, raw.trace("time"), raw.trace("V(" + node + ")"))
 
-    #open up the log file and create a csv file where we will store the results from the transient analysis
-    flog = open(prefix +  ".log", "r", encoding = "utf-16-le")
+            raw.close()
 
-    fcsv = open(prefix + "trans.csv", "w")
+    #we only needed the waveform so everything ltSpice made can go, even if the simulation failed
+    finally:
+        with Instrument.timer("tran.cleanup"):
+            for ext in [".raw", ".op.raw", ".log", ".cir"]:
+                if os.path.exists(prefix + "tran" + ext):
+                    os.remove(prefix + "tran" + ext)
 
-    
-    logList = flog.readlines()
-
-    #we iterate through the log file
-    for index in range(len(logList)):
-
-        #and find where the measurements made are located
-        if ('Measurement: result\n' == logList[index]):
-            idx = index + 2
-
-            #then we write the value of the output at each time step
-            #and write it into the csv file
-            while(len(logList[idx].strip()) > 1):
-                
-                fcsv.write(",".join(logList[idx].split("\t")))
-                idx += 2
-            break
-    
-    fcsv.close()
-    flog.close()
-    
+    #after that we calculate the amount of distortion in the output
+    arr = np.column_stack((np.arange(len(times)), samples, times))
 
-    #once we have transferred the relevant information to the csv file,
-    #we can get rid of the log file
-    
-    os.remove(prefix + ".log")
+    return waveStats(arr, freq)
 
-    #after that we remove the command lines we added from the cir file
-    fcir = open(prefix + ".cir", "r+")
-    lines = fcir.readlines()
-    fcir.seek(0)
-    fcir.truncate()
-    fcir.writelines(lines[:-5])
 
-    fcir.close()
+#This function calculates the peak to peak swing and the distortion of the output waveform.
+#arr is an array with one row per sample whose 2nd column is the value of the output and
+#whose 3rd column is the time the sample was taken at. freq is the frequency of the input signal.
+#The samples have to cover one period with both end points, which is what tran and combined make.
+#Besides "distortion" it returns "THD", the total harmonic distortion Distortion.measure finds
+#from the spectrum of the same period
+
+def waveStats(arr, freq):
+
+    #the spectrum needs the whole period. Only the end point is left out, the same way
+    #as the sample it would repeat
+    with Instrument.timer("distortion"):
+        thd = Distortion.measure(arr[:, 1], endpoint = True)["THD"]
 
     #after that we calculate the amount of distortion in the output.
     #This measurement is more relevant for oscillators where you can get harmonic distortion
@@ -84,43 +131,23 @@ def tran(freq, ID, node):
     #between the expected output, which should be sinusoidal and the actual output and then divided
     #it by the peak to peak swing of the output so that larger signals don't get penalized more
 
-    #we load in the data collected from the log file on the output waveform
-    
-    arr = np.loadtxt(prefix + "trans.csv", delimiter = ",", dtype = float)
-
     #we then take off the last element because in ltSpice, transient simulations always end
     #with the value of the outing being 0 which could cause a huge jump in our measurement
     #and make the distortion seem higher than it actually is
     
     arr = arr[0:-2]
 
-    #we subtract off the mean from the output waveform to make it 0 mean
-    arr[:, 1] = arr[:, 1] - np.mean(arr[:, 1])
-
-    #then we measure the peak to peak
-    p2p = np.ptp(arr[:,1])
-
-    phase = 0
-
-    #we iterate through the array of output values
-    #and look for when the output cross the x axis
-    for index in range(len(arr[:, 2]) - 1):
-        if arr[index][1]*arr[index + 1][1] < 0:
-
-            #the phase would then just be the distance from this point
-            #to the origin multiplied by the angular frequency
-            
-            phase = arr[index + 1][2]*freq*2*np.pi
-            break
-    
+    #the measurement itself is done by Distortion.sineFit which can also measure a whole
+    #population of waveforms at once
+    with Instrument.timer("distortion"):
+        p2p, distortion = Distortion.sineFit(arr[:, 1], arr[:, 2], freq)
 
-    #after we get the phase we can measure the distance between the expected and actual output
-    
-    distortion = np.sum(np.absolute(arr[:,1] - 0.5*p2p*np.sin(arr[:,2]*freq*2*np.pi + phase)))/p2p
+    #plain floats like the measurements of ac and DCpow
+    p2p = float(p2p[0])
+    distortion = float(distortion[0])
+    thd = float(thd[0])
 
-    #and then remove the csv file since we got all of the relevant measurements from it
-    os.remove(prefix + "trans.csv")
-    return {"p2p": p2p, "distortion": distortion}
+    return {"p2p": p2p, "distortion": distortion, "THD": thd}
 
 
 #This function performs ac analysis on the circuit and measures the 
@@ -130,48 +157,113 @@ def tran(freq, ID, node):
 #the starting frequency, the number of frequencies to sample in the analysis, and
 #the stopping frequency. Returns a dictionary with the measurements
 
-def ac(ID, node, start, numStep, stop):
-
-    #get the step size from the number of steps given
-    step = (stop -  start)/numStep
+@Instrument.timed("ac")
+def ac(ID, node, start, numStep, stop, workDir = "NetLists"):
 
-    prefix = "NetLists/Circuit" + str(ID) + "/" + "Circuit" + str(ID)
+    prefix = circPrefix(ID, workDir)
     
-    fcir = open(prefix + ".cir", "a")
+    #the commands for getting the measurements go into a copy of the cir file (like tran) so the
+    #circuit's own deck is never changed
+    with Instrument.timer("ac.deck"):
+        fcir = open(prefix + ".cir", "r")
+        lines = fcir.readlines()
+        fcir.close()
 
-    #go into the circuit file and add in certain commands for getting the measurements
-    fcir.write("Vin N5 0 ac 1 sin\n")
+        lines.append("Vin N5 0 ac 1 sin\n")
+        lines += acCommands(node, start, numStep, stop)
 
-    fcir.write(".ac dec " + str(start) + " " + str(step) + " " + str(stop)+"\n")
-    fcir.write(".MEASURE AC op_point max mag(V(" + node + "))\n")
-    fcir.write(".MEASURE AC 3dB_cutoff1 when mag(V(" + node + ")) = (op_point/sqrt(2)) cross=1\n")
-    fcir.write(".MEASURE AC 3dB_cutoff2 when mag(V(" + node + ")) = (op_point/sqrt(2)) cross=2\n")
-    fcir.write(".MEASURE AC unity_freq when mag(V(" + node + ")) = 1\n")
-    fcir.write(".MEASURE AC unity_phase FIND V(N3) at unity_freq\n")
-        
-    fcir.close()
+        fcir = open(prefix + "ac.cir", "w")
+        fcir.writelines(lines)
+        fcir.close()
 
     #we run the AC analysis
-    os.system("cd NetLists/Circuit" + str(ID) + ";/Applications/LTspice.app/Contents/MacOS/LTspice -b Circuit" + str(ID) + ".cir")
+    try:
+        runSim(ID, workDir, "Circuit" + str(ID) + "ac.cir")
+
+        #open up the log file and read in the lines
+        with Instrument.timer("ac.parse"):
+            flog = open(prefix + "ac.log", "r", encoding = "utf-16-le")
+            logList = flog.readlines()
+            flog.close()
+
+            measurements = parseAC(logList)
+
+    #and once we get all of the measurements we can remove everything ltSpice made
+    finally:
+        for ext in [".raw", ".op.raw", ".log", ".cir"]:
+            if os.path.exists(prefix + "ac" + ext):
+                os.remove(prefix + "ac" + ext)
+    
+    return measurements
+
+#this function calculates the DC power for the circuit.Takes in the ID
+#for the circuit
 
-    #and remove the raw files
-    os.remove(prefix + ".op.raw")
-    os.remove(prefix + ".raw")
+@Instrument.timed("DCpow")
+def DCpow(ID, workDir = "NetLists"):
+
+    
+    #In ltSpice it doesn't look there's a command for calculating the total power of a circuit so
+    #I instead found the current going through each of the voltage sources in the circuit to get the
+    #power consumption.
+
+    
+    prefix = circPrefix(ID, workDir)
+    fcir = open(prefix + ".cir", "r")
 
-    #then we open up the cir file again and remove all of the commands
-    #we added in
-    fcir = open(prefix + ".cir", "r+")
     lines = fcir.readlines()
-    fcir.seek(0)
-    fcir.truncate()
-    fcir.writelines(lines[:-7])
+    voltages = readSources(lines)
+    fcir.close()
 
+    #we add in the .op command to get the DC operating points, in a copy of the cir file so the
+    #circuit's own deck is never changed
+    fcir = open(prefix + "op.cir", "w")
+    fcir.writelines(lines + ["\n.op\n"])
     fcir.close()
 
-    #open up the log file and read in the lines
-    flog = open(prefix +  ".log", "r", encoding = "utf-16-le")
-    
-    logList = flog.readlines()
+    #run the simulation. The .op command only produces a .raw file which we don't need
+    try:
+        runSim(ID, workDir, "Circuit" + str(ID) + "op.cir")
+
+        #go through each line of the log file
+        with Instrument.timer("DCpow.parse"):
+            flog = open(prefix + "op.log", "r", encoding = "utf-16-le")
+
+            power = parsePower(flog.readlines(), voltages)
+
+            flog.close()
+
+    finally:
+        for ext in [".raw", ".log", ".cir"]:
+            if os.path.exists(prefix + "op" + ext):
+                os.remove(prefix + "op" + ext)
+
+    #and return the total power consumed
+    return {"DC Power": power}
+
+
+
+#this function returns the lines that are added to a cir file to run the ac analysis
+#and make the measurements that ac and combined read back out of the log file
+
+def acCommands(node, start, numStep, stop):
+
+    #.ac dec takes the number of points per decade, so we spread the numStep points given
+    #over the decades between start and stop
+    perDecade = max(int(np.ceil(numStep/max(np.log10(stop/start), 1e-9))), 1)
+
+    return [".ac dec " + str(perDecade) + " " + str(start) + " " + str(stop)+"\n",
+            ".MEASURE AC op_point max mag(V(" + node + "))\n",
+            ".MEASURE AC 3dB_cutoff1 when mag(V(" + node + ")) = (op_point/sqrt(2)) cross=1\n",
+            ".MEASURE AC 3dB_cutoff2 when mag(V(" + node + ")) = (op_point/sqrt(2)) cross=2\n",
+            ".MEASURE AC unity_freq when mag(V(" + node + ")) = 1\n",
+            ".MEASURE AC unity_phase FIND V(" + node + ") at unity_freq\n"]
+
+
+#this function takes in the lines of an ltSpice log file and returns the dictionary of
+#ac measurements
+
+def parseAC(logList):
 
     #initialize the measurements dictionary
     measurements = {"op_freq_gain": None, "op_freq_phase": None, "3db_cutoff1": None, "3db_cutoff2": None, "unity_freq": None, "phase_margin": 0}
@@ -186,6 +278,7 @@ def ac(ID, node, start, numStep, stop):
             #if it does then we check if ltSpice was successful in getting the measurement
             if "FAIL'ed" in line:
                 #if not we skip the measurement
+                Instrument.count("measure.failed")
                 continue
 
             #else we process that line and extract the measurement
@@ -196,6 +289,7 @@ def ac(ID, node, start, numStep, stop):
 
         elif "unity_phase" in line:
             if "FAIL'ed" in line or measurements["op_freq_phase"]  == None:
+                Instrument.count("measure.failed")
                 continue
             
             readIn = line.split(",")[1]
@@ -206,84 +300,307 @@ def ac(ID, node, start, numStep, stop):
             for measurement in list(measurements.keys())[2:-1]:
                 if measurement in line:
                     if "FAIL'ed" in line:
+                        Instrument.count("measure.failed")
                         break
                     measurements[measurement] = float(line.split(" ")[-1])
                     break
 
-    #and once we get all of the measurements we can remove the log file
-    flog.close()
-    os.remove(prefix + ".log")
-    
     return measurements
 
-#this function calculates the DC power for the circuit.Takes in the ID
-#for the circuit
-
-def DCpow(ID):
 
-    
-    #In ltSpice it doesn't look there's a command for calculating the total power of a circuit so
-    #I instead found the current going through each of the voltage sources in the circuit to get the
-    #power consumption.
+#this function takes in the lines of a cir file and returns a dictionary mapping the
+#(lower case) name of each voltage source to its DC value
 
-    
-    prefix = "NetLists/Circuit" + str(ID) + "/" + "Circuit" + str(ID)
-    fcir = open(prefix + ".cir", "r+")
+def readSources(lines):
 
-    lines = fcir.readlines()
     #we keep track of the names of the voltage sources in a dictionary
     voltages = dict()
 
     #we go through each of the lines in the cir file
-    for index in range(len(lines[6:])):
+    for line in lines:
         
         #if line starts with V then it's describing a voltage source
-        if lines[index][0] == "V":
-            li = lines[index].split(" ")
+        if line[0] == "V":
+            li = line.split(" ")
 
             #so we add a mapping from the voltage source name to its DC value
             #to the dictionary
             voltages[li[0].lower()] = float(li[4])
 
-    #we add in the .op command to get the DC operating points
-    fcir.write("\n.op")
-    fcir.close()
+    return voltages
 
-    #run the simulation and remove the .raw file .op command only produces one of these files which
-    #is pretty interesting
 
-    os.system("cd NetLists/Circuit" + str(ID) + ";/Applications/LTspice.app/Contents/MacOS/LTspice -b Circuit" + str(ID) + ".cir")
+#this function takes in the lines of an ltSpice log file containing the operating point
+#and the voltage sources returned by readSources and returns the total DC power
 
-    os.remove(prefix + ".raw")
-    
-    power = 0
+def parsePower(logList, voltages):
 
-    #go through each line of the log file
-    flog = open(prefix + ".log", "r", encoding = "utf-16-le")
+    power = 0
 
-    lines = flog.readlines()
-    for index in range(len(lines)):
+    for line in logList:
 
         #if the line is describing the current going through one of the voltage sources
-        if lines[index][0:3] == "I(V":
+        if line[0:3] == "I(V":
+
+            readIn = line.split()
+            name = readIn[0][2:-1].lower()
+
+            #sources that were added for the analyses (like Vin) aren't part of the circuit
+            if name not in voltages:
+                continue
 
-            readIn = lines[index].split()
             #we get the current going through that voltage source and multiply it by
             #the voltage of the voltage source to get the power consumed by the source
-            power += float(voltages[readIn[0][2:-1].lower()])*float(readIn[1])
+            power += float(voltages[name])*float(readIn[1])
 
-    flog.close()
-    
-    os.remove(prefix + ".log")
+    return abs(power)
 
-    #after that we remove the .op file
-    fcir = open(prefix + ".cir", "r+")
-    lines = fcir.readlines()
-    fcir.seek(0)
-    fcir.truncate()
-    fcir.writelines(lines[:-2])
 
-    fcir.close()
+#This function runs every analysis for a circuit in two ltSpice runs instead of the three
+#that calling tran, ac and DCpow one after the other takes. ltSpice only runs one analysis
+#per deck, so there's an .ac deck (Circuit{ID}allac.cir) and a .tran deck (alltran.cir), which
+#are run at the same time (see runDecks). The .op isn't needed: a transient run starts from the DC operating point, so
+#the current through each voltage source at time 0 (measured with .meas tran like in
+#stepped) gives the DC power. The original cir file is never touched and only the log
+#files are read back.
 
-    #and return the total power consumed
-    return {"DC Power": abs(power)}
+#Rather than stepping the transient simulation 100 times like tran does, the waveform
+#is sampled with 101 .meas statements on a single transient run.
+
+#Takes in the same arguments as tran and ac and returns a dictionary holding all
+#of the measurements returned by tran, ac and DCpow.
+
+#If deck (the netlist as a string, from NetList.render) is given then it's used instead of reading
+#the cir file. Along with a workDir like NetList.TMPFS, the only files written are the decks handed to ltSpice
+
+@Instrument.timed("combined")
+def combined(freq, ID, node, start, numStep, stop, workDir = "NetLists", deck = None):
+
+    prefix = circPrefix(ID, workDir)
+
+    if deck is None:
+        fcir = open(prefix + ".cir", "r")
+        lines = fcir.readlines()
+        fcir.close()
+    else:
+        os.makedirs(os.path.dirname(prefix), exist_ok = True)
+        lines = deck.splitlines(keepends = True)
+
+    voltages = readSources(lines)
+
+    lines = lines + ["\nVin N5 0 sin(0, 1m, " + str(freq) + ") ac 1\n"]
+
+    #the times we sample the output waveform at
+    times = np.arange(101)/(100*freq)
+
+    tranCommands = [".tran 0 " + str(1/freq) + " " + str(1/(100*freq)) + "\n"]
+    for index in range(len(times)):
+        tranCommands.append(".meas tran sample" + str(index) + " find V(" + node + ") at = " + str(times[index]) + "\n")
+    for name in voltages:
+        tranCommands.append(".meas tran i_" + name + " find I(" + name + ") at = 0\n")
+
+    logs = runDecks(ID, workDir, {"allac": lines + acCommands(node, start, numStep, stop), "alltran": lines + tranCommands})
+    logList = logs["alltran"]
+
+    with Instrument.timer("combined.parse"):
+        measurements = parseAC(logs["allac"])
+
+        #pull the samples of the output waveform and the source currents out of the log file.
+        #The lines look like sample{index}: v(node)=value at time and i_{source}: i(source)=value at 0
+        samples = np.full(len(times), np.nan)
+        power = 0
+
+        for line in logList:
+            if line.startswith("sample") or line.startswith("i_"):
+                if "FAIL'ed" in line:
+                    Instrument.count("measure.failed")
+                    continue
+                name = line.split(":")[0]
+                val = float(line.split("=")[1].split()[0])
+                if name.startswith("sample"):
+                    samples[int(name[len("sample"):])] = val
+                elif name[2:] in voltages:
+                    power += voltages[name[2:]]*val
+
+        measurements["DC Power"] = abs(power)
+
+    arr = np.column_stack((np.arange(len(times)), samples, times))
+
+    measurements.update(waveStats(arr, freq))
+
+    return measurements
+
+
+#takes in a dictionary mapping names to the lines of a deck, writes each deck into
+#Circuit{ID}{name}.cir in the circuit's folder and runs them all at the same time with a
+#SimRunner.SimRunner (ltSpice runs a deck on a single core, so the .ac and .tran decks of a circuit
+#take about as long as the slower of the two). Returns a dictionary mapping each name to the lines
+#of its log file. Everything ltSpice made for the decks (and the decks themselves) is removed
+#afterwards. Raises the SimFailure of the first deck that failed
+
+def runDecks(ID, workDir, decks):
+
+    prefix = circPrefix(ID, workDir)
+
+    jobs = []
+    for name, lines in decks.items():
+        fcir = open(prefix + name + ".cir", "w")
+        fcir.writelines(lines)
+        fcir.close()
+        jobs.append(SimRunner.SimJob(ID, workDir + "/Circuit" + str(ID), "Circuit" + str(ID) + name + ".cir"))
+
+    Instrument.count("sim.runs", len(jobs))
+
+    try:
+        with Instrument.timer("sim"):
+            results = SimRunner.SimRunner(LTSPICE, len(jobs), TIMEOUT, RETRIES).runBatch(jobs)
+
+        for job in jobs:
+            Instrument.count("sim.retries", job.attempts - 1)
+
+        failures = [result for result in results if isinstance(result, SimRunner.SimFailure)]
+        for failure in failures:
+            Instrument.count("sim.failed." + failure.reason)
+        if len(failures) > 0:
+            raise failures[0]
+
+        logs = dict()
+        for name in decks:
+            flog = open(prefix + name + ".log", "r", encoding = "utf-16-le")
+            logs[name] = flog.readlines()
+            flog.close()
+
+    finally:
+        for name in decks:
+            for ext in [".raw", ".op.raw", ".log", ".cir"]:
+                if os.path.exists(prefix + name + ext):
+                    os.remove(prefix + name + ext)
+
+    return logs
+
+
+#This function evaluates a whole population that shares one topology with as few ltSpice runs as
+#possible. Instead of launching ltSpice (and parsing the models, writing files...) once per circuit,
+#up to batch circuits are put in one stepped netlist (see NetList.stepped) whose component values are
+#.param symbols stepped through with .step param run list. Since ltSpice only runs one analysis per
+#deck, the netlist is simulated twice, so every batch takes two runs. The runs measure the same things
+#as combined: the ac measurements, then the output waveform through 101 .meas tran samples and the
+#current through each voltage source at time 0, which is its DC operating point current, for the DC power.
+
+#ltSpice prints the .meas results of a stepped run as one table per measurement with a row per step,
+#and parseSteps pulls the rows back out so each circuit gets its own measurements. A step that's
+#missing from a table (because the measurement failed) gets None like in ac.
+
+#Takes in the same arguments as combined (with the list of circuits instead of an ID) and returns a
+#list of measurement dictionaries in the same order as circuits.
+
+@Instrument.timed("stepped")
+def stepped(circuits, freq, node, start, numStep, stop, workDir = "NetLists", batch = 64):
+
+    results = []
+
+    for first in range(0, len(circuits), batch):
+        results += steppedBatch(circuits[first:first + batch], freq, node, start, numStep, stop, workDir)
+
+    return results
+
+
+def steppedBatch(circuits, freq, node, start, numStep, stop, workDir):
+
+    ID = "Step" + str(circuits[0].ID)
+    prefix = circPrefix(ID, workDir)
+    os.makedirs(os.path.dirname(prefix), exist_ok = True)
+
+    #names of the voltage sources of the circuit in the deck
+    sources = [("v" + comp.name).lower() for comp in circuits[0].components if comp.kind == "Vsource"]
+
+    vin = "Vin N5 0 sin(0, 1m, " + str(freq) + ") ac 1\n"
+
+    #ltSpice only runs one analysis per deck so the stepped netlist is simulated twice: once with the
+    #.ac measurements and once with the .tran ones (the samples of the output waveform and the current
+    #through each voltage source at time 0)
+    tranCommands = [vin, ".tran 0 " + str(1/freq) + " " + str(1/(100*freq)) + "\n"]
+
+    times = np.arange(101)/(100*freq)
+    for index in range(len(times)):
+        tranCommands.append(".meas tran sample" + str(index) + " find V(" + node + ") at = " + str(times[index]) + "\n")
+    for name in sources:
+        tranCommands.append(".meas tran i_" + name + " find I(" + name + ") at = 0\n")
+
+    with Instrument.timer("stepped.deck"):
+        body = NetList.stepped(circuits, ID)
+
+    logs = runDecks(ID, workDir, {"stepac": [body, vin] + acCommands(node, start, numStep, stop), "steptran": [body] + tranCommands})
+
+    with Instrument.timer("stepped.parse"):
+        tables = parseSteps(logs["stepac"])
+        tables.update(parseSteps(logs["steptran"]))
+
+        results = []
+
+        for run in range(1, len(circuits) + 1):
+
+            #turn this step's rows back into the lines parseAC reads out of a normal log
+            lines = []
+            for name in ["op_point", "unity_phase"]:
+                row = tables.get(name, dict()).get(run)
+                lines.append(name + ": step=" + row[0] + "\n" if row is not None else "Measurement \"" + name + "\" FAIL'ed\n")
+            for name in ["3db_cutoff1", "3db_cutoff2", "unity_freq"]:
+                row = tables.get(name, dict()).get(run)
+                lines.append(name + ": step AT " + row[-1] + "\n" if row is not None else "Measurement \"" + name + "\" FAIL'ed\n")
+
+            #unity_phase has to come after op_point
+            measurements = parseAC([lines[0], lines[2], lines[3], lines[4], lines[1]])
+
+            circuit = circuits[run - 1]
+            power = 0
+            for comp in circuit.components:
+                if comp.kind == "Vsource":
+                    row = tables.get("i_" + ("v" + comp.name).lower(), dict()).get(run)
+                    if row is not None:
+                        power += float(comp.params[0])*float(row[0])
+            measurements["DC Power"] = abs(power)
+
+            samples = np.array([float(tables["sample" + str(index)][run][0]) if run in tables.get("sample" + str(index), dict()) else np.nan
+                                for index in range(len(times))])
+
+            arr = np.column_stack((np.arange(len(times)), samples, times))
+            measurements.update(waveStats(arr, freq))
+
+            results.append(measurements)
+
+    return results
+
+
+#this function reads the .meas tables of a stepped ltSpice log. Each table starts with a
+#"Measurement: name" line and a header, followed by one row per step holding the step number
+#and the values. Returns a dictionary mapping each (lower case) measurement name to a dictionary
+#mapping the step number to the list of values in its row
+
+def parseSteps(logList):
+
+    tables = dict()
+    current = None
+
+    for line in logList:
+
+        if line.startswith("Measurement:"):
+            current = tables.setdefault(line.split(":", 1)[1].strip().lower(), dict())
+            continue
+
+        words = line.split()
+
+        if current is None or len(words) == 0:
+            current = None
+            continue
+
+        if not words[0].isdigit():
+            continue
+
+        if "FAIL'ed" in line:
+            Instrument.count("measure.failed")
+            continue
+
+        current[int(words[0])] = words[1:]
+
+    return tables
@@ -0,0 +1,355 @@
+import numpy as np
+import Genome
+import Instrument
+
+#NSGA submodule is a multi-objective alternative to collapsing every metric into one FoM. Like the
+#README says, gain, bandwidth, distortion and power pull against each other, and any single weighting
+#of them hides the trade-offs (and has to be rerun whenever the weights change). NSGA-II keeps the
+#objectives separate and evolves the whole Pareto front at once, so a single run gives every
+#trade-off.
+
+#Everything works on an (n, m) array of objective values with one row per individual and one column
+#per objective. Internally every objective is minimized (objectives that should be maximized are
+#negated by objectives) and measurements that couldn't be made become +inf so they lose to anything.
+#Non-dominated sorting and crowding distance are array operations over the whole population rather
+#than loops over pairs of individuals.
+
+#Input impedance isn't measured by Metrics or MNA yet so it isn't in the default objectives.
+#Distortion only comes out of the transient analysis (Metrics.tran, Transient) and not out of
+#MNA.evalPopulation, so it isn't either. Add ("distortion", "min") to the spec when the evaluator
+#runs the transient.
+
+
+#default objectives as (measurement key, "max" or "min") pairs. 3db_cutoff2 is the upper cutoff
+#frequency, which sets the bandwidth
+OBJECTIVES = [("op_freq_gain", "max"), ("3db_cutoff2", "max"), ("DC Power", "min")]
+
+
+#This function turns a list of measurement dictionaries (from Parallel.evalPopulation,
+#MNA.evalPopulation...) into the (n, m) array of objectives to minimize
+
+def objectives(measurements, spec = OBJECTIVES):
+
+    F = np.full((len(measurements), len(spec)), np.inf)
+
+    for row in range(len(measurements)):
+
+        m = measurements[row]
+        if "failure" in m:
+            continue
+
+        for col, (key, sense) in enumerate(spec):
+            val = m.get(key)
+            if val is None or not np.isfinite(val):
+                continue
+            F[row, col] = -val if sense == "max" else val
+
+    return F
+
+
+#returns the (n, n) boolean matrix whose entry (i, j) is True when individual i dominates individual j:
+#it's no worse in every objective and better in at least one
+
+def dominance(F):
+
+    F = np.asarray(F, dtype = float)
+
+    noWorse = np.all(F[:, None, :] <= F[None, :, :], axis = -1)
+    better = np.any(F[:, None, :] < F[None, :, :], axis = -1)
+
+    return noWorse & better
+
+
+#This function performs fast non-dominated sorting. Returns the array of ranks (0 is the Pareto
+#front, 1 the front behind it and so on). Each front is peeled off in one step: the individuals that
+#nobody left dominates form the next front, and their columns are taken out of the domination counts
+
+def sort(F):
+
+    D = dominance(F)
+    n = len(D)
+
+    count = np.sum(D, axis = 0)
+    ranks = np.full(n, -1)
+    left = np.ones(n, dtype = bool)
+
+    rank = 0
+    while np.any(left):
+
+        front = left & (count == 0)
+
+        ranks[front] = rank
+        left &= ~front
+        count = count - np.sum(D[front], axis = 0)
+
+        rank += 1
+
+    return ranks
+
+
+#This function returns the crowding distance of every individual within its front: for every
+#objective, the gap between its two neighbours in that front divided by the range of the front,
+#summed over the objectives. The ends of each front get an infinite distance so they're always kept
+
+def crowding(F, ranks):
+
+    F = np.asarray(F, dtype = float)
+    n, m = F.shape
+    dist = np.zeros(n)
+
+    for rank in np.unique(ranks):
+
+        members = np.flatnonzero(ranks == rank)
+        if len(members) <= 2:
+            dist[members] = np.inf
+            continue
+
+        vals = F[members]
+        order = np.argsort(vals, axis = 0, kind = "stable")
+        sortedVals = np.take_along_axis(vals, order, 0)
+
+        #failed individuals have infinite objectives so the differences can be inf - inf
+        with np.errstate(invalid = "ignore"):
+            span = sortedVals[-1] - sortedVals[0]
+            ok = np.isfinite(span) & (span > 0)
+
+            gap = np.zeros_like(sortedVals)
+            gap[1:-1] = np.where(ok, (sortedVals[2:] - sortedVals[:-2])/np.where(ok, span, 1), 0)
+        gap[0] = np.inf
+        gap[-1] = np.inf
+
+        #put every gap back in the row of the individual it belongs to and add up over the objectives
+        contrib = np.zeros_like(gap)
+        np.put_along_axis(contrib, order, gap, 0)
+        dist[members] = np.sum(contrib, axis = 1)
+
+    return dist
+
+
+#returns the indices of the individuals from best to worst by the crowded comparison: lower rank
+#first and then larger crowding distance
+
+def order(ranks, dist):
+    return np.lexsort((-dist, ranks))
+
+
+#This function performs the NSGA-II environmental selection: returns the indices of the num
+#individuals that survive, filling up front by front and breaking the last front by crowding distance
+
+def select(F, num):
+
+    ranks = sort(F)
+    dist = crowding(F, ranks)
+
+    return order(ranks, dist)[:num]
+
+
+#returns a fitness array (higher is better) that ranks individuals by the crowded comparison so
+#that Genome.select can be used for mating selection
+
+def fitness(F):
+
+    ranks = sort(F)
+    dist = crowding(F, ranks)
+
+    fit = np.empty(len(ranks))
+    fit[order(ranks, dist)] = np.arange(len(ranks), 0, -1)
+
+    return fit
+
+
+#returns the rows of F that aren't dominated by any other row (and aren't duplicates of an earlier row)
+
+def nonDominated(F):
+
+    F = np.asarray(F, dtype = float)
+    if len(F) == 0:
+        return F
+
+    F = np.unique(F, axis = 0)
+
+    return F[~np.any(dominance(F), axis = 0)]
+
+
+#This function returns the hypervolume of the region dominated by the points F and bounded by the
+#reference point ref (every objective minimized). Points that don't dominate ref don't count. Two
+#objectives are done with a single sort and more are sliced along the last objective, working out
+#the hypervolume of each slice in one less dimension
+
+def hypervolume(F, ref):
+
+    F = np.asarray(F, dtype = float)
+    ref = np.asarray(ref, dtype = float)
+
+    F = F[np.all(F < ref, axis = 1)] if len(F) > 0 else F
+    if len(F) == 0:
+        return 0.0
+
+    m = F.shape[1]
+
+    if m == 1:
+        return float(ref[0] - np.min(F[:, 0]))
+
+    F = nonDominated(F)
+
+    if m == 2:
+        F = F[np.argsort(F[:, 0])]
+        heights = np.minimum.accumulate(F[:, 1])
+        widths = np.diff(np.append(F[:, 0], ref[0]))
+        return float(np.sum(widths*(ref[1] - heights)))
+
+    F = F[np.argsort(F[:, -1])]
+    bounds = np.append(F[1:, -1], ref[-1])
+
+    volume = 0.0
+    for index in range(len(F)):
+        depth = bounds[index] - F[index, -1]
+        if depth > 0:
+            volume += depth*hypervolume(F[:index + 1, :-1], ref[:-1])
+
+    return volume
+
+
+##########################################################Hypervolume Class##########################################################
+
+#The Hypervolume class keeps track of the hypervolume of everything seen during a run without
+#recomputing it from scratch every generation. It keeps an archive of the non-dominated points. When
+#a point is added, the volume it adds is the volume of its box (from the point to ref) minus the part
+#of that box the archive already covers, which is the hypervolume of the archive clipped to the box.
+
+####Class Attributes####
+
+##ref: the reference point
+
+##archive: (k, m) array of the non-dominated points seen so far
+
+##volume: hypervolume of the archive
+
+####Class Methods####
+
+##add: adds points (an (n, m) array) and returns how much the hypervolume grew
+
+
+class Hypervolume:
+
+    def __init__(self, ref):
+
+        self.ref = np.asarray(ref, dtype = float)
+        self.archive = np.zeros((0, len(self.ref)))
+        self.volume = 0.0
+
+    def add(self, F):
+
+        F = nonDominated(np.atleast_2d(np.asarray(F, dtype = float)))
+        F = F[np.all(F < self.ref, axis = 1)] if len(F) > 0 else F
+
+        start = self.volume
+
+        for point in F:
+
+            #points the archive already dominates (or matches) add nothing
+            if len(self.archive) > 0 and np.any(np.all(self.archive <= point, axis = 1)):
+                continue
+
+            box = float(np.prod(self.ref - point))
+            covered = hypervolume(np.maximum(self.archive, point), self.ref) if len(self.archive) > 0 else 0.0
+            self.volume += box - covered
+
+            #the new point pushes out the archive points it dominates
+            keep = ~np.all(point <= self.archive, axis = 1)
+            self.archive = np.vstack((self.archive[keep], point))
+
+        return self.volume - start
+
+
+#This function runs NSGA-II.
+
+#genome: Genome holding the initial population
+#evaluate: takes in a list of circuits and returns a list of measurement dictionaries (for example
+#lambda circuits: Parallel.evalPopulation(circuits, analyses) or MNA.evalPopulation)
+#spec: objectives (see OBJECTIVES)
+#generations: number of generations to run
+#factor, pm, crossover, pc: variation settings, the same as GA.SteadyState
+#ref: reference point for the hypervolume (in the minimized objectives). By default it's the worst
+#finite value of every objective in the initial population, pushed out by 10%
+
+#Objectives that the evaluator doesn't measure for any individual of the initial population are
+#dropped from spec since every individual would tie on them (and a default reference point of 0
+#would make the hypervolume 0). A ValueError is raised if that leaves none.
+
+#The Instrument stats are closed out (see Instrument.generation) after the initial population is
+#evaluated (generation 0) and after every generation.
+
+#Returns a dictionary holding the final population (genome), its objectives (F, as minimized),
+#its measurements, the indices of its Pareto front (front), the hypervolume after every
+#generation (history) and the objectives that were used (spec)
+
+def run(genome, evaluate, spec = OBJECTIVES, generations = 50, factor = 0.1, pm = 0.2, crossover = "uniform",
+        pc = 0.9, k = 2, ref = None, seed = None):
+
+    rng = np.random.default_rng(seed)
+    size = len(genome)
+
+    measurements = evaluate(genome.circuits())
+    F = objectives(measurements, spec)
+
+    measured = [col for col in range(len(spec)) if any(spec[col][0] in m for m in measurements)]
+    if len(measured) == 0:
+        raise ValueError("none of the objectives are measured by evaluate")
+
+    if len(measured) < len(spec):
+        spec = [spec[col] for col in measured]
+        F = F[:, measured]
+        if ref is not None:
+            ref = np.asarray(ref)[measured]
+
+    if ref is None:
+        finite = np.where(np.isfinite(F), F, np.nan)
+        worst = np.nanmax(finite, axis = 0)
+        best = np.nanmin(finite, axis = 0)
+        ref = np.where(np.isfinite(worst), worst + 0.1*np.maximum(worst - best, np.abs(worst)), 0)
+
+    hv = Hypervolume(ref)
+    hv.add(F)
+    history = [hv.volume]
+
+    Instrument.generation(0)
+
+    for gen in range(generations):
+
+        #mating selection by crowded comparison tournaments
+        fit = fitness(F)
+        parentsA = genome.select(fit, size, "tournament", k, rng)
+        parentsB = genome.select(fit, size, "tournament", k, rng)
+
+        children = genome.params[parentsA].copy()
+        cross = rng.uniform(0, 1, size) < pc
+        if np.any(cross):
+            children[cross] = genome.crossover(parentsA[cross], parentsB[cross], crossover, rng = rng)
+
+        offspring = Genome.Genome(genome.template, children)
+        offspring.mutate(factor, pm, rng)
+
+        childMeasurements = evaluate(offspring.circuits())
+        childF = objectives(childMeasurements, spec)
+
+        hv.add(childF)
+        history.append(hv.volume)
+
+        #parents and children compete for the places in the next generation
+        allF = np.vstack((F, childF))
+        allParams = np.vstack((genome.params, offspring.params))
+        allMeasurements = measurements + childMeasurements
+
+        keep = select(allF, size)
+
+        genome = Genome.Genome(genome.template, allParams[keep])
+        F = allF[keep]
+        measurements = [allMeasurements[index] for index in keep]
+
+        Instrument.generation(gen + 1)
+
+    ranks = sort(F)
+
+    return {"genome": genome, "F": F, "measurements": measurements, "front": np.flatnonzero(ranks == 0),
+            "history": history, "hypervolume": hv, "spec": spec}
@@ -0,0 +1,161 @@
+import os
+import time
+import subprocess
+import tempfile
+import numpy as np
+import CirComp as Cir
+import SimRunner
+
+#NetList submodule renders the netlist of a circuit into a string in memory instead of writing it
+#line by line into a file. Building every line of every circuit through Component.netList is slow
+#when it has to be done for a whole population every generation, but circuits with the same
+#topology only differ in their parameter values. So the first time we see a topology we compile
+#it into a Template (a single format string with a slot for every parameter) and after that
+#rendering a circuit is one call to str.format.
+
+#model definitions written at the top of every netlist
+MODELS = ("*MODEL DEFINITIONS\n"
+          ".model 2N2222 NPN(IS = 1E-14 VAF = 100 BF = 200 IKF = 0.3 XTB = 1.5 BR = 3 CJC = 8E-12 CJE = 25E-12 TR=100E-9 TF=400E-12 ITF=1 VTF = 2 XTF=3 RB=10 RC=.3 RE=.2 Vceo=30 lcrating=800m mfg=N)\n"
+          ".model 1N4148 D(Is=2.52n Rs=.568 N=1.752 Cjo=4p M=.4 tt=20n lave=200m Vpk=75 mfg=OnSemi type=silicon\n"
+          ".model 2N3906 PNP(Is=1E-14 VAF=100 BF=200 IKF=0.4 XTB=1.5 BR=4 CJC=4.5E-12 CJE=10E-12 RB=20 RC=0.1 RE=0.1 TR=250E-9 TF=350E-12 ITF=1 VTF=2 XTF=3 Vceo=40 lcrating=200m mfg=NXP\n")
+
+#folder that decks are written to when they have to be on disk. /dev/shm is kept in memory on
+#Linux so writing there never touches the disk
+TMPFS = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+##########################################################Template Class##########################################################
+
+#The Template class is the compiled netlist of a topology.
+
+####Class Attributes####
+
+##text: format string of the whole netlist. {ID} is the circuit ID and {0}, {1}, ... are the
+#parameters of the components in the order they appear in the circuit
+
+##numParams: number of parameter slots
+
+####Class Methods####
+
+##render: takes in the ID and the list of parameter values and returns the netlist
+
+
+class Template:
+
+    def __init__(self, circuit):
+
+        lines = ["*Circuit # {ID}\n\n", MODELS, "*NETLIST DESCRIPTION\n"]
+
+        pos = 0
+        for comp in circuit.components:
+
+            #we let Component.netList build the line but give it placeholders instead of the
+            #parameter values so the same line works for every circuit with this topology
+            slots = ["{" + str(pos + index) + "}" for index in range(len(comp.params))]
+            lines.append(Cir.Component(comp.kind, comp.name, comp.nodes, slots).netList() + "\n")
+
+            pos += len(comp.params)
+
+        self.text = "".join(lines)
+        self.numParams = pos
+
+    def render(self, ID, params):
+        return self.text.format(*params, ID = ID)
+
+
+#compiled templates, keyed by topology
+templates = dict()
+
+
+#returns the key describing the topology of a circuit. Circuits with the same key share a template
+
+def topology(circuit):
+    return tuple((comp.kind, comp.name, tuple(comp.nodes), len(comp.params)) for comp in circuit.components)
+
+
+#returns the (compiled once) template for the topology of a circuit
+
+def template(circuit):
+
+    key = topology(circuit)
+    if key not in templates:
+        templates[key] = Template(circuit)
+
+    return templates[key]
+
+
+#This function returns the netlist of a circuit as a string. extra is a list of lines (like the
+#analysis commands added by Metrics) that are added to the end of the deck
+
+def render(circuit, extra = ()):
+
+    params = [param for comp in circuit.components for param in comp.params]
+
+    return template(circuit).render(circuit.ID, params) + "".join(extra)
+
+
+#This function renders a single deck that simulates every circuit in circuits (which have to share
+#a topology) in one run. Every parameter slot of the template becomes a .param symbol p0, p1, ... whose
+#value is looked up in a table by the run number, and ".step param run list 1 2 ..." steps through
+#the circuits (run k is circuits[k - 1]). extra is added to the end like in render. ltSpice only runs
+#one analysis per deck, so extra should hold a single analysis and its measurements (Metrics.stepped
+#renders the netlist once and runs it with an .ac deck and a .tran deck).
+
+def stepped(circuits, ID, extra = ()):
+
+    key = topology(circuits[0])
+    for circuit in circuits[1:]:
+        if topology(circuit) != key:
+            raise ValueError("every circuit in a stepped deck has to have the same topology")
+
+    tmpl = template(circuits[0])
+    params = np.array([[param for comp in circuit.components for param in comp.params] for circuit in circuits], dtype = float).reshape(len(circuits), tmpl.numParams)
+
+    runs = range(1, len(circuits) + 1)
+
+    lines = [tmpl.text.format(*["{p" + str(col) + "}" for col in range(tmpl.numParams)], ID = ID), "\n"]
+    for col in range(tmpl.numParams):
+        lines.append(".param p" + str(col) + " table(run" + "".join(", " + str(run) + ", " + repr(float(val)) for run, val in zip(runs, params[:, col])) + ")\n")
+    lines.append(".step param run list " + " ".join(str(run) for run in runs) + "\n")
+
+    return "".join(lines) + "".join(extra)
+
+
+#writes a deck to path (by default Circuit{ID}.cir inside of a folder in TMPFS) and returns the path
+
+def write(deck, ID, path = None):
+
+    if path is None:
+        folder = os.path.join(TMPFS, "Circuit" + str(ID))
+        os.makedirs(folder, exist_ok = True)
+        path = os.path.join(folder, "Circuit" + str(ID) + ".cir")
+
+    f = open(path, "w")
+    f.write(deck)
+    f.close()
+
+    return path
+
+
+#This function pipes a deck into the standard input of a simulator that can read its netlist
+#from there (for example "ngspice -b") and returns what the simulator printed out. Like
+#SimRunner.run, the simulator (and anything it started) is killed after timeout seconds, and a
+#SimRunner.SimFailure is raised for the circuit ID if it timed out or exited with an error code
+
+def pipe(deck, cmd, ID = None, timeout = 120):
+
+    start = time.time()
+
+    proc = subprocess.Popen(cmd, stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                            start_new_session = True)
+    try:
+        out, err = proc.communicate(deck.encode(), timeout = timeout)
+    except subprocess.TimeoutExpired:
+        SimRunner.kill(proc.pid)
+        proc.communicate()
+        raise SimRunner.SimFailure(ID, "timeout", elapsed = time.time() - start)
+
+    if proc.returncode != 0:
+        raise SimRunner.SimFailure(ID, "crash", elapsed = time.time() - start, detail = err.decode(errors = "replace")[-500:])
+
+    return out.decode(errors = "replace")
@@ -0,0 +1,165 @@
+import os
+import shutil
+import tempfile
+import multiprocessing as mp
+import Metrics
+import SimRunner
+import Instrument
+
+#Parallel submodule evaluates a whole population of circuits at once by handing
+#the circuits out to a pool of worker processes. The functions in Metrics work in
+#the folder of a circuit (workDir/Circuit{ID}): they read its cir file, write the
+#decks for each analysis next to it (Circuit{ID}tran.cir, ac.cir, op.cir...) and
+#read back the files ltSpice makes from them. Two evaluations of circuits with the
+#same ID would write over each other's files, so every worker gets its own scratch
+#directory, exports its own copy of the netlist into it before running the analyses
+#and deletes the circuit's folder when it's done.
+
+
+#An analysis is described by a tuple (name, args) where name is one of "tran", "ac"
+#"DCpow" or "combined" and args is a dictionary with the arguments of the corresponding Metrics
+#function other than ID and workDir. For example:
+
+#[("tran", {"freq": 1000, "node": "N3"}),
+# ("ac", {"node": "N3", "start": 10, "numStep": 100, "stop": 1e8}),
+# ("DCpow", {})]
+
+ANALYSES = {"tran": Metrics.tran, "ac": Metrics.ac, "DCpow": Metrics.DCpow, "combined": Metrics.combined}
+
+
+#scratch directory of the worker process. Set by initWorker when the pool starts up
+_scratch = None
+
+
+#this function is run once in each worker process when the pool is created. It
+#makes a folder inside of root that only this worker will write to
+
+def initWorker(root):
+
+    global _scratch
+
+    _scratch = os.path.join(root, "Worker" + str(os.getpid()))
+    os.makedirs(_scratch, exist_ok = True)
+
+    #a forked worker starts with a copy of the parent's stats, which would be sent back and
+    #counted twice when they're merged
+    Instrument.reset()
+
+
+#this function evaluates a single circuit inside of the worker's scratch directory.
+#It exports the netlist, runs every analysis one after the other and then merges
+#all of the measurement dictionaries into a single dictionary. If a simulation fails
+#the dictionary holds "failure" (the reason it failed, see SimRunner.SimFailure) along
+#with whatever was measured before it so the fitness function can penalize it
+
+def evalCircuit(task):
+
+    circuit, analyses = task
+
+    workDir = _scratch
+
+    #if we're not running inside a pool (numWorkers = 1) we make a scratch directory here
+    if workDir is None:
+        workDir = tempfile.mkdtemp(prefix = "Circuit" + str(circuit.ID))
+
+    circuit.expNetList(workDir)
+
+    measurements = dict()
+
+    try:
+        for name, args in analyses:
+            measurements.update(ANALYSES[name](ID = circuit.ID, workDir = workDir, **args))
+
+    except SimRunner.SimFailure as failure:
+        measurements["failure"] = failure.reason
+
+    finally:
+        #we're done with this circuit so we get rid of its folder so that the scratch
+        #directory doesn't keep growing over the course of a run
+        shutil.rmtree(os.path.join(workDir, "Circuit" + str(circuit.ID)), ignore_errors = True)
+        if _scratch is None:
+            shutil.rmtree(workDir, ignore_errors = True)
+
+    return measurements
+
+
+#This function evaluates every circuit in circuits using a pool of numWorkers processes.
+#If numWorkers is None then we use one worker per core. chunkSize is the number of
+#circuits that are handed to a worker at a time. If a FitnessCache (from Cache) is given,
+#circuits that are already in it aren't simulated again and new results are added to it.
+#If gen is given, the Instrument stats (with the ones the workers sent back) are closed out under
+#generation gen once the population is evaluated (see Instrument.generation).
+#Returns a list of measurement dictionaries in the same order as circuits
+
+def evalPopulation(circuits, analyses, numWorkers = None, chunkSize = 1, cache = None, gen = None):
+
+    results = [None]*len(circuits)
+
+    #look every circuit up in the cache first and only simulate the ones we haven't seen
+    keys = [None]*len(circuits)
+    if cache is not None:
+        for index in range(len(circuits)):
+            keys[index] = cache.key(circuits[index], analyses)
+            results[index] = cache.get(keys[index])
+
+    todo = [index for index in range(len(circuits)) if results[index] is None]
+
+    #duplicates inside of the population only need to be simulated once
+    first = dict()
+    for index in todo:
+        if keys[index] is None or keys[index] not in first:
+            first[keys[index] if keys[index] is not None else index] = index
+
+    tasks = [(circuits[index], analyses) for index in first.values()]
+
+    for index, measurements in zip(first.values(), runTasks(tasks, numWorkers, chunkSize)):
+        results[index] = measurements
+        #failures (timeouts especially) might not happen next time so they aren't cached
+        if cache is not None and "failure" not in measurements:
+            cache.put(keys[index], measurements)
+
+    for index in todo:
+        if results[index] is None:
+            results[index] = dict(results[first[keys[index]]])
+
+    if gen is not None:
+        Instrument.generation(gen)
+
+    return results
+
+
+#runs evalCircuit in a worker and sends the worker's stats (see Instrument) back with the results
+
+def evalTask(task):
+    return evalCircuit(task), Instrument.take()
+
+
+#runs evalCircuit on every task using a pool of numWorkers processes and returns the
+#results in the same order as the tasks. The stats of the workers are merged into this process
+
+def runTasks(tasks, numWorkers = None, chunkSize = 1):
+
+    if numWorkers is None:
+        numWorkers = os.cpu_count()
+
+    #with a single worker (or nothing to do) there's no point in paying for starting up the pool
+    if numWorkers == 1 or len(tasks) == 0:
+        return [evalCircuit(task) for task in tasks]
+
+    #all of the worker scratch directories live inside of root so that we can clean
+    #them all up in one go once the population has been evaluated
+    root = tempfile.mkdtemp(prefix = "AmpGA")
+
+    try:
+        with mp.Pool(numWorkers, initializer = initWorker, initargs = (root,)) as pool:
+            #map hands the results back in the same order as the tasks
+            out = pool.map(evalTask, tasks, chunksize = chunkSize)
+    finally:
+        shutil.rmtree(root, ignore_errors = True)
+
+    results = []
+    for measurements, stats in out:
+        results.append(measurements)
+        Instrument.merge(stats)
+
+    return results
@@ -0,0 +1,156 @@
+import os
+import numpy as np
+
+#RawRead submodule reads the binary .raw waveform files written by ltSpice (and ngspice) without
+#going through the log file. The header is parsed as text and the data that follows it is mapped
+#into memory with np.memmap, so reading a trace doesn't copy the file.
+
+#In a .raw file the header is a list of "Key: value" lines followed by the list of variables and
+#a "Binary:" line after which the data starts. ltSpice writes the header in UTF-16LE and ngspice
+#writes it in ASCII. For real analyses (like .tran) ltSpice stores time as a float64 and every other
+#variable as a float32 unless the "double" flag is set, while ngspice stores every variable as a
+#float64 without setting the flag, so the width is worked out from the size of the data. Complex
+#analyses (like .ac) store every variable as a complex128. The data is stored one point after the other unless the "fastaccess"
+#flag is set, in which case it's stored one variable after the other.
+
+
+##########################################################Raw Class##########################################################
+
+####Class Attributes####
+
+##header: dictionary holding the lines of the header (Title, Plotname, Flags, ...)
+
+##flags: list of the flags of the file (real/complex, forward, double, fastaccess, ...)
+
+##names: list of the variable names in the order they're stored
+
+##numPoints: number of points stored for every variable
+
+##data: the memory mapped data. Either a structured array with one field per variable (point by point
+#layout) or a dictionary of arrays (fastaccess layout)
+
+####Class Methods####
+
+##trace: takes in the name of a variable (like "time" or "V(n3)", case doesn't matter) and returns its values
+
+##close: releases the memory map
+
+
+class Raw:
+
+    def __init__(self, path):
+
+        self.header = dict()
+        self.names = []
+
+        offset, text = readHeader(path)
+
+        lines = text.splitlines()
+        index = 0
+        while index < len(lines):
+
+            line = lines[index]
+            index += 1
+
+            if line.startswith("Variables:"):
+                #the variables are listed one per line as "index name type"
+                while index < len(lines) and lines[index][:1] in ["\t", " "]:
+                    self.names.append(lines[index].split()[1])
+                    index += 1
+                continue
+
+            if ":" in line:
+                key, val = line.split(":", 1)
+                self.header[key.strip()] = val.strip()
+
+        self.flags = self.header.get("Flags", "").lower().split()
+        self.numPoints = int(self.header["No. Points"])
+
+        #work out how each variable is stored
+        if "complex" in self.flags:
+            types = [np.complex128]*len(self.names)
+        elif "double" in self.flags:
+            types = [np.float64]*len(self.names)
+        else:
+            types = realTypes(os.path.getsize(path) - offset, self.numPoints, len(self.names), path)
+
+        if "fastaccess" in self.flags:
+            self.data = dict()
+            for name, kind in zip(self.names, types):
+                self.data[name.lower()] = np.memmap(path, dtype = kind, mode = "r", offset = offset, shape = (self.numPoints,))
+                offset += self.numPoints*np.dtype(kind).itemsize
+        else:
+            point = np.dtype([(name.lower(), kind) for name, kind in zip(self.names, types)])
+            self.data = np.memmap(path, dtype = point, mode = "r", offset = offset, shape = (self.numPoints,))
+
+    def trace(self, name):
+
+        values = self.data[name.lower()]
+
+        #ltSpice uses the sign bit of the time variable to mark compressed points so time is
+        #always read back as its absolute value
+        if name.lower() == "time":
+            values = np.abs(values)
+
+        return values
+
+    def close(self):
+        self.data = None
+
+
+#returns the types of the numVars variables of a real raw file without the "double" flag from the
+#size of its data: all float64 (ngspice) or float64 time and float32 for the rest (ltSpice). Raises a
+#ValueError if the data is too short for either
+
+def realTypes(size, numPoints, numVars, path):
+
+    if size >= numPoints*8*numVars:
+        return [np.float64]*numVars
+
+    if size >= numPoints*(8 + 4*(numVars - 1)):
+        return [np.float64] + [np.float32]*(numVars - 1)
+
+    raise ValueError(path + " holds less data than its header says")
+
+
+#reads the header of a raw file. Returns the offset (in bytes) where the data starts along
+#with the text of the header
+
+def readHeader(path):
+
+    f = open(path, "rb")
+    head = f.read(2)
+    f.seek(0)
+
+    #ltSpice headers are UTF-16LE so every other byte of the first character is 0
+    encoding = "utf-16-le" if len(head) == 2 and head[1] == 0 else "latin-1"
+    marker = "Binary:\n".encode(encoding)
+
+    buf = b""
+    while True:
+        chunk = f.read(1 << 16)
+        if not chunk:
+            f.close()
+            raise ValueError(path + " has no binary data")
+        buf += chunk
+
+        pos = buf.find(marker)
+
+        #UTF-16 characters are 2 bytes long so the marker has to start on an even byte
+        while encoding == "utf-16-le" and pos >= 0 and pos % 2 == 1:
+            pos = buf.find(marker, pos + 1)
+
+        if pos >= 0:
+            break
+
+    f.close()
+
+    offset = pos + len(marker)
+
+    return offset, buf[:pos].decode(encoding)
+
+
+#opens a raw file
+
+def read(path):
+    return Raw(path)
@@ -0,0 +1,312 @@
+import os
+import time
+import signal
+import asyncio
+import subprocess
+
+#SimRunner submodule launches the simulator. A circuit that hangs or never converges used to block
+#the whole run forever since the simulator was started with os.system, and a simulator crash only
+#showed up later as a missing file error. Here every run has a wall clock timeout after which the
+#simulator (and anything it started) is killed, failed runs are retried with relaxed convergence
+#options, and failures come back as SimFailure objects that say what went wrong so they can be
+#scored as a penalty instead of stopping the run.
+
+#There are two ways to use it: run (a blocking call for a single deck, used by Metrics.runSim) and
+#the SimRunner class which keeps many simulations in flight at once with asyncio (used by
+#Metrics.runDecks to run the .ac and .tran decks of combined and stepped side by side).
+
+
+#options added to the deck when a simulation is retried. They loosen the convergence tolerances,
+#allow more iterations and switch to gear integration which is more forgiving than trapezoidal
+RELAXED = ".options reltol=0.01 abstol=1e-9 vntol=1e-4 gmin=1e-10 itl1=500 itl2=200 itl4=100 method=gear\n"
+
+
+##########################################################SimFailure Class##########################################################
+
+#The SimFailure class describes a simulation that didn't work. It's raised by run and returned
+#(not raised) by SimRunner so that a batch of jobs always comes back complete.
+
+####Class Attributes####
+
+##ID: the ID of the circuit that was simulated
+
+##reason: "timeout" if the simulator was killed for running too long, "crash" if it exited with an error
+#code and "missing-output" if it exited normally but didn't write the files we need
+
+##attempts: number of times the simulation was tried
+
+##elapsed: total wall clock time spent on the job in seconds
+
+##detail: the end of whatever the simulator printed to stderr
+
+##penalty: fitness to give the circuit. Set by SimRunner (-inf by default)
+
+
+class SimFailure(Exception):
+
+    def __init__(self, ID, reason, attempts = 1, elapsed = 0.0, detail = "", penalty = float("-inf")):
+
+        super().__init__("simulation of circuit " + str(ID) + " failed: " + reason)
+
+        self.ID = ID
+        self.reason = reason
+        self.attempts = attempts
+        self.elapsed = elapsed
+        self.detail = detail
+        self.penalty = penalty
+
+
+##########################################################SimJob Class##########################################################
+
+####Class Attributes####
+
+##ID: the ID of the circuit
+
+##folder: the folder the simulator is run in
+
+##file: name of the deck inside of folder
+
+##outputs: extensions (like ".log" or ".raw") of the files the simulator has to write for the run to count.
+#They're added onto the name of the deck without its .cir extension
+
+##elapsed, attempts: filled in by SimRunner
+
+
+class SimJob:
+
+    def __init__(self, ID, folder, file, outputs = (".log",)):
+
+        self.ID = ID
+        self.folder = folder
+        self.file = file
+        self.outputs = list(outputs)
+        self.elapsed = 0.0
+        self.attempts = 0
+
+    #paths of the output files
+    def paths(self):
+
+        base = os.path.join(self.folder, os.path.splitext(self.file)[0])
+
+        return [base + ext for ext in self.outputs]
+
+    #returns the outputs that are missing. Outputs left over from an earlier run are deleted by
+    #prepare before every attempt so only files written by this run count
+    def missing(self):
+        return [path for path in self.paths() if not os.path.exists(path)]
+
+    #deletes the outputs of an earlier run
+    def clear(self):
+        for path in self.paths():
+            if os.path.exists(path):
+                os.remove(path)
+
+
+#gets a job ready for an attempt and returns the name of the deck to run. The first attempt runs the
+#deck itself. Retries run a copy of it with the relaxed options added (before .end if it has one) so
+#the deck, which the caller may use again for other analyses, is never changed
+
+def prepare(job, attempt):
+
+    job.clear()
+
+    if attempt == 0:
+        return job.file
+
+    f = open(os.path.join(job.folder, job.file), "r")
+    lines = f.readlines()
+    f.close()
+
+    if len(lines) > 0 and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+
+    end = [index for index in range(len(lines)) if lines[index].strip().lower() == ".end"]
+    if len(end) > 0:
+        lines.insert(end[-1], RELAXED)
+    else:
+        lines.append(RELAXED)
+
+    file = os.path.splitext(job.file)[0] + "_relaxed.cir"
+    f = open(os.path.join(job.folder, file), "w")
+    f.writelines(lines)
+    f.close()
+
+    return file
+
+
+#after an attempt on the relaxed copy of a deck, renames everything the simulator wrote for it
+#(.log, .raw, .op.raw...) to the names the outputs of the deck itself would have and deletes the copy
+
+def restore(job, file):
+
+    if file == job.file:
+        return
+
+    base = os.path.splitext(file)[0]
+    target = os.path.splitext(job.file)[0]
+
+    for name in os.listdir(job.folder):
+        if name.startswith(base + ".") and name != file:
+            os.replace(os.path.join(job.folder, name), os.path.join(job.folder, target + name[len(base):]))
+
+    os.remove(os.path.join(job.folder, file))
+
+
+#kills a simulator along with anything it started. The simulator is started in its own session
+#so its process group holds all of them
+
+def kill(pid):
+
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+#This function runs the simulator cmd in batch mode on one deck and blocks until it's done. It's
+#killed after timeout seconds and retried up to retries times with relaxed options. Raises a
+#SimFailure if it never succeeds, otherwise returns the job.
+
+def run(job, cmd, timeout = 120, retries = 1):
+
+    start = time.time()
+    reason = ""
+    detail = ""
+
+    for attempt in range(retries + 1):
+
+        job.attempts = attempt + 1
+        file = prepare(job, attempt)
+
+        proc = subprocess.Popen([cmd, "-b", file], cwd = job.folder, stdout = subprocess.DEVNULL,
+                                stderr = subprocess.PIPE, start_new_session = True)
+        try:
+            out, err = proc.communicate(timeout = timeout)
+        except subprocess.TimeoutExpired:
+            kill(proc.pid)
+            proc.communicate()
+            restore(job, file)
+            reason = "timeout"
+            continue
+
+        restore(job, file)
+
+        detail = err.decode(errors = "replace")[-500:]
+
+        if proc.returncode != 0:
+            reason = "crash"
+        elif len(job.missing()) > 0:
+            reason = "missing-output"
+        else:
+            job.elapsed = time.time() - start
+            return job
+
+    job.elapsed = time.time() - start
+    raise SimFailure(job.ID, reason, job.attempts, job.elapsed, detail)
+
+
+##########################################################SimRunner Class##########################################################
+
+#The SimRunner class runs many simulator processes at once with asyncio. At most limit of them are
+#running at any time and the rest wait their turn.
+
+####Class Attributes####
+
+##cmd: path of the simulator (Metrics.LTSPICE by default)
+
+##limit: largest number of simulators running at once
+
+##timeout: wall clock time (in seconds) a single attempt gets before it's killed
+
+##retries: number of times a failed job is tried again with relaxed options
+
+##penalty: fitness given to failed jobs
+
+####Class Methods####
+
+##runJob: (coroutine) runs one job and returns it, or a SimFailure if it failed
+
+##runAll: (coroutine) runs a list of jobs and returns their results in the same order
+
+##runBatch: blocking version of runAll for code that isn't using asyncio
+
+
+class SimRunner:
+
+    def __init__(self, cmd = None, limit = None, timeout = 120, retries = 1, penalty = float("-inf")):
+
+        if cmd is None:
+            import Metrics
+            cmd = Metrics.LTSPICE
+
+        self.cmd = cmd
+        self.limit = os.cpu_count() if limit is None else limit
+        self.timeout = timeout
+        self.retries = retries
+        self.penalty = penalty
+        self.sem = None
+
+    async def attempt(self, job, file):
+
+        proc = await asyncio.create_subprocess_exec(self.cmd, "-b", file, cwd = job.folder, stdout = asyncio.subprocess.DEVNULL,
+                                                    stderr = asyncio.subprocess.PIPE, start_new_session = True)
+        try:
+            out, err = await asyncio.wait_for(proc.communicate(), self.timeout)
+
+        except asyncio.TimeoutError:
+            kill(proc.pid)
+            await proc.wait()
+            restore(job, file)
+            return "timeout", ""
+
+        except asyncio.CancelledError:
+            #if the job is cancelled we don't leave the simulator running
+            kill(proc.pid)
+            await proc.wait()
+            restore(job, file)
+            raise
+
+        restore(job, file)
+
+        detail = err.decode(errors = "replace")[-500:]
+
+        if proc.returncode != 0:
+            return "crash", detail
+
+        if len(job.missing()) > 0:
+            return "missing-output", detail
+
+        return None, detail
+
+    async def runJob(self, job):
+
+        if self.sem is None:
+            self.sem = asyncio.Semaphore(self.limit)
+
+        async with self.sem:
+
+            start = time.time()
+
+            for attempt in range(self.retries + 1):
+
+                job.attempts = attempt + 1
+                file = prepare(job, attempt)
+
+                reason, detail = await self.attempt(job, file)
+                if reason is None:
+                    job.elapsed = time.time() - start
+                    return job
+
+            job.elapsed = time.time() - start
+
+            return SimFailure(job.ID, reason, job.attempts, job.elapsed, detail, self.penalty)
+
+    async def runAll(self, jobs):
+
+        #the semaphore belongs to the event loop that's running so a new one is made for every batch
+        self.sem = asyncio.Semaphore(self.limit)
+
+        return await asyncio.gather(*[self.runJob(job) for job in jobs])
+
+    def runBatch(self, jobs):
+        return asyncio.run(self.runAll(jobs))
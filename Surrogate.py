@@ -0,0 +1,226 @@
+import numpy as np
+
+#Surrogate submodule is a cheap model of the simulator that's trained online on the (params -> metrics)
+#pairs we get from real simulations. Most children are worse than their parents, so before simulating
+#a batch of children we ask the surrogate what it thinks their metrics are and only send the most
+#promising ones (and the ones it's least sure about) on to the real simulator.
+
+#Component values span many decades (pF capacitors and kOhm resistors) so the model works with the
+#log of the parameters, standardized to zero mean and unit variance. The metrics are standardized too.
+
+
+##########################################################Surrogate Class##########################################################
+
+####Class Attributes####
+
+##keys: names of the metrics that are modeled (like "op_freq_gain", "3db_cutoff2", "DC Power", "distortion")
+
+##method: "knn" (k nearest neighbours), "rff" (ridge regression on random fourier features) or "gp"
+#(gaussian process with an RBF kernel)
+
+##X, Y: training inputs (log parameters) and metrics. Only the newest maxTrain pairs are kept
+
+##simulated: number of candidates sent to the real simulator by screen
+
+##skipped: number of candidates screen decided not to simulate (simulations saved)
+
+##errors: dictionary mapping each key to the list of absolute errors between what the surrogate
+#predicted and what the simulator returned, filled in by record
+
+####Class Methods####
+
+##record: adds simulated pairs to the training set (and scores the predictions made for them first)
+
+##fit: retrains the model on the training set
+
+##predict: returns the predicted metrics (n, len(keys)) and their standard deviations
+
+##screen: picks which candidates to simulate
+
+##stats: returns the number of simulations saved and the accuracy of the predictions
+
+
+class Surrogate:
+
+    def __init__(self, keys, method = "rff", k = 5, numFeatures = 256, lengthScale = 2.0, ridge = 0.1,
+                 minTrain = 32, maxTrain = 2000, seed = None):
+
+        self.keys = list(keys)
+        self.method = method
+        self.k = k
+        self.numFeatures = numFeatures
+        self.lengthScale = lengthScale
+        self.ridge = ridge
+        self.minTrain = minTrain
+        self.maxTrain = maxTrain
+        self.rng = np.random.default_rng(seed)
+
+        self.X = None
+        self.Y = None
+        self.model = None
+
+        self.simulated = 0
+        self.skipped = 0
+        self.errors = {key: [] for key in self.keys}
+
+        if method not in ["knn", "rff", "gp"]:
+            raise ValueError("unknown surrogate method " + method)
+
+    #log of the parameters. 0 valued parameters are clipped so the log is finite
+    def features(self, params):
+        return np.log10(np.maximum(np.atleast_2d(np.asarray(params, dtype = float)), 1e-30))
+
+    def record(self, params, metrics, refit = True):
+
+        X = self.features(params)
+        Y = np.array([[np.nan if m.get(key) is None else float(m[key]) for key in self.keys] for m in metrics], dtype = float).reshape(len(X), len(self.keys))
+
+        #score the predictions for these points before the model sees them
+        if self.model is not None:
+            pred, std = self.predict(params)
+            for col in range(len(self.keys)):
+                ok = np.isfinite(Y[:, col])
+                self.errors[self.keys[col]] += list(np.abs(pred[ok, col] - Y[ok, col]))
+
+        #failed simulations aren't used for training
+        ok = np.all(np.isfinite(Y), axis = 1)
+        X = X[ok]
+        Y = Y[ok]
+
+        self.X = X if self.X is None else np.concatenate((self.X, X))[-self.maxTrain:]
+        self.Y = Y if self.Y is None else np.concatenate((self.Y, Y))[-self.maxTrain:]
+
+        if refit and len(self.X) >= self.minTrain:
+            self.fit()
+
+    def fit(self):
+
+        X = self.X
+        Y = self.Y
+
+        self.xMean = np.mean(X, axis = 0)
+        self.xStd = np.std(X, axis = 0) + 1e-12
+        self.yMean = np.mean(Y, axis = 0)
+        self.yStd = np.std(Y, axis = 0) + 1e-12
+
+        Xs = (X - self.xMean)/self.xStd
+        Ys = (Y - self.yMean)/self.yStd
+
+        match self.method:
+
+            case "knn":
+                self.model = (Xs, Ys)
+
+            case "rff":
+                #random features whose inner products approximate an RBF kernel
+                W = self.rng.normal(0, 1/self.lengthScale, (X.shape[1], self.numFeatures))
+                b = self.rng.uniform(0, 2*np.pi, self.numFeatures)
+                Phi = np.sqrt(2/self.numFeatures)*np.cos(Xs @ W + b)
+
+                A = Phi.T @ Phi + self.ridge*np.eye(self.numFeatures)
+                Ainv = np.linalg.inv(A)
+                weights = Ainv @ Phi.T @ Ys
+
+                #noise level from the training residuals, used for the uncertainty
+                noise = np.mean((Phi @ weights - Ys)**2, axis = 0) + self.ridge
+
+                self.model = (W, b, weights, Ainv, noise)
+
+            case "gp":
+                K = self.kernel(Xs, Xs) + self.ridge*np.eye(len(Xs))
+                L = np.linalg.cholesky(K)
+                alpha = np.linalg.solve(L.T, np.linalg.solve(L, Ys))
+
+                self.model = (Xs, L, alpha)
+
+    def kernel(self, A, B):
+
+        dist = np.sum(A**2, axis = 1)[:, None] + np.sum(B**2, axis = 1)[None, :] - 2*A @ B.T
+
+        return np.exp(-np.maximum(dist, 0)/(2*self.lengthScale**2))
+
+    def predict(self, params):
+
+        Xs = (self.features(params) - self.xMean)/self.xStd
+
+        match self.method:
+
+            case "knn":
+                train, Ys = self.model
+                dist = np.sum((Xs[:, None, :] - train[None, :, :])**2, axis = -1)
+                k = min(self.k, len(train))
+                near = np.argpartition(dist, k - 1, axis = 1)[:, :k]
+
+                mean = np.mean(Ys[near], axis = 1)
+
+                #spread of the neighbours plus how far away they are
+                std = np.std(Ys[near], axis = 1) + np.sqrt(np.mean(np.take_along_axis(dist, near, 1), axis = 1))[:, None]
+
+            case "rff":
+                W, b, weights, Ainv, noise = self.model
+                Phi = np.sqrt(2/self.numFeatures)*np.cos(Xs @ W + b)
+
+                mean = Phi @ weights
+                spread = np.einsum("ij,jk,ik->i", Phi, Ainv, Phi)
+                std = np.sqrt(noise[None, :]*(1 + spread[:, None]))
+
+            case "gp":
+                train, L, alpha = self.model
+                Ks = self.kernel(Xs, train)
+
+                mean = Ks @ alpha
+                v = np.linalg.solve(L, Ks.T)
+                std = np.sqrt(np.maximum(1 - np.sum(v**2, axis = 0), 0))[:, None]*np.ones((1, len(self.keys)))
+
+        return mean*self.yStd + self.yMean, std*self.yStd
+
+    #This function decides which candidates (rows of params) should be simulated. score takes in a
+    #dictionary mapping each key to an array of predicted values and returns the predicted fitness
+    #(higher is better). fraction of the candidates are simulated: most of them are the ones with
+    #the best predicted fitness and explore of them are the ones the surrogate is least sure about.
+    #Until the surrogate has minTrain points, every candidate is simulated. Returns the indices of
+    #the candidates to simulate.
+
+    def screen(self, params, score, fraction = 0.25, explore = 0.25):
+
+        num = len(np.atleast_2d(params))
+
+        if self.model is None:
+            self.simulated += num
+            return np.arange(num)
+
+        mean, std = self.predict(params)
+
+        fit = np.asarray(score({key: mean[:, col] for col, key in enumerate(self.keys)}), dtype = float)
+        fit = np.where(np.isfinite(fit), fit, -np.inf)
+
+        #relative uncertainty summed over the metrics
+        unsure = np.sum(std/self.yStd, axis = 1)
+
+        budget = max(1, int(np.ceil(fraction*num)))
+        numExplore = int(explore*budget)
+
+        chosen = list(np.argsort(-fit, kind = "stable")[:budget - numExplore])
+        for index in np.argsort(-unsure, kind = "stable"):
+            if len(chosen) >= budget:
+                break
+            if index not in chosen:
+                chosen.append(index)
+
+        self.simulated += len(chosen)
+        self.skipped += num - len(chosen)
+
+        return np.sort(np.array(chosen, dtype = int))
+
+    def stats(self):
+
+        accuracy = dict()
+        for col, key in enumerate(self.keys):
+            errors = np.array(self.errors[key])
+            if len(errors) > 0 and self.Y is not None:
+                accuracy[key] = {"MAE": float(np.mean(errors)), "relMAE": float(np.mean(errors)/(np.std(self.Y[:, col]) + 1e-12))}
+
+        total = self.simulated + self.skipped
+
+        return {"simulated": self.simulated, "saved": self.skipped, "savedFraction": self.skipped/total if total > 0 else 0,
+                "trainSize": 0 if self.X is None else len(self.X), "accuracy": accuracy}
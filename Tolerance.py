@@ -0,0 +1,129 @@
+import numpy as np
+import MNA
+
+#Tolerance submodule measures how robust a design is to the tolerances of real components. Like the
+#README describes, we perturb the component values at random, see how much the FoM moves and turn
+#that spread into a robustness score that can be added into the fitness.
+
+#All of the samples in a batch are made as one (samples, numParams) array and evaluated together
+#(by default with the batched MNA engine). Instead of always running a fixed number of samples,
+#batches keep being added until the estimate of the FoM's standard deviation is accurate enough.
+
+
+#relative tolerance of each kind of component. For uniform perturbations a value can move anywhere
+#within +-tol of its nominal value and for gaussian perturbations tol is 3 standard deviations
+TOLERANCES = {"Resistor": 0.05, "Capacitor": 0.1, "Inductor": 0.1, "Vsource": 0.01, "NMOS": 0.05, "PMOS": 0.05}
+
+
+#This function makes num perturbed copies of the parameter vector params. kinds holds the kind of
+#the component each parameter belongs to (like Genome.kinds), dist is "uniform" or "gaussian" and
+#tol maps kinds to relative tolerances (kinds that aren't in it aren't perturbed). Returns a
+#(num, len(params)) array.
+
+def perturb(params, kinds, num, dist = "gaussian", tol = TOLERANCES, rng = np.random):
+
+    params = np.asarray(params, dtype = float)
+    rel = np.array([tol.get(kind, 0) for kind in kinds], dtype = float)
+
+    match dist:
+        case "uniform":
+            noise = rng.uniform(-1, 1, (num, len(params)))*rel
+        case "gaussian":
+            noise = rng.normal(0, 1, (num, len(params)))*rel/3
+        case _:
+            raise ValueError("unknown distribution " + dist)
+
+    return np.maximum(params*(1 + noise), 0)
+
+
+#returns an evaluator for analyze that runs the batched MNA engine on circuits with the topology of
+#circuit. The evaluator takes a (samples, numParams) array and returns the dictionary of measurement
+#arrays from MNA.measure (failed samples have nan measurements)
+
+def mnaEvaluator(circuit, node, start, numStep, stop, inNode = "N5"):
+
+    topo = MNA.Topology(circuit, inNode)
+    freqs = np.logspace(np.log10(start), np.log10(stop), numStep)
+
+    def evaluate(samples):
+
+        measurements, converged = MNA.measure(topo, samples, node, freqs)
+
+        return {key: np.where(converged, val, np.nan) for key, val in measurements.items()}
+
+    return evaluate
+
+
+#This function runs the Monte Carlo tolerance analysis on one design.
+
+#params: nominal parameter vector (for example topo.values(circuit) or a row of a Genome)
+#kinds: kind of each parameter (see perturb)
+#evaluate: takes in a (samples, numParams) array and returns a dictionary of measurement arrays (see mnaEvaluator)
+#fom: takes in that dictionary and returns the array of FoMs
+
+#Samples are drawn batch at a time. After each batch we estimate the standard error of the FoM's
+#standard deviation from the sample's fourth moment. Once it's smaller than rtol times the standard
+#deviation (and at least minSamples have been run) or maxSamples have been run, we stop.
+
+#Returns a dictionary with the nominal FoM, the mean and standard deviation of the perturbed FoMs,
+#the standard error of that standard deviation, the fraction of samples that could be evaluated
+#(yield), the number of samples run and the robustness score 1/(1 + std/|nominal|), which is 1 for
+#a design whose FoM doesn't move at all and goes to 0 as the spread grows.
+
+def analyze(params, kinds, evaluate, fom, dist = "gaussian", tol = TOLERANCES, batch = 64, minSamples = 64,
+            maxSamples = 4096, rtol = 0.05, rng = np.random):
+
+    params = np.asarray(params, dtype = float)
+
+    nominal = float(fom(evaluate(params[None, :]))[0])
+
+    foms = np.zeros(0)
+    total = 0
+
+    while total < maxSamples:
+
+        num = min(batch, maxSamples - total)
+        samples = perturb(params, kinds, num, dist, tol, rng)
+
+        foms = np.concatenate((foms, np.asarray(fom(evaluate(samples)), dtype = float)))
+        total += num
+
+        good = foms[np.isfinite(foms)]
+        n = len(good)
+
+        if total < minSamples or n < 4:
+            continue
+
+        std = np.std(good, ddof = 1)
+        stderr = spreadError(good)
+
+        if std == 0 or stderr < rtol*std:
+            break
+
+    good = foms[np.isfinite(foms)]
+
+    if len(good) < 2:
+        return {"nominal": nominal, "mean": np.nan, "std": np.nan, "stderr": np.nan, "yield": len(good)/total,
+                "samples": total, "robustness": 0.0}
+
+    std = float(np.std(good, ddof = 1))
+    robustness = 1/(1 + std/abs(nominal)) if np.isfinite(nominal) and nominal != 0 else 0.0
+
+    return {"nominal": nominal, "mean": float(np.mean(good)), "std": std, "stderr": float(spreadError(good)),
+            "yield": len(good)/total, "samples": total, "robustness": robustness}
+
+
+#standard error of the sample standard deviation of x. The variance of the sample variance is
+#(m4 - (n - 3)/(n - 1)*s^4)/n where m4 is the fourth central moment, and the delta method turns
+#that into the error of the standard deviation by dividing by 2s
+
+def spreadError(x):
+
+    n = len(x)
+    dev = x - np.mean(x)
+    var = np.sum(dev**2)/(n - 1)
+    m4 = np.mean(dev**4)
+
+    varOfVar = max((m4 - (n - 3)/(n - 1)*var**2)/n, 0)
+
+    return np.sqrt(varOfVar)/(2*np.sqrt(var)) if var > 0 else 0.0
@@ -0,0 +1,315 @@
+import numpy as np
+import MNA
+import Distortion
+import Instrument
+
+#scipy is only needed for sparse matrices
+try:
+    import scipy.sparse
+    import scipy.sparse.linalg
+except ImportError:
+    scipy = None
+
+#Transient submodule runs the transient analysis of Metrics.tran in python with the MNA engine
+#instead of ltSpice. The input source is the same 1 mV sine wave on inNode, the circuit starts from
+#its DC operating point and the output waveform is written straight into an array as the
+#simulation goes, which Distortion then measures without any files in between.
+
+#Every time step replaces the capacitors and inductors with companion models. The circuit equations
+#are f(x, t) + Cm dx/dt = 0, where f is the DC residual (Gx - b(t) + I(x)) and Cm is the matrix of
+#capacitances and inductances from MNA.capacitance. Backward Euler ("be") turns dx/dt into
+#(x_n+1 - x_n)/h and the trapezoidal rule ("trap") averages f over the step, so every capacitor
+#becomes a conductance (1 or 2)*C/h in parallel with a current source that holds the history of the
+#step before. The nonlinear devices are then solved with Newton iterations.
+
+#The step size is fixed so the companion conductances never change. The factorization of the
+#jacobian (G + (1 or 2)*Cm/h + device conductances) is kept and reused for as long as the jacobian
+#stays within reuseTol of the one that was factored, so stretches of the waveform where the devices
+#stay close to linear run on a single factorization. Circuits without devices are factored exactly
+#once. Dense batches keep the inverse of every jacobian (numpy has no batched LU) and sparse mode
+#keeps a scipy splu factorization.
+
+#Like the AC analysis, the junction and diffusion capacitances of the devices are held at their
+#values at the operating point. The device currents are fully nonlinear, so an amplifier whose gain
+#drives its output into clipping still clips.
+
+
+##########################################################LU Class##########################################################
+
+#The LU class holds the factorization of a batch of jacobians (..., n, n) and refactors only the
+#ones that changed.
+
+####Class Attributes####
+
+##A: the matrices that were factored
+
+##inv: their inverses (dense mode). Matrices that are singular have an inverse full of nan
+
+##lu: the scipy splu factorization (sparse mode, a single matrix). None if the matrix is singular
+
+##sparse: True for sparse mode
+
+####Class Methods####
+
+##refresh: takes in the current jacobians and refactors the ones that moved more than tol (relative
+#to their largest entry) from the factored ones. Returns how many were refactored
+
+##solve: solves A x = b with the factored matrices
+
+
+class LU:
+
+    def __init__(self, A, sparse = False):
+
+        if sparse and scipy is None:
+            raise ImportError("sparse matrices need scipy")
+
+        if sparse and A.ndim != 2:
+            raise ValueError("sparse matrices only work on a single circuit")
+
+        self.sparse = sparse
+        self.A = A.copy()
+        self.lu = None
+        self.inv = None
+
+        if sparse:
+            self.factor()
+        else:
+            self.inv = invert(A)
+
+        Instrument.count("tran.factor", int(np.prod(A.shape[:-2])))
+
+    def factor(self):
+
+        try:
+            self.lu = scipy.sparse.linalg.splu(scipy.sparse.csc_matrix(self.A))
+        except RuntimeError:
+            self.lu = None
+
+    def refresh(self, A, tol):
+
+        scale = np.max(np.abs(self.A), axis = (-2, -1))
+        stale = np.max(np.abs(A - self.A), axis = (-2, -1)) > tol*scale
+
+        num = int(np.sum(stale))
+        if num == 0:
+            return 0
+
+        if self.sparse:
+            self.A = A.copy()
+            self.factor()
+        else:
+            self.A[stale] = A[stale]
+            self.inv[stale] = invert(A[stale])
+
+        Instrument.count("tran.factor", num)
+
+        return num
+
+    def solve(self, b):
+
+        if not self.sparse:
+            return np.einsum("...ij,...j->...i", self.inv, b)
+
+        if self.lu is None:
+            return np.full(b.shape, np.nan)
+
+        return self.lu.solve(b)
+
+
+#returns the inverses of the stacked matrices A (..., n, n). Like MNA.solve, a singular matrix (or
+#one holding infs or nans) gives an inverse full of nan instead of stopping the whole batch
+
+def invert(A):
+
+    try:
+        if np.all(np.isfinite(A)):
+            return np.linalg.inv(A)
+    except np.linalg.LinAlgError:
+        pass
+
+    flat = A.reshape((-1,) + A.shape[-2:])
+    inv = np.full(flat.shape, np.nan)
+
+    for index in range(len(flat)):
+        if np.all(np.isfinite(flat[index])):
+            try:
+                inv[index] = np.linalg.inv(flat[index])
+            except np.linalg.LinAlgError:
+                pass
+
+    return inv.reshape(A.shape)
+
+
+#This function runs the transient analysis. Takes in the topology, the parameter values
+#(..., numParams), the node to record and the frequency of the input sine wave (amplitude amp on
+#topo.inNode). cycles periods are simulated and points samples are recorded per period (plus the
+#one at time 0), with substeps time steps between samples.
+
+#method: "trap" or "be"
+#maxIter, tol: Newton iterations allowed per time step and the tolerance on the update
+#reuseTol: how far (relative) the jacobian can move before it's factored again. 0 only reuses an
+#identical jacobian
+#sparse: factor with scipy's sparse LU. Only for a single circuit (vals of shape (numParams,))
+#out: array (..., cycles*points + 1) the waveform is written into. One is made if it isn't given
+
+#Returns out and the boolean array of circuits that converged at every step (the waveforms of the
+#ones that didn't are nan from where they failed)
+
+def simulate(topo, vals, node, freq, amp = 1e-3, cycles = 1, points = 100, substeps = 4, method = "trap",
+             maxIter = 50, tol = 1e-9, reuseTol = 1e-2, sparse = False, out = None):
+
+    vals = np.asarray(vals, dtype = float)
+    batch = vals.shape[:-1]
+    n = topo.size
+    row = topo.index(node)
+
+    if topo.vin is None:
+        raise ValueError("the circuit doesn't have the input node " + str(topo.inNode))
+
+    match method:
+        case "be":
+            alpha = 1
+        case "trap":
+            alpha = 2
+        case _:
+            raise ValueError("unknown integration method " + method)
+
+    numSamples = cycles*points + 1
+    if out is None:
+        out = np.empty(batch + (numSamples,))
+    elif out.shape != batch + (numSamples,):
+        raise ValueError("out should have shape " + str(batch + (numSamples,)))
+
+    #start from the operating point. The input source is 0 V there like at time 0
+    x, J, small, ok = MNA.dcSolve(topo, vals)
+    x = np.where(ok[..., None], x, np.nan)
+    out[..., 0] = x[..., row]
+
+    G, b = MNA.linear(topo, vals)
+    Cm = MNA.capacitance(topo, vals, small)
+
+    h = 1/(freq*points*substeps)
+    Ch = alpha/h*Cm[..., :n, :n]
+    linear = G[..., :n, :n] + Ch
+
+    lu = LU(linear + (J[..., :n, :n] - G[..., :n, :n]), sparse)
+
+    #f at the last time point, needed by the trapezoidal rule. The operating point has f = 0
+    fPrev = np.zeros(batch + (n,))
+
+    w = 2*np.pi*freq
+
+    for step in range(cycles*points*substeps):
+
+        t = (step + 1)*h
+        b[..., topo.vin] = amp*np.sin(w*t)
+
+        #history current of the companion models
+        hist = np.einsum("...ij,...j->...i", Ch, x[..., :n])
+        if alpha == 2:
+            hist = hist - fPrev
+
+        #Newton iterations starting from the last time point
+        xn = x.copy()
+        done = ~ok
+
+        for iteration in range(maxIter):
+
+            Jn = G.copy()
+            I, small = MNA.devices(topo, xn, Jn)
+
+            F = np.einsum("...ij,...j->...i", linear, xn[..., :n]) - b[..., :n] + I[..., :n] - hist
+
+            #after a few iterations on an old factorization use the exact jacobian
+            lu.refresh(Jn[..., :n, :n] + Ch, reuseTol if iteration < 3 else 0)
+
+            dx = lu.solve(F)
+            xn[..., :n] -= dx
+
+            Instrument.count("tran.newton")
+
+            done = done | (np.max(np.abs(dx), axis = -1) < tol + 1e-6*np.max(np.abs(xn), axis = -1))
+            if np.all(done):
+                break
+
+        #circuits that didn't converge (or blew up) are dropped from here on
+        ok = ok & done & np.all(np.isfinite(xn), axis = -1)
+        x = np.where(ok[..., None], xn, np.nan)
+
+        #at the solution f = hist - 2*Cm*x/h, so the trapezoidal rule doesn't need another device evaluation
+        fPrev = hist - np.einsum("...ij,...j->...i", Ch, x[..., :n])
+
+        if (step + 1) % substeps == 0:
+            out[..., (step + 1)//substeps] = x[..., row]
+
+    return out, ok
+
+
+#This function does the same thing as Metrics.tran with the transient engine. Takes in the circuit,
+#the frequency of the input, the output node and the number of points to sample. options are passed
+#on to simulate. Returns the dictionary with "p2p", "distortion" and "THD"
+
+def tran(circuit, freq, node, points = 100, inNode = "N5", **options):
+
+    topo = MNA.Topology(circuit, inNode)
+
+    waves, ok = simulate(topo, topo.values(circuit), node, freq, points = points, **options)
+
+    return MNA.unpack(waveStats(waves, freq, points), ok)
+
+
+#measures the last period of a batch of waveforms (..., cycles*points + 1) like Metrics.waveStats:
+#the last two samples are dropped and the rest go to Distortion.sineFit, and the whole period goes
+#to Distortion.measure for the THD. Simulating more than one period lets the coupling capacitors
+#settle before the period that's measured
+
+def waveStats(waves, freq, points):
+
+    times = np.arange(points + 1)/(points*freq)
+    last = waves[..., -(points + 1):].reshape(-1, points + 1)
+
+    with Instrument.timer("distortion"):
+        p2p, distortion = Distortion.sineFit(last[:, :-2], times[:-2], freq)
+        thd = Distortion.measure(last, endpoint = True)["THD"]
+
+    return {"p2p": p2p.reshape(waves.shape[:-1]), "distortion": distortion.reshape(waves.shape[:-1]),
+            "THD": thd.reshape(waves.shape[:-1])}
+
+
+#This function runs the transient analysis on a population of circuits. Circuits are grouped by
+#topology like in MNA.evalPopulation and each group is simulated as one batch, writing every
+#waveform into one preallocated (circuits, cycles*points + 1) array. Returns a list with one
+#dictionary per circuit (the measurements of Metrics.tran) and the array of waveforms.
+
+def evalPopulation(circuits, freq, node, points = 100, cycles = 1, inNode = "N5", **options):
+
+    groups = dict()
+    for index in range(len(circuits)):
+        topo = MNA.Topology(circuits[index], inNode)
+        if topo.key not in groups:
+            groups[topo.key] = (topo, [])
+        groups[topo.key][1].append(index)
+
+    numSamples = cycles*points + 1
+    waves = np.empty((len(circuits), numSamples))
+    results = [None]*len(circuits)
+
+    for topo, members in groups.values():
+
+        vals = np.stack([topo.values(circuits[index]) for index in members])
+
+        #a group that's the whole population writes straight into waves
+        whole = len(members) == len(circuits)
+        out = waves if whole else np.empty((len(members), numSamples))
+
+        with Instrument.timer("tran.native"):
+            out, ok = simulate(topo, vals, node, freq, cycles = cycles, points = points, out = out, **options)
+
+        if not whole:
+            waves[members] = out
+
+        for index, result in zip(members, MNA.unpack(waveStats(out, freq, points), ok)):
+            results[index] = result
+
+    return results, waves